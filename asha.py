@@ -0,0 +1,174 @@
+import argparse
+import json
+import os
+import threading
+
+import sweep
+import train
+
+
+parser = argparse.ArgumentParser(parents=[sweep.parser], add_help=False,
+                                 description='asynchronous successive halving (ASHA) over train.py settings')
+parser.add_argument('--eta', default=3, type=int,
+                    help='reduction factor: the best 1/eta of the runs of a rung are promoted (default: 3)')
+parser.add_argument('--num_rungs', default=3, type=int,
+                    help='number of rungs, the last one being the full --epochs (default: 3)')
+parser.add_argument('--rungs', default=None, type=str,
+                    help='comma separated rung ends as fractions of --epochs, e.g. 0.1,0.5,1 '
+                         '(default: eta ** -k, for k = num_rungs - 1 ... 0)')
+
+
+def rung_epochs(args, epochs):
+    """Epochs at which the runs are compared.
+
+    Rungs are fractions of the full schedule: every run keeps --epochs (and
+    so the learning rate schedule of adjust_learning_rate) and is stopped
+    with --stop_epoch, so a promoted run resumes from its checkpoint exactly
+    where it would have been without the stop.
+    """
+    if args.rungs is not None:
+        fractions = [float(f) for f in args.rungs.split(',')]
+    else:
+        fractions = [args.eta ** -k for k in reversed(range(args.num_rungs))]
+    rungs = sorted(set(max(1, min(epochs, int(round(f * epochs)))) for f in fractions))
+    if rungs[-1] != epochs:
+        rungs.append(epochs)
+    return rungs
+
+
+def rung_result(expname, epoch, epochs):
+    "err1 of a run at the end of a rung, None if it has not got there"
+    if epoch == epochs:
+        result = sweep.read_result(expname)
+        return None if result is None else result['best_err1']
+    path = sweep.run_directory(expname) + 'stop_%d.json' % epoch
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)['err1']
+
+
+class Scheduler(object):
+    """Asynchronous successive halving.
+
+    Whenever a slot is free, the highest rung with a run in its best 1/eta
+    that has not been promoted yet hands that run its next rung; otherwise a
+    new run is started on the first rung. The state is rebuilt from the
+    result files of the runs, so an interrupted search carries on.
+    """
+
+    def __init__(self, expnames, rungs, eta):
+        self.rungs = rungs
+        self.eta = eta
+        self.epochs = rungs[-1]
+        self.results = [{} for _ in rungs]
+        self.promoted = [set() for _ in rungs]
+        self.unstarted = []
+        self.failed = {}
+        self.running = 0
+        self.condition = threading.Condition()
+        for expname in expnames:
+            reached = -1
+            for k, epoch in enumerate(rungs):
+                err1 = rung_result(expname, epoch, self.epochs)
+                if err1 is not None:
+                    self.results[k][expname] = err1
+                    reached = k
+            for k in range(reached):
+                self.promoted[k].add(expname)
+            if reached < 0:
+                self.unstarted.append(expname)
+
+    def _next(self):
+        for k in reversed(range(len(self.rungs) - 1)):
+            done = sorted(self.results[k], key=lambda e: self.results[k][e])
+            for expname in done[:len(done) // self.eta]:
+                if expname not in self.promoted[k]:
+                    self.promoted[k].add(expname)
+                    return expname, k + 1
+        if self.unstarted:
+            return self.unstarted.pop(0), 0
+        return None
+
+    def get(self):
+        "The next (expname, rung index) to run, waiting for running rungs; None when the search is over"
+        with self.condition:
+            while True:
+                job = self._next()
+                if job is not None or self.running == 0:
+                    break
+                self.condition.wait()
+            if job is not None:
+                self.running += 1
+            return job
+
+    def done(self, expname, k, code):
+        "Records the result of a rung; a run that did not get there is reported and not retried"
+        with self.condition:
+            err1 = rung_result(expname, self.rungs[k], self.epochs)
+            if err1 is not None:
+                self.results[k][expname] = err1
+            else:
+                self.failed[expname] = (self.rungs[k], code)
+            self.running -= 1
+            self.condition.notify_all()
+
+    def rung_reached(self, expname):
+        return max([self.rungs[k] for k in range(len(self.rungs)) if expname in self.results[k]] or [0])
+
+    def status(self, expname):
+        if expname in self.failed:
+            return 'failed before epoch %d (exit code %s)' % self.failed[expname]
+        reached = self.rung_reached(expname)
+        if reached == self.epochs:
+            return 'finished'
+        return 'stopped at epoch %d' % reached if reached else 'not started'
+
+
+def main():
+    args = parser.parse_args()
+    expnames, configs, keys = sweep.load_configs(args)
+    config_of = dict(zip(expnames, configs))
+
+    epochs = int(configs[0].get('epochs', train.parser.get_default('epochs')))
+    if any(int(c.get('epochs', epochs)) != epochs for c in configs):
+        raise Exception('all runs of a successive halving search need the same --epochs')
+    rungs = rung_epochs(args, epochs)
+    scheduler = Scheduler(expnames, rungs, args.eta)
+    print('{} runs, rungs at epochs {}, eta {}'.format(len(configs), rungs, args.eta))
+    if args.dry_run:
+        return
+
+    shared_data = sweep.export_shared(args)
+    lock = threading.Lock()
+
+    def worker(slot):
+        while True:
+            job = scheduler.get()
+            if job is None:
+                return
+            expname, k = job
+            with lock:
+                print('start', expname, 'until epoch', rungs[k], 'on', sweep.slot_name(slot))
+            code = None
+            try:
+                code = sweep.run_one(dict(config_of[expname], stop_epoch=rungs[k]), expname, slot, shared_data)
+            finally:
+                scheduler.done(expname, k, code)
+            with lock:
+                print('done ', expname, 'until epoch', rungs[k], 'exit code', code)
+                if expname in scheduler.failed:
+                    print('FAILED', expname, 'see', sweep.run_directory(expname) + 'stdout.log')
+
+    threads = [threading.Thread(target=worker, args=(slot,)) for slot in sweep.slots(args)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    sweep.write_summary(args, expnames, configs, keys,
+                        extra=[('epochs', scheduler.rung_reached), ('status', scheduler.status)])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,289 @@
+import argparse
+import copy
+import itertools
+import json
+import platform
+import sys
+import time
+
+import torch
+import torch.nn.functional as F
+
+import resnet as RN
+import pyramidnet as PYRM
+import mixers
+import train
+
+
+parser = argparse.ArgumentParser(description='throughput benchmark of models, blocks and augmentation processes')
+parser.add_argument('--suites', default=['models', 'blocks', 'mixers'], type=str, nargs='+',
+                    help='what to benchmark (options: models, blocks, mixers, compile)')
+parser.add_argument('--net_types', default=['resnet', 'pyramidnet'], type=str, nargs='+',
+                    help='model families to benchmark')
+parser.add_argument('--depths', default=[20, 56], type=int, nargs='+',
+                    help='network depths to benchmark')
+parser.add_argument('--alphas', default=[48], type=float, nargs='+',
+                    help='PyramidNet alphas to benchmark')
+parser.add_argument('--bottleneck', default='both', type=str, choices=['both', 'yes', 'no'],
+                    help='block types to benchmark')
+parser.add_argument('--dataset', default='cifar100', type=str,
+                    help='dataset the models are built for (default: cifar100)')
+parser.add_argument('-b', '--batch_size', default=32, type=int,
+                    help='mini-batch size (default: 32)')
+parser.add_argument('--warmup', default=2, type=int,
+                    help='untimed iterations before measuring (default: 2)')
+parser.add_argument('--repeat', default=5, type=int,
+                    help='timed iterations (default: 5)')
+parser.add_argument('--threads', default=None, type=int,
+                    help='torch intra-op threads, fixed for comparable numbers')
+parser.add_argument('--device', default='cpu', type=str,
+                    help='device to benchmark on (default: cpu)')
+parser.add_argument('--output', default=None, type=str,
+                    help='write the results as JSON to this path')
+parser.add_argument('--compare', default=None, type=str,
+                    help='baseline JSON to compare against; exits with status 1 on a regression')
+parser.add_argument('--tolerance', default=0.10, type=float,
+                    help='relative slowdown of the median time that counts as a regression (default: 0.10)')
+
+
+def timeit(fn, warmup, repeat, device, setup=None):
+    "Median/min/mean wall time of fn() in milliseconds; setup() runs untimed before each call"
+    def sync():
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+
+    def prepared():
+        if setup is None:
+            return fn
+        state = setup()
+        return lambda: fn(state)
+
+    for _ in range(warmup):
+        prepared()()
+    times = []
+    for _ in range(repeat):
+        run = prepared()
+        sync()
+        start = time.perf_counter()
+        run()
+        sync()
+        times.append((time.perf_counter() - start) * 1000.)
+    times.sort()
+    return {'median_ms': times[len(times) // 2], 'min_ms': times[0],
+            'mean_ms': sum(times) / len(times), 'repeat': repeat}
+
+
+def model_configs(args):
+    bottlenecks = {'both': [False, True], 'yes': [True], 'no': [False]}[args.bottleneck]
+    for net_type, depth, bottleneck in itertools.product(args.net_types, args.depths, bottlenecks):
+        alphas = args.alphas if net_type == 'pyramidnet' else [None]
+        for alpha in alphas:
+            yield net_type, depth, alpha, bottleneck
+
+
+def build_model(net_type, dataset, depth, alpha, bottleneck):
+    numberofclass = {'cifar10': 10, 'cifar100': 100, 'imagenet': 1000}[dataset]
+    if net_type == 'resnet':
+        return RN.ResNet(dataset, depth, numberofclass, bottleneck)
+    elif net_type == 'pyramidnet':
+        return PYRM.PyramidNet(dataset, depth, alpha, numberofclass, bottleneck)
+    raise Exception('unknown network architecture: {}'.format(net_type))
+
+
+def input_size(dataset):
+    return 224 if dataset == 'imagenet' else 32
+
+
+def bench_models(args, device):
+    results = {}
+    size = input_size(args.dataset)
+    input = torch.randn(args.batch_size, 3, size, size, device=device)
+    for net_type, depth, alpha, bottleneck in model_configs(args):
+        model = build_model(net_type, args.dataset, depth, alpha, bottleneck).to(device).train()
+        target = torch.randint(model.fc.out_features, (args.batch_size,), device=device)
+        optimizer = torch.optim.SGD(model.parameters(), 0.1, momentum=0.9, nesterov=True)
+        name = 'model/{}-d{}{}-{}'.format(net_type, depth, '' if alpha is None else '-a%g' % alpha,
+                                          'bottleneck' if bottleneck else 'basic')
+
+        def forward():
+            return F.cross_entropy(model(input), target)
+
+        def step():
+            optimizer.zero_grad()
+            forward().backward()
+            optimizer.step()
+
+        results[name + '/forward'] = timeit(forward, args.warmup, args.repeat, device)
+        results[name + '/backward'] = timeit(lambda loss: loss.backward(), args.warmup, args.repeat, device,
+                                             setup=forward)
+        results[name + '/step'] = timeit(step, args.warmup, args.repeat, device)
+        print_result(name + '/step', results[name + '/step'])
+    return results
+
+
+def bench_blocks(args, device):
+    # (name, block, input channels, size) at CIFAR stage-1 resolution
+    blocks = [
+        ('pyramidnet.BasicBlock', PYRM.BasicBlock(64, 72), 64, 32),
+        ('pyramidnet.Bottleneck', PYRM.Bottleneck(256, 72), 256, 32),
+        ('pyramidnet.BasicBlock-downsample', PYRM.BasicBlock(64, 72, 2, torch.nn.AvgPool2d((2, 2), stride=(2, 2), ceil_mode=True)), 64, 32),
+        ('resnet.BasicBlock', RN.BasicBlock(64, 64), 64, 32),
+        ('resnet.Bottleneck', RN.Bottleneck(256, 64), 256, 32),
+    ]
+    results = {}
+    for name, block, channels, size in blocks:
+        block = block.to(device).train()
+        input = torch.randn(args.batch_size, channels, size, size, device=device, requires_grad=True)
+
+        def forward():
+            return block(input).sum()
+
+        name = 'block/' + name
+        results[name + '/forward'] = timeit(forward, args.warmup, args.repeat, device)
+        results[name + '/backward'] = timeit(lambda out: out.backward(), args.warmup, args.repeat, device,
+                                             setup=forward)
+        print_result(name + '/forward', results[name + '/forward'])
+    return results
+
+
+def mixer_args():
+    "train.py defaults with every process switched on"
+    mix_args = train.parser.parse_args([])
+    mix_args.beta = 1.
+    for name in ['cutout', 'cutmix', 'divmix', 'cutmixup', 'aroundmix', 'fademixup', 'softcutout']:
+        setattr(mix_args, name + '_prob', 1.)
+    mix_args.aroundmix_alpha = 0.05
+    mix_args.softcutout_alpha = 0.5
+    mix_args.fademixup_blend = True
+    return mix_args
+
+
+def bench_mixers(args, device):
+    results = {}
+    size = input_size(args.dataset)
+    mix_args = mixer_args()
+    for per_sample in [False, True]:
+        sampler = mixers.MixSampler(0, per_sample)
+        for process in sorted(mixers.MIXERS):
+            mixer = mixers.MIXERS[process]
+            input = torch.randn(args.batch_size, 3, size, size, device=device)
+            target = torch.randint(100, (args.batch_size,), device=device)
+            name = 'mixer/{}/{}'.format(process, 'per-sample' if per_sample else 'per-batch')
+            results[name] = timeit(lambda: mixer(input, target, mix_args, sampler),
+                                   args.warmup, args.repeat, device)
+            print_result(name, results[name])
+
+            # forward and backward of the mixed-target loss over 100-class logits
+            logits = torch.randn(args.batch_size, 100, device=device, requires_grad=True)
+            _, mixed_target = mixer(input, target, mix_args, sampler)
+            results[name + '/loss'] = timeit(lambda: mixers.mixed_loss(logits, mixed_target).backward(),
+                                             args.warmup, args.repeat, device)
+    return results
+
+
+def bench_compile(args, device):
+    """Checks the compiled training step (forward, mixed loss, backward) and the
+    scripted eval model against eager mode, then times eager and compiled steps"""
+    results = {}
+    size = input_size(args.dataset)
+    input = torch.randn(args.batch_size, 3, size, size, device=device)
+    compiled_loss = torch.compile(train.forward_loss)
+    for net_type, depth, alpha, bottleneck in model_configs(args):
+        eager = build_model(net_type, args.dataset, depth, alpha, bottleneck).to(device).train()
+        compiled = copy.deepcopy(eager)
+        target = torch.randint(eager.fc.out_features, (args.batch_size,), device=device)
+        lam = torch.rand(args.batch_size, device=device)
+        mixed_target = [(target, lam), (target.flip(0), 1. - lam)]
+        name = 'compile/{}-d{}{}-{}'.format(net_type, depth, '' if alpha is None else '-a%g' % alpha,
+                                            'bottleneck' if bottleneck else 'basic')
+
+        def step(model, loss_fn):
+            model.zero_grad(set_to_none=True)
+            output, loss = loss_fn(model, input, mixed_target)
+            loss.backward()
+            return output, loss
+
+        # one step from the same weights and batch norm statistics
+        output, loss = step(eager, train.forward_loss)
+        compiled_output, compiled_loss_value = step(compiled, compiled_loss)
+        pairs = [(output, compiled_output), (loss, compiled_loss_value)]
+        pairs += [(p.grad, q.grad) for p, q in zip(eager.parameters(), compiled.parameters())]
+        for a, b in pairs:
+            if not torch.allclose(a, b, rtol=1e-3, atol=1e-4):
+                raise Exception('{}: compiled step differs from eager (max abs diff {:.3g})'.format(
+                    name, (a - b).abs().max().item()))
+
+        with torch.no_grad():
+            model = eager.eval()
+            if not torch.allclose(torch.jit.script(model)(input), model(input), rtol=1e-4, atol=1e-5):
+                raise Exception('{}: scripted model differs from eager'.format(name))
+            model.train()
+
+        results[name + '/eager'] = timeit(lambda: step(eager, train.forward_loss), args.warmup, args.repeat, device)
+        results[name + '/compiled'] = timeit(lambda: step(compiled, compiled_loss), args.warmup, args.repeat, device)
+        print_result(name + '/eager', results[name + '/eager'])
+        print_result(name + '/compiled', results[name + '/compiled'])
+    return results
+
+
+def print_result(name, result):
+    print('{:<60} {:>10.3f} ms'.format(name, result['median_ms']))
+
+
+def compare(results, baseline, tolerance):
+    "Prints the median-time ratios against a baseline and returns the regressed names"
+    regressions = []
+    print('{:<60} {:>10} {:>10} {:>8}'.format('benchmark', 'base (ms)', 'now (ms)', 'ratio'))
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        base = baseline[name]['median_ms']
+        now = results[name]['median_ms']
+        ratio = now / base if base > 0 else float('inf')
+        flag = ''
+        if ratio > 1. + tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('{:<60} {:>10.3f} {:>10.3f} {:>8.2f}{}'.format(name, base, now, ratio, flag))
+    return regressions
+
+
+def main():
+    args = parser.parse_args()
+    device = torch.device(args.device)
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+
+    suites = {'models': bench_models, 'blocks': bench_blocks, 'mixers': bench_mixers, 'compile': bench_compile}
+    results = {}
+    for suite in args.suites:
+        if suite not in suites:
+            raise Exception('unknown benchmark suite: {}'.format(suite))
+        results.update(suites[suite](args, device))
+
+    report = {
+        'meta': {
+            'torch': torch.__version__,
+            'device': str(device),
+            'threads': torch.get_num_threads(),
+            'batch_size': args.batch_size,
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print('{} regression(s) over {:.0%}'.format(len(regressions), args.tolerance))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
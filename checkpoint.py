@@ -0,0 +1,87 @@
+import os
+import queue
+import shutil
+import threading
+
+import torch
+
+
+def snapshot(state):
+    "Copies every tensor in a (nested) checkpoint state to host memory"
+    if torch.is_tensor(state):
+        return state.detach().to('cpu', copy=True)
+    if isinstance(state, dict):
+        return type(state)((k, snapshot(v)) for k, v in state.items())
+    if isinstance(state, (list, tuple)):
+        return type(state)(snapshot(v) for v in state)
+    return state
+
+
+def atomic_save(state, filename):
+    "torch.save to a temporary file in the same directory, then rename over filename"
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        torch.save(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, filename)
+
+
+def atomic_link(src, dst):
+    "Points dst at the current contents of src, hard-linking when the filesystem allows it"
+    tmp = dst + '.tmp'
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+class CheckpointWriter(object):
+    """Writes checkpoints from a background thread.
+
+    save() snapshots the state to host memory and returns; the write is
+    committed with a write-temp-then-rename, so a crash never leaves a
+    truncated checkpoint behind. At most max_pending saves are in flight,
+    further calls block until one of them is written.
+    """
+
+    def __init__(self, max_pending=1):
+        self.slots = threading.Semaphore(max(1, max_pending))
+        self.pending = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self._worker, daemon=True)
+        self.thread.start()
+
+    def save(self, state, filename, best_filename=None):
+        self._raise_error()
+        self.slots.acquire()
+        self.pending.put((snapshot(state), filename, best_filename))
+
+    def close(self):
+        "Waits for the pending saves and stops the writer"
+        self.pending.put(None)
+        self.thread.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _worker(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            state, filename, best_filename = item
+            try:
+                atomic_save(state, filename)
+                if best_filename is not None:
+                    atomic_link(filename, best_filename)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.slots.release()
@@ -0,0 +1,71 @@
+import math
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+
+class DeviceCIFARLoader(object):
+    """Batches of a CIFAR split kept on the device as one uint8 tensor.
+
+    Replaces DataLoader + RandomCrop/RandomHorizontalFlip/ToTensor/Normalize:
+    shuffling, padding-crop, flip and normalization are batched tensor ops on
+    the device, so there are no worker processes and no per-sample PIL work.
+    """
+
+    def __init__(self, dataset, batch_size, device, train=True, shuffle=True,
+                 padding=4, mean=(0., 0., 0.), std=(1., 1., 1.), seed=None):
+        # one writable copy, the data of SharedCIFAR is a read-only memory map
+        self.data = torch.from_numpy(np.array(dataset.data)).permute(0, 3, 1, 2).contiguous().to(device)
+        self.targets = torch.as_tensor(dataset.targets, dtype=torch.long).to(device)
+        self.batch_size = batch_size
+        self.device = self.data.device
+        self.train = train
+        self.shuffle = shuffle
+        self.padding = padding
+
+        # ToTensor scales to [0, 1] before Normalize, fold that into mean and std
+        self.mean = torch.tensor(mean, device=self.device).view(1, -1, 1, 1) * 255.
+        self.std = torch.tensor(std, device=self.device).view(1, -1, 1, 1) * 255.
+
+        self.generator = torch.Generator(device=self.device)
+        if seed is None:
+            self.generator.seed()
+        else:
+            self.generator.manual_seed(seed)
+
+    def __len__(self):
+        return int(math.ceil(self.data.size(0) / float(self.batch_size)))
+
+    def __iter__(self):
+        n = self.data.size(0)
+        if self.shuffle:
+            order = torch.randperm(n, generator=self.generator, device=self.device)
+        else:
+            order = torch.arange(n, device=self.device)
+
+        for start in range(0, n, self.batch_size):
+            index = order[start:start + self.batch_size]
+            input = self.data[index]
+            if self.train:
+                input = self.crop_flip(input)
+            input = (input.float() - self.mean) / self.std
+            yield input, self.targets[index]
+
+    def crop_flip(self, input):
+        "Zero-padded random crop and random horizontal flip in one gather"
+        n, c, h, w = input.size()
+        p = self.padding
+        padded = F.pad(input, (p, p, p, p))
+
+        offset_y = torch.randint(2 * p + 1, (n, 1), generator=self.generator, device=self.device)
+        offset_x = torch.randint(2 * p + 1, (n, 1), generator=self.generator, device=self.device)
+        flip = torch.rand(n, 1, generator=self.generator, device=self.device) < 0.5
+
+        rows = offset_y + torch.arange(h, device=self.device).view(1, -1)
+        cols = torch.arange(w, device=self.device).view(1, -1)
+        cols = offset_x + torch.where(flip, w - 1 - cols, cols)
+
+        batch = torch.arange(n, device=self.device).view(-1, 1, 1, 1)
+        channel = torch.arange(c, device=self.device).view(1, -1, 1, 1)
+        return padded[batch, channel, rows.view(n, 1, h, 1), cols.view(n, 1, 1, w)]
@@ -0,0 +1,244 @@
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import torch
+import torch.utils.data
+import torchvision.transforms as transforms
+from PIL import Image
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.ppm', '.bmp', '.webp')
+
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+
+def find_images(root):
+    "(classes, [(path, label), ...]) of an ImageFolder-style tree root/<class>/<image>"
+    classes = sorted(d for d in os.listdir(root) if os.path.isdir(os.path.join(root, d)))
+    samples = []
+    for label, name in enumerate(classes):
+        for directory, _, files in sorted(os.walk(os.path.join(root, name))):
+            for f in sorted(files):
+                if f.lower().endswith(IMAGE_EXTENSIONS):
+                    samples.append((os.path.join(directory, f), label))
+    return classes, samples
+
+
+def resize_encode(job):
+    "JPEG bytes of an image resized so that its shorter side is size"
+    path, size, quality = job
+    with Image.open(path) as img:
+        img = img.convert('RGB')
+        scale = size / min(img.size)
+        if scale < 1:
+            img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.BILINEAR)
+        out = io.BytesIO()
+        img.save(out, format='JPEG', quality=quality)
+    return out.getvalue()
+
+
+def convert(src, dst, size=256, shard_mb=256, quality=90, workers=8):
+    """Packs the images of src/<class>/* into dst/shard_<n>.bin files of at most
+    shard_mb MB. The images are resized to size on the shorter side and
+    re-encoded once. dst/index.npy has a (shard, offset, length, label) row per
+    sample and dst/classes.json the class names."""
+    classes, samples = find_images(src)
+    if not samples:
+        raise Exception('no images found under {}'.format(src))
+    if not os.path.exists(dst):
+        os.makedirs(dst)
+
+    index = np.zeros((len(samples), 4), dtype=np.int64)
+    limit = shard_mb * 1024 * 1024
+    shard, offset, f = 0, 0, None
+    jobs = [(path, size, quality) for path, _ in samples]
+    with multiprocessing.Pool(workers) as pool:
+        for i, data in enumerate(pool.imap(resize_encode, jobs, chunksize=64)):
+            if f is None or (offset > 0 and offset + len(data) > limit):
+                if f is not None:
+                    f.close()
+                    shard += 1
+                f = open(os.path.join(dst, 'shard_%05d.bin' % shard), 'wb')
+                offset = 0
+            f.write(data)
+            index[i] = (shard, offset, len(data), samples[i][1])
+            offset += len(data)
+    f.close()
+
+    # the index is written last, it marks the conversion as complete
+    with open(os.path.join(dst, 'classes.json'), 'w') as f:
+        json.dump(classes, f)
+    np.save(os.path.join(dst, 'index.npy'), index)
+    return dst
+
+
+class ShardedImageFolder(torch.utils.data.Dataset):
+    """Samples of a convert() directory, decoded on access.
+
+    Shards are memory-mapped lazily in every loader worker, so reading a
+    sample is a slice of the page cache; with ShardSampler the reads of a
+    worker walk through the shards sequentially.
+    """
+
+    def __init__(self, directory, transform=None):
+        self.directory = directory
+        self.transform = transform
+        self.index = np.load(os.path.join(directory, 'index.npy'))
+        with open(os.path.join(directory, 'classes.json')) as f:
+            self.classes = json.load(f)
+        self.targets = self.index[:, 3]
+        self._shards = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getstate__(self):
+        # memory maps are opened again in every worker
+        state = dict(self.__dict__)
+        state['_shards'] = {}
+        return state
+
+    def _shard(self, shard):
+        data = self._shards.get(shard)
+        if data is None:
+            data = np.memmap(os.path.join(self.directory, 'shard_%05d.bin' % shard), dtype=np.uint8, mode='r')
+            self._shards[shard] = data
+        return data
+
+    def __getitem__(self, i):
+        shard, offset, length, label = self.index[i]
+        data = self._shard(int(shard))[offset:offset + length]
+        img = Image.open(io.BytesIO(data.tobytes())).convert('RGB')
+        if self.transform is not None:
+            img = self.transform(img)
+        return img, int(label)
+
+
+class ShardSampler(torch.utils.data.Sampler):
+    """Shuffles the order of the shards and the samples within each shard.
+
+    Consecutive indices (and so the batches of a loader worker) come from
+    the same shard, which keeps the reads sequential. With num_replicas > 1
+    every process takes an equal contiguous part of the shuffled order, so
+    it reads its own run of shards (sharing at most the ones at the edges
+    of its part) and no sample is given to two processes; the last
+    len(dataset) % num_replicas samples of the order are dropped. Without
+    shuffle (evaluation) the samples, in shard order, are split into
+    contiguous parts that cover every sample exactly once; the parts may
+    differ in length by one.
+    """
+
+    def __init__(self, dataset, shuffle=True, num_replicas=1, rank=0, seed=0):
+        self.shards = [np.flatnonzero(dataset.index[:, 0] == s) for s in np.unique(dataset.index[:, 0])]
+        self.shuffle = shuffle
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.epoch = 0
+        if shuffle:
+            self.num_samples = len(dataset) // num_replicas
+        else:
+            self.begin = len(dataset) * rank // num_replicas
+            self.num_samples = len(dataset) * (rank + 1) // num_replicas - self.begin
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        if not self.shuffle:
+            indices = np.concatenate(self.shards) if self.shards else np.zeros(0, dtype=np.int64)
+            return iter(indices[self.begin:self.begin + self.num_samples].tolist())
+        # the same order in every process, split by samples rather than by
+        # shards so that uneven or too few shards still fill every part
+        rng = np.random.RandomState(self.seed + self.epoch)
+        order = [rng.permutation(self.shards[s]) for s in rng.permutation(len(self.shards))]
+        indices = np.concatenate(order) if order else np.zeros(0, dtype=np.int64)
+        begin = self.rank * self.num_samples
+        return iter(indices[begin:begin + self.num_samples].tolist())
+
+    def __len__(self):
+        return self.num_samples
+
+
+def imagenet_transforms(crop=224, resize=256):
+    normalize = transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD)
+    transform_train = transforms.Compose([
+        transforms.RandomResizedCrop(crop),
+        transforms.RandomHorizontalFlip(),
+        transforms.ToTensor(),
+        normalize,
+    ])
+    transform_test = transforms.Compose([
+        transforms.Resize(resize),
+        transforms.CenterCrop(crop),
+        transforms.ToTensor(),
+        normalize,
+    ])
+    return transform_train, transform_test
+
+
+def synthetic_tree(root, classes=10, images=20, size=(320, 240), seed=0):
+    "A small ImageFolder tree of random JPEG images, root/{train,val}/<class>/<n>.jpg"
+    rng = np.random.RandomState(seed)
+    for split, count in (('train', images), ('val', max(1, images // 4))):
+        for c in range(classes):
+            directory = os.path.join(root, split, 'class_%03d' % c)
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            for n in range(count):
+                pixels = rng.randint(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+                Image.fromarray(pixels).save(os.path.join(directory, '%d.jpg' % n))
+    return root
+
+
+def main():
+    parser = argparse.ArgumentParser(description='pre-decoded, sharded ImageNet storage')
+    sub = parser.add_subparsers(dest='command')
+    p = sub.add_parser('convert', help='pack <src>/{train,val}/<class>/* into shards under <dst>/{train,val}')
+    p.add_argument('src')
+    p.add_argument('dst')
+    p.add_argument('--size', default=256, type=int, help='shorter side of the stored images (default: 256)')
+    p.add_argument('--shard_mb', default=256, type=int, help='maximum size of a shard in MB (default: 256)')
+    p.add_argument('--quality', default=90, type=int, help='JPEG quality of the stored images (default: 90)')
+    p.add_argument('--workers', default=8, type=int, help='number of encoding processes (default: 8)')
+    p = sub.add_parser('synthetic', help='write a small tree of random images to <root>')
+    p.add_argument('root')
+    p.add_argument('--classes', default=10, type=int)
+    p.add_argument('--images', default=20, type=int, help='training images per class')
+    p = sub.add_parser('check', help='read a converted split back through the training pipeline')
+    p.add_argument('directory')
+    p.add_argument('--batch_size', default=64, type=int)
+    p.add_argument('--workers', default=4, type=int)
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        for split in ('train', 'val'):
+            begin = time.time()
+            convert(os.path.join(args.src, split), os.path.join(args.dst, split),
+                    args.size, args.shard_mb, args.quality, args.workers)
+            print('{}: converted in {:.1f}s'.format(split, time.time() - begin))
+    elif args.command == 'synthetic':
+        synthetic_tree(args.root, args.classes, args.images)
+    elif args.command == 'check':
+        transform_train, _ = imagenet_transforms()
+        dataset = ShardedImageFolder(args.directory, transform_train)
+        loader = torch.utils.data.DataLoader(dataset, batch_size=args.batch_size, sampler=ShardSampler(dataset),
+                                             num_workers=args.workers)
+        begin = time.time()
+        count = 0
+        for input, target in loader:
+            count += input.size(0)
+        print('{} samples, {} classes, {:.1f} samples/s'.format(
+            count, len(dataset.classes), count / (time.time() - begin)))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+import argparse
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+import resnet as RN
+import pyramidnet as PYRM
+
+
+parser = argparse.ArgumentParser(description='export a trained checkpoint for inference')
+parser.add_argument('checkpoint', type=str,
+                    help='path to a checkpoint written by train.py (e.g. runs/TEST/model_best.pth.tar)')
+parser.add_argument('--net_type', default='pyramidnet', type=str,
+                    help='networktype: resnet, and pyamidnet')
+parser.add_argument('--dataset', default='cifar100', type=str,
+                    help='dataset (options: cifar10, cifar100, and imagenet)')
+parser.add_argument('--depth', default=32, type=int,
+                    help='depth of the network (default: 32)')
+parser.add_argument('--alpha', default=300, type=float,
+                    help='number of new channel increases per depth (default: 300)')
+parser.add_argument('--no-bottleneck', dest='bottleneck', action='store_false',
+                    help='to use basicblock for CIFAR datasets (default: bottleneck)')
+parser.add_argument('--export', default=None, type=str,
+                    help='write the folded model as TorchScript to this path')
+parser.set_defaults(bottleneck=True)
+
+
+# (conv, bn) attribute pairs where the BatchNorm directly follows the convolution
+FOLD_PAIRS = {
+    PYRM.PyramidNet: [('conv1', 'bn1')],
+    PYRM.BasicBlock: [('conv1', 'bn2'), ('conv2', 'bn3')],
+    PYRM.Bottleneck: [('conv1', 'bn2'), ('conv2', 'bn3'), ('conv3', 'bn4')],
+    RN.ResNet: [('conv1', 'bn1')],
+    RN.BasicBlock: [('conv1', 'bn1'), ('conv2', 'bn2')],
+    RN.Bottleneck: [('conv1', 'bn1'), ('conv2', 'bn2'), ('conv3', 'bn3')],
+}
+
+
+def strip_prefix(state_dict, prefix='module.'):
+    "Removes the DataParallel/DistributedDataParallel prefix from the keys"
+    return {(k[len(prefix):] if k.startswith(prefix) else k): v for k, v in state_dict.items()}
+
+
+def load_model(path, net_type, dataset, depth, alpha=300, bottleneck=True):
+    "Rebuilds the model of a train.py checkpoint on the CPU, in eval mode"
+    checkpoint = torch.load(path, map_location='cpu')
+    state_dict = strip_prefix(checkpoint.get('state_dict', checkpoint))
+    numberofclass = state_dict['fc.weight'].size(0)
+
+    if net_type == 'resnet':
+        model = RN.ResNet(dataset, depth, numberofclass, bottleneck)
+    elif net_type == 'pyramidnet':
+        model = PYRM.PyramidNet(dataset, depth, alpha, numberofclass, bottleneck)
+    else:
+        raise Exception('unknown network architecture: {}'.format(net_type))
+
+    model.load_state_dict(state_dict)
+    return model.eval()
+
+
+def fold_conv_bn(conv, bn):
+    "Folds an eval-mode BatchNorm into the weights and bias of the convolution before it"
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    bias = conv.bias if conv.bias is not None else torch.zeros_like(bn.running_mean)
+
+    conv.weight = nn.Parameter(conv.weight * scale.view(-1, 1, 1, 1))
+    conv.bias = nn.Parameter((bias - bn.running_mean) * scale + bn.bias)
+
+
+def fold_batchnorms(model):
+    """Folds every BatchNorm that directly follows a convolution and replaces it
+    with nn.Identity. BatchNorms in front of a convolution are left as they are."""
+    with torch.no_grad():
+        for module in list(model.modules()):
+            pairs = list(FOLD_PAIRS.get(type(module), []))
+            if isinstance(module, nn.Sequential):
+                names = list(module._modules)
+                pairs += [(a, b) for a, b in zip(names, names[1:])
+                          if isinstance(module._modules[a], nn.Conv2d)
+                          and isinstance(module._modules[b], nn.BatchNorm2d)]
+            for conv_name, bn_name in pairs:
+                bn = getattr(module, bn_name)
+                if isinstance(bn, nn.BatchNorm2d):
+                    fold_conv_bn(getattr(module, conv_name), bn)
+                    setattr(module, bn_name, nn.Identity())
+    return model
+
+
+class Predictor(object):
+    """Batched top-k prediction with a folded model.
+
+    predict() takes a normalized (batch, 3, h, w) tensor and returns the top-k
+    probabilities and class indices, each of shape (batch, topk).
+    """
+
+    def __init__(self, model, device='cpu', topk=5):
+        self.device = torch.device(device)
+        self.model = fold_batchnorms(model.eval()).to(self.device)
+        self.topk = topk
+
+    @classmethod
+    def from_checkpoint(cls, path, net_type, dataset, depth, alpha=300, bottleneck=True, device='cpu', topk=5):
+        return cls(load_model(path, net_type, dataset, depth, alpha, bottleneck), device, topk)
+
+    def predict(self, batch):
+        with torch.inference_mode():
+            output = self.model(batch.to(self.device, non_blocking=True))
+            prob = F.softmax(output.float(), dim=1)
+            return prob.topk(min(self.topk, prob.size(1)), dim=1)
+
+
+def main():
+    args = parser.parse_args()
+    predictor = Predictor.from_checkpoint(args.checkpoint, args.net_type, args.dataset,
+                                          args.depth, args.alpha, args.bottleneck)
+    print('folded model loaded from', args.checkpoint)
+
+    if args.export is not None:
+        size = 224 if args.dataset == 'imagenet' else 32
+        example = torch.randn(1, 3, size, size)
+        scripted = torch.jit.script(predictor.model)
+        with torch.no_grad():
+            # the scripted model must agree with the eager one
+            if not torch.allclose(scripted(example), predictor.model(example), rtol=1e-4, atol=1e-5):
+                raise Exception('scripted model differs from the eager model')
+        scripted.save(args.export)
+        print('TorchScript model written to', args.export)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+import torch
+import torch.optim as optim
+
+
+class LARS(optim.Optimizer):
+    """SGD with momentum and layer-wise adaptive rate scaling (You et al., 2017).
+
+    The update of every parameter of a group with lars=True is rescaled by
+    the trust ratio eta * ||w|| / ||g + weight_decay * w||, so that layers
+    with small weights are not blown away by the large learning rates of
+    large-batch training. Groups with lars=False (biases and batch norm,
+    see param_groups) are plain momentum SGD. The ratio stays on the device.
+    """
+
+    def __init__(self, params, lr, momentum=0.9, weight_decay=0, eta=0.001, nesterov=False):
+        defaults = dict(lr=lr, momentum=momentum, weight_decay=weight_decay, eta=eta,
+                        nesterov=nesterov, lars=True)
+        super(LARS, self).__init__(params, defaults)
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        for group in self.param_groups:
+            for p in group['params']:
+                if p.grad is None:
+                    continue
+                d_p = p.grad
+                if group['weight_decay'] != 0:
+                    d_p = d_p.add(p, alpha=group['weight_decay'])
+                if group['lars']:
+                    w_norm = torch.norm(p)
+                    g_norm = torch.norm(d_p)
+                    trust = torch.where((w_norm > 0) & (g_norm > 0),
+                                        group['eta'] * w_norm / g_norm, torch.ones_like(w_norm))
+                    d_p = d_p.mul(trust)
+
+                state = self.state[p]
+                buf = state.get('momentum_buffer')
+                if buf is None:
+                    buf = state['momentum_buffer'] = torch.clone(d_p).detach()
+                else:
+                    buf.mul_(group['momentum']).add_(d_p)
+                d_p = d_p.add(buf, alpha=group['momentum']) if group['nesterov'] else buf
+                p.add_(d_p, alpha=-group['lr'])
+
+        return loss
+
+
+def param_groups(model, weight_decay):
+    "LARS groups: weights are adapted and decayed, biases and batch norm parameters are not"
+    adapted, plain = [], []
+    for p in model.parameters():
+        if p.requires_grad:
+            (adapted if p.dim() > 1 else plain).append(p)
+    return [{'params': adapted, 'weight_decay': weight_decay, 'lars': True},
+            {'params': plain, 'weight_decay': 0., 'lars': False}]
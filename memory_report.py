@@ -0,0 +1,96 @@
+import argparse
+import time
+
+import torch
+
+import resnet as RN
+import pyramidnet as PYRM
+
+
+parser = argparse.ArgumentParser(description='activation checkpointing memory/time report')
+parser.add_argument('--net_type', default='pyramidnet', type=str,
+                    help='networktype: resnet, and pyamidnet')
+parser.add_argument('--dataset', default='cifar100', type=str,
+                    help='dataset (options: cifar10, cifar100, and imagenet)')
+parser.add_argument('--depth', default=110, type=int,
+                    help='depth of the network (default: 110)')
+parser.add_argument('--alpha', default=270, type=float,
+                    help='number of new channel increases per depth (default: 270)')
+parser.add_argument('--no-bottleneck', dest='bottleneck', action='store_false',
+                    help='to use basicblock for CIFAR datasets (default: bottleneck)')
+parser.add_argument('-b', '--batch_size', default=64, type=int,
+                    help='mini-batch size (default: 64)')
+parser.add_argument('--modes', default=[0, 1, 4], type=int, nargs='+',
+                    help='checkpoint_blocks settings to compare, 0 disables checkpointing (default: 0 1 4)')
+parser.add_argument('--repeat', default=3, type=int,
+                    help='number of timed forward/backward passes (default: 3)')
+parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu', type=str,
+                    help='device to measure on')
+parser.set_defaults(bottleneck=True)
+
+
+def build_model(args, checkpoint_blocks):
+    numberofclass = {'cifar10': 10, 'cifar100': 100, 'imagenet': 1000}[args.dataset]
+    if args.net_type == 'resnet':
+        return RN.ResNet(args.dataset, args.depth, numberofclass, args.bottleneck, checkpoint_blocks)
+    elif args.net_type == 'pyramidnet':
+        return PYRM.PyramidNet(args.dataset, args.depth, args.alpha, numberofclass, args.bottleneck, checkpoint_blocks)
+    raise Exception('unknown network architecture: {}'.format(args.net_type))
+
+
+def saved_bytes(model, input, target):
+    "Bytes of the tensors autograd keeps alive for backward after one forward pass"
+    seen = {}
+
+    def pack(t):
+        seen[(t.data_ptr(), t.numel())] = t.numel() * t.element_size()
+        return t
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+        loss = torch.nn.functional.cross_entropy(model(input), target)
+    loss.backward()
+    return sum(seen.values())
+
+
+def step_time(model, input, target, repeat, device):
+    def sync():
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+
+    # warmup
+    torch.nn.functional.cross_entropy(model(input), target).backward()
+    sync()
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(device)
+    start = time.time()
+    for _ in range(repeat):
+        model.zero_grad()
+        torch.nn.functional.cross_entropy(model(input), target).backward()
+    sync()
+    elapsed = (time.time() - start) / repeat
+    peak = torch.cuda.max_memory_allocated(device) if device.type == 'cuda' else None
+    return elapsed, peak
+
+
+def main():
+    args = parser.parse_args()
+    device = torch.device(args.device)
+    size = 224 if args.dataset == 'imagenet' else 32
+    input = torch.randn(args.batch_size, 3, size, size, device=device)
+    target = torch.randint(10, (args.batch_size,), device=device)
+
+    print('{:>18} {:>16} {:>14} {:>14}'.format('checkpoint_blocks', 'saved act (MB)', 'peak (MB)', 'step (ms)'))
+    for blocks in args.modes:
+        torch.manual_seed(0)
+        model = build_model(args, blocks).to(device)
+        model.train()
+        saved = saved_bytes(model, input, target)
+        elapsed, peak = step_time(model, input, target, args.repeat, device)
+        print('{:>18} {:>16.1f} {:>14} {:>14.1f}'.format(
+            blocks if blocks > 0 else 'off', saved / 2.0 ** 20,
+            'n/a' if peak is None else '{:.1f}'.format(peak / 2.0 ** 20), elapsed * 1000))
+        del model
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import csv
+import json
+import os
+import threading
+import time
+
+import torch
+
+
+class MetricsSink(object):
+    """Buffers metric records and writes them from a background thread.
+
+    log(kind, **fields) only appends to an in-memory buffer, so it is cheap
+    enough for the training loop; tensor values are converted to numbers by
+    the writer thread, which keeps device syncs off the main thread. Records
+    of each kind go to <directory>/<kind>.jsonl or <directory>/<kind>.csv.
+    A sink without a directory drops everything.
+    """
+
+    def __init__(self, directory=None, fmt='jsonl', flush_interval=5.):
+        if fmt not in ('jsonl', 'csv'):
+            raise Exception('unknown metrics format: {}'.format(fmt))
+        self.directory = directory
+        self.fmt = fmt
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.files = {}
+        self.writers = {}
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+        self.thread = None
+        if directory is not None:
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            self.thread = threading.Thread(target=self._worker, daemon=True)
+            self.thread.start()
+
+    @property
+    def enabled(self):
+        return self.thread is not None
+
+    def log(self, kind, **fields):
+        if self.thread is None:
+            return
+        fields = {k: v.detach() if torch.is_tensor(v) else v for k, v in fields.items()}
+        fields['time'] = time.time()
+        with self.lock:
+            self.buffer.append((kind, fields))
+
+    def close(self):
+        if self.thread is None:
+            return
+        self.closed.set()
+        self.thread.join()
+        self.thread = None
+        for f in self.files.values():
+            f.close()
+
+    def _worker(self):
+        while not self.closed.wait(self.flush_interval):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        with self.lock:
+            records, self.buffer = self.buffer, []
+        for kind, fields in records:
+            self._write(kind, {k: _number(v) for k, v in fields.items()})
+        for f in self.files.values():
+            f.flush()
+
+    def _write(self, kind, record):
+        f = self.files.get(kind)
+        if f is None:
+            f = open(os.path.join(self.directory, '{}.{}'.format(kind, self.fmt)), 'a')
+            self.files[kind] = f
+        if self.fmt == 'jsonl':
+            f.write(json.dumps(record) + '\n')
+            return
+        writer = self.writers.get(kind)
+        if writer is None:
+            writer = csv.DictWriter(f, fieldnames=list(record), extrasaction='ignore')
+            if f.tell() == 0:
+                writer.writeheader()
+            self.writers[kind] = writer
+        writer.writerow(record)
+
+
+def _number(value):
+    if torch.is_tensor(value):
+        return value.detach().float().item()
+    return value
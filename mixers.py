@@ -0,0 +1,344 @@
+import math
+
+import torch
+import torch.nn.functional as F
+
+
+MIXERS = {}
+
+
+def register_mixer(name):
+    "Registers a data augmentation process under the given --process name"
+    def decorator(fn):
+        MIXERS[name] = fn
+        return fn
+    return decorator
+
+
+def get_mixer(name):
+    if name not in MIXERS:
+        raise Exception('unknown data augmentation process: {}'.format(name))
+    return MIXERS[name]
+
+
+def mixed_loss(output, mixed_target):
+    """Weighted cross-entropy over a list of (target, weight) pairs.
+
+    Weights are either python floats or per-sample tensors of shape (batch,).
+    The log-softmax is computed once and every target only gathers its
+    column, instead of a full cross-entropy pass (and its backward) per pair;
+    the result is the sum over pairs of mean(weight * cross_entropy(output, target)).
+    """
+    log_prob = F.log_softmax(output, dim=1)
+    picked = log_prob.gather(1, torch.stack([target for target, _ in mixed_target], dim=1))
+    loss = 0
+    for k, (_, weight) in enumerate(mixed_target):
+        loss = loss + weight * picked[:, k]
+    return -loss.mean()
+
+
+class MixSampler(object):
+    """Draws the randomness of the augmentation processes on the input's device.
+
+    Every draw comes from a seeded torch.Generator living on that device, so
+    there is no host RNG and no host<->device transfer on the training step.
+    With per_sample=False a single value is drawn and broadcast over the batch,
+    which matches the behaviour of the original per-batch processes.
+    """
+
+    def __init__(self, seed=None, per_sample=False):
+        self.seed = seed
+        self.per_sample = per_sample
+        self._generators = {}
+
+    def generator(self, device):
+        device = torch.device(device)
+        g = self._generators.get(device)
+        if g is None:
+            g = torch.Generator(device=device)
+            if self.seed is None:
+                g.seed()
+            else:
+                g.manual_seed(self.seed)
+            self._generators[device] = g
+        return g
+
+    def _draws(self, n):
+        return n if self.per_sample else 1
+
+    def rand(self, n, device):
+        u = torch.rand(self._draws(n), generator=self.generator(device), device=device)
+        return u.expand(n)
+
+    def randint(self, high, n, device):
+        r = torch.randint(high, (self._draws(n),), generator=self.generator(device), device=device)
+        return r.expand(n)
+
+    def randperm(self, n, device):
+        return torch.randperm(n, generator=self.generator(device), device=device)
+
+    def beta(self, alpha, n, device):
+        "Symmetric Beta(alpha, alpha) samples, or ones if alpha <= 0"
+        if alpha <= 0:
+            return torch.ones(n, device=device)
+        shape = (self._draws(n),)
+        x = self._standard_gamma(alpha, shape, device)
+        y = self._standard_gamma(alpha, shape, device)
+        return (x / (x + y)).expand(n)
+
+    def _standard_gamma(self, concentration, shape, device, rounds=8):
+        # Marsaglia-Tsang with a fixed number of vectorized proposal rounds,
+        # so that no data-dependent loop (and hence no host sync) is needed.
+        g = self.generator(device)
+        a = concentration + 1. if concentration < 1 else concentration
+        d = a - 1. / 3.
+        c = 1. / math.sqrt(9. * d)
+
+        z = torch.randn((rounds,) + shape, generator=g, device=device)
+        u = torch.rand((rounds,) + shape, generator=g, device=device)
+        v = (1. + c * z) ** 3
+        log_v = torch.log(v.clamp(min=1e-30))
+        accept = (v > 0) & (torch.log(u) < 0.5 * z * z + d - d * v + d * log_v)
+
+        first = accept.float().argmax(0, keepdim=True)
+        sample = d * v.gather(0, first).squeeze(0)
+        # the chance of rejecting every round is negligible; fall back to the mode
+        sample = torch.where(accept.any(0), sample, torch.full_like(sample, d))
+
+        if concentration < 1:
+            boost = torch.rand(shape, generator=g, device=device)
+            sample = sample * boost ** (1. / concentration)
+        return sample
+
+
+def rand_bbox(size, lam, sampler, device):
+    "Per-sample boxes whose area ratio is about 1 - lam, along dims 2 and 3"
+    n, W, H = size[0], size[2], size[3]
+    cut_rat = torch.sqrt(1. - lam)
+    cut_w = (W * cut_rat).long()
+    cut_h = (H * cut_rat).long()
+
+    # uniform
+    cx = sampler.randint(W, n, device)
+    cy = sampler.randint(H, n, device)
+
+    bbx1 = (cx - cut_w // 2).clamp(0, W)
+    bby1 = (cy - cut_h // 2).clamp(0, H)
+    bbx2 = (cx + cut_w // 2).clamp(0, W)
+    bby2 = (cy + cut_h // 2).clamp(0, H)
+
+    return bbx1, bby1, bbx2, bby2
+
+
+def box_mask(size, bbx1, bby1, bbx2, bby2):
+    "Boolean (batch, 1, size[2], size[3]) mask of per-sample boxes"
+    device = bbx1.device
+    xs = torch.arange(size[2], device=device).view(1, -1, 1)
+    ys = torch.arange(size[3], device=device).view(1, 1, -1)
+    mask = ((xs >= bbx1.view(-1, 1, 1)) & (xs < bbx2.view(-1, 1, 1)) &
+            (ys >= bby1.view(-1, 1, 1)) & (ys < bby2.view(-1, 1, 1)))
+    return mask.unsqueeze(1)
+
+
+def box_ratio(size, bbx1, bby1, bbx2, bby2):
+    return ((bbx2 - bbx1) * (bby2 - bby1)).float() / (size[2] * size[3])
+
+
+def _batch_view(t):
+    return t.view(-1, 1, 1, 1)
+
+
+def _holes(input, n_holes, length, sampler):
+    size = input.size()
+    n, h, w = size[0], size[2], size[3]
+    holes = None
+    for _ in range(n_holes):
+        y = sampler.randint(h, n, input.device)
+        x = sampler.randint(w, n, input.device)
+
+        y1 = (y - length // 2).clamp(0, h)
+        y2 = (y + length // 2).clamp(0, h)
+        x1 = (x - length // 2).clamp(0, w)
+        x2 = (x + length // 2).clamp(0, w)
+
+        hole = box_mask(size, y1, x1, y2, x2)
+        holes = hole if holes is None else holes | hole
+    return holes
+
+
+@register_mixer('None')
+def no_mix(input, target, args, sampler):
+    return input, [(target, 1.)]
+
+
+@register_mixer('cutout')
+def cutout(input, target, args, sampler):
+    if not args.beta > 0:
+        return input, [(target, 1.)]
+    apply = sampler.rand(input.size(0), input.device) < args.cutout_prob
+    holes = _holes(input, args.cutout_n_holes, args.cutout_length, sampler)
+    holes = holes & _batch_view(apply)
+    input = input * (1. - holes.float())
+    return input, [(target, 1.)]
+
+
+@register_mixer('softcutout')
+def softcutout(input, target, args, sampler):
+    if not args.beta > 0:
+        return input, [(target, 1.)]
+    apply = sampler.rand(input.size(0), input.device) < args.softcutout_prob
+    holes = _holes(input, args.softcutout_n_holes, args.softcutout_length, sampler)
+    holes = holes & _batch_view(apply)
+    input = input * (1. - holes.float() * (1. - args.softcutout_alpha))
+    return input, [(target, 1.)]
+
+
+@register_mixer('mixup')
+def mixup(input, target, args, sampler):
+    n, device = input.size(0), input.device
+    lam = sampler.beta(args.mixup_alpha, n, device)
+    index = sampler.randperm(n, device)
+
+    input = torch.lerp(input[index], input, _batch_view(lam))
+    return input, [(target, lam), (target[index], 1. - lam)]
+
+
+@register_mixer('cutmix')
+def cutmix(input, target, args, sampler):
+    if not args.beta > 0:
+        return input, [(target, 1.)]
+    n, device = input.size(0), input.device
+    apply = sampler.rand(n, device) < args.cutmix_prob
+    lam = sampler.beta(args.beta, n, device)
+    index = sampler.randperm(n, device)
+
+    bbx1, bby1, bbx2, bby2 = rand_bbox(input.size(), lam, sampler, device)
+    # samples that are not mixed get an empty box
+    bbx2 = torch.where(apply, bbx2, bbx1)
+    mask = box_mask(input.size(), bbx1, bby1, bbx2, bby2)
+    input = torch.where(mask, input[index], input)
+    # adjust lambda to exactly match pixel ratio
+    lam = 1. - box_ratio(input.size(), bbx1, bby1, bbx2, bby2)
+    return input, [(target, lam), (target[index], 1. - lam)]
+
+
+@register_mixer('cutmixup')
+def cutmixup(input, target, args, sampler):
+    if not args.beta > 0:
+        return input, [(target, 1.)]
+    n, device = input.size(0), input.device
+    apply = sampler.rand(n, device) < args.cutmixup_prob
+    mixuplam = sampler.beta(args.cutmixup_alpha, n, device)
+    cutmixlam = sampler.beta(args.beta, n, device)
+    index = sampler.randperm(n, device)
+
+    bbx1, bby1, bbx2, bby2 = rand_bbox(input.size(), cutmixlam, sampler, device)
+    bbx2 = torch.where(apply, bbx2, bbx1)
+    mask = box_mask(input.size(), bbx1, bby1, bbx2, bby2)
+    # mixup inside the box, keep the sample outside of it
+    weight = mask.float() * _batch_view(1. - mixuplam)
+    input = torch.lerp(input, input[index], weight)
+    # adjust lambda to exactly match pixel ratio
+    cutmixlam = 1. - box_ratio(input.size(), bbx1, bby1, bbx2, bby2)
+    lam_b = (1. - cutmixlam) * (1. - mixuplam)
+    return input, [(target, 1. - lam_b), (target[index], lam_b)]
+
+
+@register_mixer('divmix')
+def divmix(input, target, args, sampler):
+    n, device = input.size(0), input.device
+    h, w = input.size(2), input.size(3)
+    apply = sampler.rand(n, device) < args.divmix_prob
+    identity = torch.arange(n, device=device)
+    indices = [torch.where(apply, sampler.randperm(n, device), identity) for _ in range(3)]
+
+    # quadrant 0 keeps the sample, quadrants 1-3 are taken from the shuffled batches
+    rows = torch.arange(h, device=device)
+    cols = torch.arange(w, device=device)
+    quadrant = (rows >= h // 2).long().view(-1, 1) + 2 * (cols >= w // 2).long().view(1, -1)
+    sources = torch.stack([identity] + indices, 1)[:, quadrant]
+    input = input.permute(0, 2, 3, 1)[sources, rows.view(-1, 1), cols.view(1, -1)]
+    input = input.permute(0, 3, 1, 2).contiguous()
+
+    quarter = apply.float() * 0.25
+    mixed_target = [(target, 1. - 3. * quarter)]
+    mixed_target += [(target[index], quarter) for index in indices]
+    return input, mixed_target
+
+
+_AROUND_KERNELS = {}
+
+
+def around_kernel(alpha, channels, device, dtype=torch.float32):
+    """Depthwise 3x3 aroundmix kernel, cached per (alpha, channels, device, dtype).
+
+    The centre keeps 1 - 8 * alpha of the pixel and each of the 8 neighbours adds
+    alpha; with zero padding the border pixels simply miss their outside neighbours.
+    """
+    key = (alpha, channels, torch.device(device), dtype)
+    kernel = _AROUND_KERNELS.get(key)
+    if kernel is None:
+        kernel = torch.full((3, 3), alpha)
+        kernel[1, 1] = 1 - alpha * 8
+        kernel = kernel.expand(channels, 1, 3, 3).to(device=device, dtype=dtype).contiguous()
+        _AROUND_KERNELS[key] = kernel
+    return kernel
+
+
+@register_mixer('aroundmix')
+def aroundmix(input, target, args, sampler):
+    if not args.aroundmix_prob > 0:
+        return input, [(target, 1.)]
+    apply = sampler.rand(input.size(0), input.device) < args.aroundmix_prob
+    channels = input.size(1)
+    kernel = around_kernel(args.aroundmix_alpha, channels, input.device, input.dtype)
+    inputi = F.conv2d(input, kernel, padding=1, groups=channels)
+
+    input = torch.where(_batch_view(apply), inputi, input)
+    return input, [(target, 1.)]
+
+
+_FADE_PROFILES = {}
+
+
+def fade_profile(h, w, device, dtype=torch.float32):
+    """Per-pixel fademixup weight for lam = 1, cached per (h, w, device, dtype).
+
+    Pixels on the i-th ring from the border get weight i / ((1/6) * (s/2) * (s/2 + 1) * (s/2 - 4))
+    with s = min(h, w), the coefficient the original ring loop computed for ring i
+    (the loop then blended every ring with itself, see fademixup).
+    """
+    shorter = min(h, w)
+    if shorter <= 8:
+        raise Exception('fademixup needs images larger than 8x8, got {}x{}'.format(h, w))
+    key = (h, w, torch.device(device), dtype)
+    profile = _FADE_PROFILES.get(key)
+    if profile is None:
+        rows = torch.arange(h).view(-1, 1)
+        cols = torch.arange(w).view(1, -1)
+        ring = torch.zeros(h, w)
+        for i in range(shorter // 2):
+            h_i = (i * h) // shorter
+            w_i = (i * w) // shorter
+            inside = (rows >= h_i) & (rows < h - h_i) & (cols >= w_i) & (cols < w - w_i)
+            ring[inside] = i
+        unit = (1/6) * (shorter/2) * (shorter/2 + 1) * (shorter/2 - 4)
+        profile = (ring / unit).to(device=device, dtype=dtype)
+        _FADE_PROFILES[key] = profile
+    return profile
+
+
+@register_mixer('fademixup')
+def fademixup(input, target, args, sampler):
+    n, device = input.size(0), input.device
+    lam = sampler.beta(args.fademixup_alpha, n, device)
+    index = sampler.randperm(n, device)
+
+    # the original ring loop blended every ring with itself, so the image is kept
+    # and only the targets are mixed; --fademixup_blend takes the rings from the
+    # shuffled batch instead, in one fused blend weighted by the cached profile
+    if args.fademixup_blend:
+        profile = fade_profile(input.size(2), input.size(3), device, input.dtype)
+        input = torch.lerp(input, input[index], _batch_view(lam.to(input.dtype)) * profile)
+
+    return input, [(target, 1. - lam), (target[index], lam)]
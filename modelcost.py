@@ -0,0 +1,294 @@
+import argparse
+import itertools
+import json
+
+
+parser = argparse.ArgumentParser(description='analytic parameter/MACs/activation calculator for PyramidNet and ResNet')
+parser.add_argument('--net_types', default=['pyramidnet'], type=str, nargs='+',
+                    help='model families to evaluate (options: resnet, pyramidnet)')
+parser.add_argument('--dataset', default='cifar100', type=str,
+                    help='dataset (options: cifar10, cifar100, and imagenet)')
+parser.add_argument('--depths', default=[110], type=int, nargs='+',
+                    help='network depths to sweep (default: 110)')
+parser.add_argument('--alphas', default=[48], type=float, nargs='+',
+                    help='PyramidNet alphas to sweep (default: 48)')
+parser.add_argument('--bottleneck', default='yes', type=str, choices=['both', 'yes', 'no'],
+                    help='block types to sweep (default: yes)')
+parser.add_argument('--input_size', default=None, type=int,
+                    help='input resolution (default: 32 for CIFAR, 224 for ImageNet)')
+parser.add_argument('--bytes_per_element', default=4, type=int,
+                    help='activation element size, 4 for fp32 and 2 for fp16/bf16 (default: 4)')
+parser.add_argument('--max_params', default=None, type=float,
+                    help='only list configs with at most this many parameters (in millions)')
+parser.add_argument('--max_macs', default=None, type=float,
+                    help='only list configs with at most this many MACs per sample (in billions)')
+parser.add_argument('--stages', dest='stages', action='store_true',
+                    help='also print the per-stage breakdown of every config')
+parser.add_argument('--json', default=None, type=str,
+                    help='write the results as JSON to this path')
+parser.set_defaults(stages=False)
+
+
+NUM_CLASSES = {'cifar10': 10, 'cifar100': 100, 'imagenet': 1000}
+
+IMAGENET_BLOCKS = {18: False, 34: False, 50: True, 101: True, 152: True, 200: True}
+IMAGENET_LAYERS = {18: [2, 2, 2, 2], 34: [3, 4, 6, 3], 50: [3, 4, 6, 3], 101: [3, 4, 23, 3],
+                   152: [3, 8, 36, 3], 200: [3, 24, 36, 3]}
+
+
+class Cost(object):
+    """Parameters, multiply-accumulates and activation elements of a model part.
+
+    Activations count the elements of every tensor created in the forward pass
+    of one sample (in-place ReLUs and residual additions create none), which is
+    what autograd keeps alive for backward in training.
+    """
+
+    def __init__(self):
+        self.params = 0
+        self.macs = 0
+        self.activations = 0
+
+    def add(self, other):
+        self.params += other.params
+        self.macs += other.macs
+        self.activations += other.activations
+
+    def as_dict(self, bytes_per_element):
+        return {'params': self.params, 'macs': self.macs,
+                'activation_bytes': self.activations * bytes_per_element}
+
+
+def conv(cost, in_planes, out_planes, size, kernel_size, stride=1, padding=0, bias=False):
+    out_size = (size + 2 * padding - kernel_size) // stride + 1
+    weights = in_planes * out_planes * kernel_size * kernel_size
+    cost.params += weights + (out_planes if bias else 0)
+    cost.macs += weights * out_size * out_size
+    cost.activations += out_planes * out_size * out_size
+    return out_size
+
+
+def bn(cost, planes, size):
+    cost.params += 2 * planes
+    cost.activations += planes * size * size
+
+
+def pool(cost, planes, size, kernel_size, stride, padding=0, ceil_mode=False):
+    span = size + 2 * padding - kernel_size
+    out_size = (-(-span // stride) if ceil_mode else span // stride) + 1
+    cost.activations += planes * out_size * out_size
+    return out_size
+
+
+def linear(cost, in_features, out_features):
+    cost.params += in_features * out_features + out_features
+    cost.macs += in_features * out_features
+    cost.activations += out_features
+
+
+def pyramid_block(cost, bottleneck, inplanes, planes, size, stride, downsample):
+    "Mirrors pyramidnet.BasicBlock/Bottleneck; returns (output channels, output size)"
+    bn(cost, inplanes, size)
+    if bottleneck:
+        conv(cost, inplanes, planes, size, 1)
+        bn(cost, planes, size)
+        out_size = conv(cost, planes, planes, size, 3, stride, 1)
+        bn(cost, planes, out_size)
+        conv(cost, planes, planes * 4, out_size, 1)
+        bn(cost, planes * 4, out_size)
+        out_planes = planes * 4
+    else:
+        out_size = conv(cost, inplanes, planes, size, 3, stride, 1)
+        bn(cost, planes, out_size)
+        conv(cost, planes, planes, out_size, 3, 1, 1)
+        bn(cost, planes, out_size)
+        out_planes = planes
+    if downsample:
+        pool(cost, inplanes, size, 2, 2, ceil_mode=True)
+    return out_planes, out_size
+
+
+def pyramidal_layer(model, cost, block_depth, size, stride=1):
+    "Mirrors PyramidNet.pyramidal_make_layer, including its channel growth"
+    ratio = 4 if model['bottleneck'] else 1
+    model['featuremap_dim'] = model['featuremap_dim'] + model['addrate']
+    _, size = pyramid_block(cost, model['bottleneck'], model['input_featuremap_dim'],
+                            int(round(model['featuremap_dim'])), size, stride, stride != 1)
+    for i in range(1, block_depth):
+        temp_featuremap_dim = model['featuremap_dim'] + model['addrate']
+        _, size = pyramid_block(cost, model['bottleneck'], int(round(model['featuremap_dim'])) * ratio,
+                                int(round(temp_featuremap_dim)), size, 1, False)
+        model['featuremap_dim'] = temp_featuremap_dim
+    model['input_featuremap_dim'] = int(round(model['featuremap_dim'])) * ratio
+    return size
+
+
+def pyramidnet_cost(dataset, depth, alpha, bottleneck, size):
+    "Per-stage Cost of pyramidnet.PyramidNet(dataset, depth, alpha, ..., bottleneck)"
+    stages = [('stem', Cost())]
+    if dataset.startswith('cifar'):
+        n = int((depth - 2) / 9) if bottleneck else int((depth - 2) / 6)
+        layers = [n, n, n]
+        inplanes = 16
+        size = conv(stages[0][1], 3, inplanes, size, 3, 1, 1)
+        bn(stages[0][1], inplanes, size)
+    else:
+        if depth in IMAGENET_LAYERS:
+            bottleneck = IMAGENET_BLOCKS[depth]
+            layers = IMAGENET_LAYERS[depth]
+        else:
+            temp_cfg = int((depth - 2) / 12) if bottleneck else int((depth - 2) / 8)
+            layers = [temp_cfg] * 4
+        inplanes = 64
+        size = conv(stages[0][1], 3, inplanes, size, 7, 2, 3)
+        bn(stages[0][1], inplanes, size)
+        size = pool(stages[0][1], inplanes, size, 3, 2, 1)
+
+    model = {'bottleneck': bottleneck, 'addrate': alpha / (sum(layers) * 1.0),
+             'featuremap_dim': inplanes, 'input_featuremap_dim': inplanes}
+    for i, block_depth in enumerate(layers):
+        cost = Cost()
+        size = pyramidal_layer(model, cost, block_depth, size, 1 if i == 0 else 2)
+        stages.append(('layer%d' % (i + 1), cost))
+
+    head = Cost()
+    final = model['input_featuremap_dim']
+    bn(head, final, size)
+    pool(head, final, size, size, size)
+    linear(head, final, NUM_CLASSES[dataset])
+    stages.append(('head', head))
+    return stages
+
+
+def resnet_block(cost, bottleneck, inplanes, planes, size, stride, downsample):
+    "Mirrors resnet.BasicBlock/Bottleneck"
+    expansion = 4 if bottleneck else 1
+    if bottleneck:
+        conv(cost, inplanes, planes, size, 1)
+        bn(cost, planes, size)
+        out_size = conv(cost, planes, planes, size, 3, stride, 1)
+        bn(cost, planes, out_size)
+        conv(cost, planes, planes * expansion, out_size, 1)
+        bn(cost, planes * expansion, out_size)
+    else:
+        out_size = conv(cost, inplanes, planes, size, 3, stride, 1)
+        bn(cost, planes, out_size)
+        conv(cost, planes, planes, out_size, 3, 1, 1)
+        bn(cost, planes, out_size)
+    if downsample:
+        conv(cost, inplanes, planes * expansion, size, 1, stride)
+        bn(cost, planes * expansion, out_size)
+    return out_size
+
+
+def resnet_layer(model, cost, planes, blocks, size, stride=1):
+    "Mirrors ResNet._make_layer"
+    expansion = 4 if model['bottleneck'] else 1
+    downsample = stride != 1 or model['inplanes'] != planes * expansion
+    size = resnet_block(cost, model['bottleneck'], model['inplanes'], planes, size, stride, downsample)
+    model['inplanes'] = planes * expansion
+    for i in range(1, blocks):
+        size = resnet_block(cost, model['bottleneck'], model['inplanes'], planes, size, 1, False)
+    return size
+
+
+def resnet_cost(dataset, depth, bottleneck, size):
+    "Per-stage Cost of resnet.ResNet(dataset, depth, ..., bottleneck)"
+    stages = [('stem', Cost())]
+    if dataset.startswith('cifar'):
+        n = int((depth - 2) / 9) if bottleneck else int((depth - 2) / 6)
+        widths = [16, 32, 64]
+        layers = [n, n, n]
+        inplanes = 16
+        size = conv(stages[0][1], 3, inplanes, size, 3, 1, 1)
+        bn(stages[0][1], inplanes, size)
+    else:
+        if depth not in IMAGENET_LAYERS:
+            raise Exception('invalid depth for ResNet (depth should be one of 18, 34, 50, 101, 152, and 200)')
+        bottleneck = IMAGENET_BLOCKS[depth]
+        widths = [64, 128, 256, 512]
+        layers = IMAGENET_LAYERS[depth]
+        inplanes = 64
+        size = conv(stages[0][1], 3, inplanes, size, 7, 2, 3)
+        bn(stages[0][1], inplanes, size)
+        size = pool(stages[0][1], inplanes, size, 3, 2, 1)
+
+    model = {'bottleneck': bottleneck, 'inplanes': inplanes}
+    for i, (planes, blocks) in enumerate(zip(widths, layers)):
+        cost = Cost()
+        size = resnet_layer(model, cost, planes, blocks, size, 1 if i == 0 else 2)
+        stages.append(('layer%d' % (i + 1), cost))
+
+    head = Cost()
+    pool(head, model['inplanes'], size, size, size)
+    linear(head, model['inplanes'], NUM_CLASSES[dataset])
+    stages.append(('head', head))
+    return stages
+
+
+def model_cost(net_type, dataset, depth, alpha=None, bottleneck=True, input_size=None, bytes_per_element=4):
+    "Total and per-stage params, MACs and activation bytes per sample of one config"
+    if input_size is None:
+        input_size = 224 if dataset == 'imagenet' else 32
+    if dataset == 'imagenet' and depth in IMAGENET_BLOCKS:
+        # the standard ImageNet depths fix the block type
+        bottleneck = IMAGENET_BLOCKS[depth]
+    if net_type == 'pyramidnet':
+        stages = pyramidnet_cost(dataset, depth, alpha, bottleneck, input_size)
+    elif net_type == 'resnet':
+        stages = resnet_cost(dataset, depth, bottleneck, input_size)
+    else:
+        raise Exception('unknown network architecture: {}'.format(net_type))
+
+    total = Cost()
+    for _, cost in stages:
+        total.add(cost)
+    result = {'net_type': net_type, 'dataset': dataset, 'depth': depth, 'alpha': alpha,
+              'bottleneck': bottleneck, 'input_size': input_size}
+    result.update(total.as_dict(bytes_per_element))
+    result['stages'] = [dict(name=name, **cost.as_dict(bytes_per_element)) for name, cost in stages]
+    return result
+
+
+def sweep(net_types, dataset, depths, alphas, bottlenecks, input_size=None, bytes_per_element=4):
+    results = []
+    for net_type, depth, bottleneck in itertools.product(net_types, depths, bottlenecks):
+        for alpha in (alphas if net_type == 'pyramidnet' else [None]):
+            results.append(model_cost(net_type, dataset, depth, alpha, bottleneck, input_size, bytes_per_element))
+    return results
+
+
+def config_name(result):
+    return '{}-d{}{}-{}'.format(result['net_type'], result['depth'],
+                                '' if result['alpha'] is None else '-a%g' % result['alpha'],
+                                'bottleneck' if result['bottleneck'] else 'basic')
+
+
+def main():
+    args = parser.parse_args()
+    bottlenecks = {'both': [False, True], 'yes': [True], 'no': [False]}[args.bottleneck]
+    results = sweep(args.net_types, args.dataset, args.depths, args.alphas, bottlenecks,
+                    args.input_size, args.bytes_per_element)
+    if args.max_params is not None:
+        results = [r for r in results if r['params'] <= args.max_params * 1e6]
+    if args.max_macs is not None:
+        results = [r for r in results if r['macs'] <= args.max_macs * 1e9]
+    results.sort(key=lambda r: r['macs'])
+
+    row = '{:<40} {:>12} {:>12} {:>16}'
+    print(row.format('config', 'params (M)', 'MACs (G)', 'act/sample (MB)'))
+    for r in results:
+        print(row.format(config_name(r), '%.3f' % (r['params'] / 1e6), '%.3f' % (r['macs'] / 1e9),
+                         '%.2f' % (r['activation_bytes'] / 2.0 ** 20)))
+        if args.stages:
+            for s in r['stages']:
+                print(row.format('  ' + s['name'], '%.3f' % (s['params'] / 1e6), '%.3f' % (s['macs'] / 1e9),
+                                 '%.2f' % (s['activation_bytes'] / 2.0 ** 20)))
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
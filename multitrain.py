@@ -0,0 +1,243 @@
+import argparse
+import contextlib
+import os
+import shlex
+import time
+
+import torch
+import torch.nn as nn
+import torch.backends.cudnn as cudnn
+
+import mixers
+import train as T
+from checkpoint import CheckpointWriter
+from metrics import MetricsSink
+
+
+parser = argparse.ArgumentParser(description='train several models on one data pipeline', add_help=False)
+parser.add_argument('--member', default=[], type=str, action='append',
+                    help='train.py options of one model, e.g. --member "--net_type resnet --depth 18 '
+                         '--process cutmix --cutmix_prob 0.5 --expname r18_cutmix"; repeat for every model')
+
+# the options that decide which batches are produced, and those read by the
+# shared loop (printing, checkpoint writer), are shared by all members
+SHARED = ('dataset', 'batch_size', 'eval_batch_size', 'epochs', 'eval_every', 'eval_subset', 'workers',
+          'device', 'device_loader', 'prefetch', 'shared_data', 'data_cache', 'imagenet_dir', 'precision',
+          'world_size', 'accum_steps', 'print_freq', 'verbose', 'max_pending_saves')
+# train.py options the shared loop has no counterpart for
+UNSUPPORTED = ('compile', 'resume', 'stop_epoch', 'profile_steps')
+
+
+class Member(object):
+    """One (model, optimizer, process) tuple of a shared run.
+
+    Every member has its own options, augmentation generator, meters,
+    metrics files and checkpoints under runs/<expname>/.
+    """
+
+    def __init__(self, args, numberofclass):
+        self.args = args
+        self.model = nn.DataParallel(T.make_model(args, numberofclass)).to(args.device)
+        self.optimizer = T.make_optimizer(args, self.model)
+        self.criterion = nn.CrossEntropyLoss().to(args.device)
+        self.mixer = mixers.get_mixer(args.process)
+        self.sampler = mixers.MixSampler(args.mix_seed, args.mix_per_sample)
+        self.scaler = torch.cuda.amp.GradScaler(enabled=args.precision == 'fp16')
+        self.sink = MetricsSink('runs/%s/metrics' % (args.expname), args.metrics_format) \
+            if args.metrics_format != 'none' else MetricsSink()
+        self.best_err1 = 100
+        self.best_err5 = 100
+        self.reset_meters()
+
+    def reset_meters(self):
+        self.losses = T.DeviceAverageMeter()
+        self.top1 = T.DeviceAverageMeter()
+        self.top5 = T.DeviceAverageMeter()
+        self.step_time = T.AverageMeter()
+
+    @contextlib.contextmanager
+    def active(self):
+        "Points the helpers of train.py (autocast, learning rate, ...) at this member's options"
+        previous, T.args = T.args, self.args
+        try:
+            yield
+        finally:
+            T.args = previous
+
+    def train_step(self, input, target):
+        begin = time.time()
+        input, mixed_target = self.mixer(input, target, self.args, self.sampler)
+        with T.autocast():
+            output = self.model(input)
+            loss = mixers.mixed_loss(output, mixed_target)
+        err1, err5 = T.accuracy(output.data, target, topk=(1, 5))
+        self.losses.update(loss, input.size(0))
+        self.top1.update(err1, input.size(0))
+        self.top5.update(err5, input.size(0))
+
+        self.scaler.scale(loss).backward()
+        self.scaler.step(self.optimizer)
+        self.scaler.update()
+        self.optimizer.zero_grad(set_to_none=True)
+        self.step_time.update(time.time() - begin)
+        return loss, err1, err5
+
+    def eval_step(self, input, target):
+        with T.autocast():
+            output = self.model(input)
+            loss = self.criterion(output, target)
+        err1, err5 = T.accuracy(output, target, topk=(1, 5))
+        self.losses.update(loss, input.size(0))
+        self.top1.update(err1, input.size(0))
+        self.top5.update(err5, input.size(0))
+
+    def state(self, epoch):
+        return {
+            'epoch': epoch,
+            'arch': self.args.net_type,
+            'state_dict': self.model.state_dict(),
+            'best_err1': self.best_err1,
+            'best_err5': self.best_err5,
+            'optimizer': self.optimizer.state_dict(),
+            'scaler': self.scaler.state_dict(),
+        }
+
+
+def member_args(base_argv, member_argv):
+    "train.py options of a member: the shared command line, overridden by the member's own options"
+    base = T.parser.parse_args(base_argv)
+    args = T.parser.parse_args(base_argv + shlex.split(member_argv))
+    for name in SHARED:
+        if getattr(args, name) != getattr(base, name):
+            raise Exception('--{} must be the same for all members, give it outside --member'.format(name))
+    for name in UNSUPPORTED:
+        if getattr(args, name) != T.parser.get_default(name):
+            raise Exception('multitrain.py does not support --{}'.format(name))
+    args.rank = 0
+    args.distributed = False
+    return args
+
+
+def train_epoch(train_loader, members, epoch):
+    shared = members[0].args
+    data_time = T.AverageMeter()
+    if hasattr(getattr(train_loader, 'sampler', None), 'set_epoch'):
+        train_loader.sampler.set_epoch(epoch)
+    for m in members:
+        m.model.train()
+        m.reset_meters()
+
+    def load(input, target):
+        return input.to(shared.device), target.to(shared.device)
+
+    if shared.prefetch > 0:
+        batches = T.Prefetcher(train_loader, shared.device, depth=shared.prefetch)
+    else:
+        batches = (load(input, target) for input, target in train_loader)
+
+    end = time.time()
+    for i, (input, target) in enumerate(batches):
+        # one decoded batch, augmented separately by every member
+        data_time.update(time.time() - end)
+        for m in members:
+            with m.active():
+                T.adjust_learning_rate(m.optimizer, epoch, i, len(train_loader))
+                loss, err1, err5 = m.train_step(input, target)
+            m.sink.log('step', epoch=epoch, iteration=i, lr=T.get_learning_rate(m.optimizer)[0],
+                       loss=loss, err1=err1, err5=err5, data_time=data_time.val, batch_time=m.step_time.val)
+        end = time.time()
+
+        if i % shared.print_freq == 0 and shared.verbose == True:
+            print('Epoch: [{0}/{1}][{2}/{3}]\tData {data_time.val:.3f} ({data_time.avg:.3f})'.format(
+                epoch, shared.epochs, i, len(train_loader), data_time=data_time))
+            for m in members:
+                print('  {0:<24} Loss {loss.val:.4f} ({loss.avg:.4f})\tTop 1-err {top1.val:.4f} ({top1.avg:.4f})'.format(
+                    m.args.expname, loss=m.losses, top1=m.top1))
+
+    for m in members:
+        print('* {0} Epoch: [{1}/{2}]\t Top 1-err {top1.avg:.3f}  Top 5-err {top5.avg:.3f}\t Train Loss {loss.avg:.3f}'.format(
+            m.args.expname, epoch, shared.epochs, top1=m.top1, top5=m.top5, loss=m.losses))
+        m.sink.log('train', epoch=epoch, lr=T.get_learning_rate(m.optimizer)[0], loss=m.losses.avg,
+                   err1=m.top1.avg, err5=m.top5.avg, data_time=data_time.avg, batch_time=m.step_time.avg)
+
+
+def validate(val_loader, members, epoch, max_samples=None):
+    shared = members[0].args
+    for m in members:
+        m.model.eval()
+        m.reset_meters()
+
+    with torch.inference_mode():
+        count = 0
+        for input, target in val_loader:
+            input = input.to(shared.device, non_blocking=True)
+            target = target.to(shared.device, non_blocking=True)
+            for m in members:
+                with m.active():
+                    m.eval_step(input, target)
+            count += input.size(0)
+            if max_samples is not None and count >= max_samples:
+                break
+
+    for m in members:
+        print('* {0} Epoch: [{1}/{2}]\t Top 1-err {top1.avg:.3f}  Top 5-err {top5.avg:.3f}\t Test Loss {loss.avg:.3f}'.format(
+            m.args.expname, epoch, shared.epochs, top1=m.top1, top5=m.top5, loss=m.losses))
+        m.sink.log('val', epoch=epoch, loss=m.losses.avg, err1=m.top1.avg, err5=m.top5.avg,
+                   samples=m.losses.count, full=max_samples is None)
+
+
+def main():
+    args, base_argv = parser.parse_known_args()
+    if not args.member:
+        raise Exception('give at least one --member')
+
+    members_args = [member_args(base_argv, m) for m in args.member]
+    expnames = [a.expname for a in members_args]
+    if len(set(expnames)) != len(expnames):
+        raise Exception('every --member needs its own --expname')
+
+    shared = members_args[0]
+    if shared.world_size > 1:
+        raise Exception('multitrain.py runs in a single process, use --world_size 1')
+    if shared.accum_steps != 1:
+        raise Exception('multitrain.py does not support --accum_steps')
+    T.args = shared
+
+    train_loader, val_loader, numberofclass = T.make_loaders(shared)
+    members = [Member(a, numberofclass) for a in members_args]
+    writer = CheckpointWriter(shared.max_pending_saves)
+
+    cudnn.benchmark = True
+
+    for epoch in range(shared.epochs):
+        train_epoch(train_loader, members, epoch)
+
+        last_epoch = epoch == shared.epochs - 1
+        if last_epoch or (epoch + 1) % shared.eval_every == 0:
+            full = last_epoch or shared.eval_subset <= 0
+            validate(val_loader, members, epoch, None if full else shared.eval_subset)
+        else:
+            full = False
+
+        for m in members:
+            is_best = full and m.top1.avg <= m.best_err1
+            if is_best:
+                m.best_err1 = m.top1.avg
+                m.best_err5 = m.top5.avg
+            print('{} current best accuracy (top-1 and 5 error): {} {}'.format(m.args.expname, m.best_err1, m.best_err5))
+            directory = 'runs/%s/' % (m.args.expname)
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            writer.save(m.state(epoch), directory + 'checkpoint.pth.tar',
+                        directory + 'model_best.pth.tar' if is_best else None)
+
+    for m in members:
+        print('{} best accuracy (top-1 and 5 error): {} {}'.format(m.args.expname, m.best_err1, m.best_err5))
+        with m.active():
+            T.save_result({'best_err1': m.best_err1, 'best_err5': m.best_err5, 'epochs': m.args.epochs})
+        m.sink.close()
+    writer.close()
+
+
+if __name__ == '__main__':
+    main()
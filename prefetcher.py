@@ -0,0 +1,122 @@
+import collections
+import queue
+import threading
+
+import torch
+
+
+class Prefetcher(object):
+    """Wraps a loader and prepares batch N+1 while batch N trains.
+
+    Batches are copied to the device with non-blocking copies (the loader
+    should use pin_memory=True) and then passed through prepare(input, target),
+    e.g. the mixing step, whose result is what the iterator yields. On CUDA the
+    work is queued on a side stream, otherwise a background thread fills a
+    bounded queue. At most `depth` prepared batches are held at any time.
+    """
+
+    def __init__(self, loader, device, prepare=None, depth=2):
+        self.loader = loader
+        self.device = torch.device(device)
+        self.prepare = prepare
+        self.depth = max(1, depth)
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        if self.device.type == 'cuda':
+            return self._iter_stream()
+        return self._iter_thread()
+
+    def _load(self, input, target):
+        input = input.to(self.device, non_blocking=True)
+        target = target.to(self.device, non_blocking=True)
+        if self.prepare is None:
+            return input, target
+        return self.prepare(input, target)
+
+    def _iter_stream(self):
+        stream = torch.cuda.Stream(device=self.device)
+        pending = collections.deque()
+        batches = iter(self.loader)
+
+        def preload():
+            # the side stream must not run ahead of the work already queued on
+            # this one (e.g. the step that last used the memory it reuses)
+            stream.wait_stream(torch.cuda.current_stream(self.device))
+            with torch.cuda.stream(stream):
+                try:
+                    input, target = next(batches)
+                except StopIteration:
+                    return False
+                for t in (input, target):
+                    if t.is_cuda:
+                        # batches produced on the device are read on the side stream
+                        t.record_stream(stream)
+                pending.append(self._load(input, target))
+            return True
+
+        while len(pending) < self.depth and preload():
+            pass
+
+        while pending:
+            torch.cuda.current_stream(self.device).wait_stream(stream)
+            batch = pending.popleft()
+            for t in _tensors(batch):
+                # memory allocated on the side stream is now used on this one
+                t.record_stream(torch.cuda.current_stream(self.device))
+            preload()
+            yield batch
+
+    def _iter_thread(self):
+        batches = queue.Queue(maxsize=self.depth)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def worker():
+            try:
+                for input, target in self.loader:
+                    if not put(self._load(input, target)):
+                        return
+                put(done)
+            except Exception as e:
+                put(e)
+
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is done:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            # unblock and join the worker if the consumer stops early
+            stop.set()
+            while thread.is_alive():
+                try:
+                    batches.get_nowait()
+                except queue.Empty:
+                    pass
+                thread.join(timeout=0.1)
+
+
+def _tensors(batch):
+    if torch.is_tensor(batch):
+        yield batch
+    elif isinstance(batch, (list, tuple)):
+        for b in batch:
+            for t in _tensors(b):
+                yield t
@@ -0,0 +1,131 @@
+import contextlib
+import json
+import os
+import re
+import threading
+import time
+
+import torch
+
+
+class StepProfiler(object):
+    """Opt-in timing of the phases of a training step.
+
+    Phases (copy, augmentation, forward, loss, backward, optimizer step, ...)
+    are recorded with phase(name) for the iterations in
+    [start, start + steps); outside that window phase() is a shared no-op
+    context. With sync=True the device is synchronized around every phase so
+    the time is attributed to the phase that queued the work. attach() adds
+    per-block forward/backward timing for the blocks of layer1-layer4.
+    At the end of the window a summary table is printed and a Chrome trace
+    (chrome://tracing, ui.perfetto.dev) is written to trace_path.
+    """
+
+    def __init__(self, start, steps, trace_path=None, device='cpu', sync=True):
+        self.start = start
+        self.stop = start + steps
+        self.trace_path = trace_path
+        self.device = torch.device(device)
+        self.sync = sync and self.device.type == 'cuda'
+        self.iteration = 0
+        self.active = start <= 0 < self.stop
+        self.events = []
+        self.origin = time.perf_counter()
+        self._null = contextlib.nullcontext()
+        self._lock = threading.Lock()
+
+    def _now(self):
+        if self.sync:
+            torch.cuda.synchronize(self.device)
+        return time.perf_counter()
+
+    def _record(self, name, category, begin, end):
+        with self._lock:
+            self.events.append({
+                'name': name, 'cat': category, 'ph': 'X', 'pid': os.getpid(),
+                'tid': threading.get_ident(),
+                'ts': (begin - self.origin) * 1e6, 'dur': (end - begin) * 1e6,
+                'args': {'iteration': self.iteration},
+            })
+
+    def phase(self, name):
+        if not self.active:
+            return self._null
+        return self._phase(name)
+
+    @contextlib.contextmanager
+    def _phase(self, name):
+        begin = self._now()
+        try:
+            yield
+        finally:
+            self._record(name, 'phase', begin, self._now())
+
+    def step(self):
+        "Marks the end of an iteration; reports once the window is over"
+        self.iteration += 1
+        was_active = self.active
+        self.active = self.start <= self.iteration < self.stop
+        if was_active and not self.active:
+            self.report()
+
+    def attach(self, model):
+        "Adds forward/backward timing hooks to every block of layer1-layer4"
+        for name, module in model.named_modules():
+            if re.search(r'(^|\.)layer[1-4]\.\d+$', name):
+                self._hook(re.sub(r'^module\.', '', name), module)
+
+    def _hook(self, name, module):
+        starts = {}
+
+        def pre_forward(module, input):
+            if not self.active:
+                return
+            starts['forward'] = self._now()
+            x = input[0]
+            if torch.is_tensor(x) and x.requires_grad:
+                # the gradient of the block input is ready when the block's backward is done
+                x.register_hook(lambda grad: self._end_backward(name, starts))
+
+        def post_forward(module, input, output):
+            if not self.active or 'forward' not in starts:
+                return
+            self._record(name, 'forward', starts.pop('forward'), self._now())
+            if torch.is_tensor(output) and output.requires_grad:
+                output.register_hook(lambda grad: self._begin_backward(starts))
+
+        module.register_forward_pre_hook(pre_forward)
+        module.register_forward_hook(post_forward)
+
+    def _begin_backward(self, starts):
+        starts['backward'] = self._now()
+
+    def _end_backward(self, name, starts):
+        if 'backward' in starts:
+            self._record(name, 'backward', starts.pop('backward'), self._now())
+
+    def summary(self):
+        "Per-name mean and total time in milliseconds, by category"
+        rows = {}
+        for e in self.events:
+            row = rows.setdefault((e['cat'], e['name']), [0, 0.])
+            row[0] += 1
+            row[1] += e['dur'] / 1000.
+        return rows
+
+    def report(self):
+        rows = self.summary()
+        total = sum(t for (cat, _), (_, t) in rows.items() if cat == 'phase')
+        print('Step profile over iterations [{}, {}):'.format(self.start, self.stop))
+        print('{:<10} {:<32} {:>7} {:>12} {:>12} {:>7}'.format('category', 'name', 'count', 'mean (ms)', 'total (ms)', 'phase%'))
+        for (cat, name), (count, t) in sorted(rows.items(), key=lambda r: (r[0][0] != 'phase', -r[1][1])):
+            share = '{:.1f}'.format(100. * t / total) if cat == 'phase' and total > 0 else ''
+            print('{:<10} {:<32} {:>7} {:>12.3f} {:>12.3f} {:>7}'.format(cat, name, count, t / count, t, share))
+
+        if self.trace_path is not None:
+            directory = os.path.dirname(self.trace_path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            with open(self.trace_path, 'w') as f:
+                json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+            print('Chrome trace written to', self.trace_path)
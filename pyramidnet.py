@@ -2,6 +2,7 @@
 
 import torch
 import torch.nn as nn
+from recompute import CheckpointedStages
 import math
 
 def conv3x3(in_planes, out_planes, stride=1):
@@ -23,6 +24,9 @@ class BasicBlock(nn.Module):
         self.relu = nn.ReLU(inplace=True)
         self.downsample = downsample
         self.stride = stride
+        # the shortcut keeps the input channels and is zero-padded if the block widens
+        self.shortcut_channels = inplanes
+        self.padded_shortcut = inplanes != planes * BasicBlock.outchannel_ratio
 
     def forward(self, x):
 
@@ -34,18 +38,12 @@ class BasicBlock(nn.Module):
         out = self.bn3(out)
         if self.downsample is not None:
             shortcut = self.downsample(x)
-            featuremap_size = shortcut.size()[2:4]
         else:
             shortcut = x
-            featuremap_size = out.size()[2:4]
 
-        batch_size = out.size()[0]
-        residual_channel = out.size()[1]
-        shortcut_channel = shortcut.size()[1]
-
-        if residual_channel != shortcut_channel:
-            padding = torch.autograd.Variable(torch.cuda.FloatTensor(batch_size, residual_channel - shortcut_channel, featuremap_size[0], featuremap_size[1]).fill_(0)) 
-            out += torch.cat((shortcut, padding), 1)
+        if self.padded_shortcut:
+            # zero-padded shortcut: only the leading channels receive the identity
+            out[:, :self.shortcut_channels] += shortcut
         else:
             out += shortcut 
 
@@ -68,6 +66,9 @@ class Bottleneck(nn.Module):
         
         self.downsample = downsample
         self.stride = stride
+        # the shortcut keeps the input channels and is zero-padded if the block widens
+        self.shortcut_channels = inplanes
+        self.padded_shortcut = inplanes != planes * Bottleneck.outchannel_ratio
 
     def forward(self, x):
 
@@ -85,29 +86,24 @@ class Bottleneck(nn.Module):
         out = self.bn4(out)
         if self.downsample is not None:
             shortcut = self.downsample(x)
-            featuremap_size = shortcut.size()[2:4]
         else:
             shortcut = x
-            featuremap_size = out.size()[2:4]
-
-        batch_size = out.size()[0]
-        residual_channel = out.size()[1]
-        shortcut_channel = shortcut.size()[1]
 
-        if residual_channel != shortcut_channel:
-            padding = torch.autograd.Variable(torch.cuda.FloatTensor(batch_size, residual_channel - shortcut_channel, featuremap_size[0], featuremap_size[1]).fill_(0)) 
-            out += torch.cat((shortcut, padding), 1)
+        if self.padded_shortcut:
+            # zero-padded shortcut: only the leading channels receive the identity
+            out[:, :self.shortcut_channels] += shortcut
         else:
             out += shortcut 
 
         return out
 
 
-class PyramidNet(nn.Module):
+class PyramidNet(CheckpointedStages):
         
-    def __init__(self, dataset, depth, alpha, num_classes, bottleneck=False):
+    def __init__(self, dataset, depth, alpha, num_classes, bottleneck=False, checkpoint_blocks=0):
         super(PyramidNet, self).__init__()   	
         self.dataset = dataset
+        self.checkpoint_blocks = checkpoint_blocks
         if self.dataset.startswith('cifar'):
             self.inplanes = 16
             if bottleneck == True:
@@ -122,11 +118,15 @@ class PyramidNet(nn.Module):
             self.input_featuremap_dim = self.inplanes
             self.conv1 = nn.Conv2d(3, self.input_featuremap_dim, kernel_size=3, stride=1, padding=1, bias=False)
             self.bn1 = nn.BatchNorm2d(self.input_featuremap_dim)
+            # the CIFAR stem has no activation and no pooling
+            self.relu = nn.Identity()
+            self.maxpool = nn.Identity()
 
             self.featuremap_dim = self.input_featuremap_dim 
             self.layer1 = self.pyramidal_make_layer(block, n)
             self.layer2 = self.pyramidal_make_layer(block, n, stride=2)
             self.layer3 = self.pyramidal_make_layer(block, n, stride=2)
+            self.layer4 = nn.Sequential()
 
             self.final_featuremap_dim = self.input_featuremap_dim
             self.bn_final= nn.BatchNorm2d(self.final_featuremap_dim)
@@ -195,35 +195,24 @@ class PyramidNet(nn.Module):
         return nn.Sequential(*layers)
 
     def forward(self, x):
-        if self.dataset == 'cifar10' or self.dataset == 'cifar100':
-            x = self.conv1(x)
-            x = self.bn1(x)
-            
-            x = self.layer1(x)
-            x = self.layer2(x)
-            x = self.layer3(x)
-
-            x = self.bn_final(x)
-            x = self.relu_final(x)
-            x = self.avgpool(x)
-            x = x.view(x.size(0), -1)
-            x = self.fc(x)
-
-        elif self.dataset == 'imagenet':
-            x = self.conv1(x)
-            x = self.bn1(x)
-            x = self.relu(x)
-            x = self.maxpool(x)
-
+        # the stage layout is fixed at construction, so forward is the same for every dataset
+        x = self.conv1(x)
+        x = self.bn1(x)
+        x = self.relu(x)
+        x = self.maxpool(x)
+
+        if self.checkpoint_blocks > 0 and self.training and torch.is_grad_enabled():
+            x = self.checkpointed_layers(x)
+        else:
             x = self.layer1(x)
             x = self.layer2(x)
             x = self.layer3(x)
             x = self.layer4(x)
 
-            x = self.bn_final(x)
-            x = self.relu_final(x)
-            x = self.avgpool(x)
-            x = x.view(x.size(0), -1)
-            x = self.fc(x)
+        x = self.bn_final(x)
+        x = self.relu_final(x)
+        x = self.avgpool(x)
+        x = torch.flatten(x, 1)
+        x = self.fc(x)
     
-        return x
\ No newline at end of file
+        return x
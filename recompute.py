@@ -0,0 +1,62 @@
+import torch
+import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
+
+
+def norm_layers(modules):
+    return [m for module in modules for m in module.modules()
+            if isinstance(m, nn.modules.batchnorm._BatchNorm)]
+
+
+def _segment(modules):
+    """Runs modules in sequence; every call after the first is the recomputation
+    of the backward pass, which updates scratch copies of the batch norm buffers."""
+    layers = norm_layers(modules)
+    calls = [0]
+
+    def forward(x):
+        calls[0] += 1
+        if calls[0] == 1:
+            for module in modules:
+                x = module(x)
+            return x
+        # the buffers are saved for backward, so they are swapped out rather than restored in place
+        kept = [dict(m._buffers) for m in layers]
+        for m, buffers in zip(layers, kept):
+            for name, b in buffers.items():
+                if b is not None:
+                    setattr(m, name, b.clone())
+        try:
+            for module in modules:
+                x = module(x)
+        finally:
+            for m, buffers in zip(layers, kept):
+                m._buffers.update(buffers)
+        return x
+    return forward
+
+
+def checkpoint_blocks(blocks, n, x):
+    """Runs blocks in sequence as checkpointed segments of n blocks (the last
+    one takes the remaining blocks), so that only the segment inputs are kept
+    for backward and the rest is recomputed there.
+
+    The recomputation would update running_mean, running_var and
+    num_batches_tracked of the batch norm layers a second time, so it
+    updates copies of them instead.
+    """
+    blocks = list(blocks)
+    for start in range(0, len(blocks), n):
+        x = checkpoint(_segment(blocks[start:start + n]), x, use_reentrant=True)
+    return x
+
+
+class CheckpointedStages(nn.Module):
+    "Base of the models whose stages layer1 ... layer4 can run through checkpoint_blocks"
+
+    @torch.jit.unused
+    def checkpointed_layers(self, x):
+        "Runs the stages, recomputing activations per checkpoint_blocks blocks during backward"
+        for layer in (self.layer1, self.layer2, self.layer3, self.layer4):
+            x = checkpoint_blocks(layer, self.checkpoint_blocks, x)
+        return x
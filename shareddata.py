@@ -0,0 +1,102 @@
+import hashlib
+import os
+
+import numpy as np
+import torch.utils.data
+from PIL import Image
+
+
+# bump when the layout of an export changes, so old caches are not reused
+FORMAT_VERSION = 1
+
+
+def split_name(train):
+    return 'train' if train else 'test'
+
+
+def export_cifar(dataset_class, root, directory):
+    """Decodes a torchvision CIFAR dataset once into <split>_data.npy (uint8, NHWC)
+    and <split>_targets.npy under directory. Existing exports are kept."""
+    if not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+    for train in (True, False):
+        data_path = os.path.join(directory, split_name(train) + '_data.npy')
+        targets_path = os.path.join(directory, split_name(train) + '_targets.npy')
+        if os.path.exists(data_path) and os.path.exists(targets_path):
+            continue
+        dataset = dataset_class(root, train=train, download=True)
+        # the data is written last, its presence marks the split as complete
+        for path, array in ((targets_path, np.asarray(dataset.targets, dtype=np.int64)),
+                            (data_path, np.ascontiguousarray(dataset.data, dtype=np.uint8))):
+            tmp = '%s.%d.tmp' % (path, os.getpid())
+            with open(tmp, 'wb') as f:
+                np.save(f, array)
+            os.replace(tmp, path)
+    return directory
+
+
+def source_files(dataset_class, root):
+    "Paths of the pickled batches a torchvision CIFAR class reads from root"
+    return [os.path.join(root, dataset_class.base_folder, name)
+            for name, _ in dataset_class.train_list + dataset_class.test_list]
+
+
+def cache_key(dataset_class, root):
+    """Name of the cache of a torchvision CIFAR class, derived from the name,
+    size and modification time of its source batches under root, so a
+    replaced or re-downloaded dataset gets a new cache. A file changed in
+    place with its size and mtime restored is not noticed."""
+    h = hashlib.sha1(('%s:%d' % (dataset_class.__name__, FORMAT_VERSION)).encode())
+    for path in source_files(dataset_class, root):
+        st = os.stat(path)
+        h.update(('%s:%d:%d' % (os.path.basename(path), st.st_size, st.st_mtime_ns)).encode())
+    return '%s-%s' % (dataset_class.__name__.lower(), h.hexdigest()[:16])
+
+
+def cifar_cache(dataset_class, root, cache_root):
+    """The export_cifar directory of dataset_class under cache_root, converted
+    on first use. Once it exists no torchvision dataset is built, so the
+    archive is neither checked nor unpickled again; only the source batches
+    are stat()ed for the key."""
+    if not all(os.path.exists(path) for path in source_files(dataset_class, root)):
+        dataset_class(root, train=True, download=True)
+    return export_cifar(dataset_class, root, os.path.join(cache_root, cache_key(dataset_class, root)))
+
+
+class SharedCIFAR(torch.utils.data.Dataset):
+    """CIFAR split read from an export_cifar directory.
+
+    The images are memory-mapped on first access, in the process that uses
+    them: loader workers open the file themselves instead of receiving a
+    copy, so every process that reads the same export (on /dev/shm or any
+    page-cached file) shares one copy of the decoded data.
+    Items are the same as torchvision's CIFAR datasets: (PIL image, label).
+    """
+
+    def __init__(self, directory, train=True, transform=None):
+        self.directory = directory
+        self.train = train
+        self.transform = transform
+        self.data_path = os.path.join(directory, split_name(train) + '_data.npy')
+        self.targets = np.load(os.path.join(directory, split_name(train) + '_targets.npy'))
+        self._data = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = np.load(self.data_path, mmap_mode='r')
+        return self._data
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_data'] = None
+        return state
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getitem__(self, index):
+        img = Image.fromarray(np.asarray(self.data[index]))
+        if self.transform is not None:
+            img = self.transform(img)
+        return img, int(self.targets[index])
@@ -0,0 +1,275 @@
+import argparse
+import csv
+import itertools
+import json
+import os
+import queue
+import subprocess
+import sys
+import tempfile
+import threading
+
+import torchvision.datasets as datasets
+
+import train
+from shareddata import cifar_cache
+
+
+# the training entry point, next to this file
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+
+
+parser = argparse.ArgumentParser(description='parallel experiment sweep over train.py settings')
+parser.add_argument('--name', default='sweep', type=str,
+                    help='name of the sweep; runs are named <name>_<index> (default: sweep)')
+parser.add_argument('--config', default=None, type=str,
+                    help='JSON file with "grid" (option -> list of values), "fixed" (option -> value) '
+                         'and/or "runs" (list of option -> value dicts)')
+parser.add_argument('--grid', default=[], type=str, action='append',
+                    help='option=value1,value2,... expanded as a grid, e.g. --grid process=cutmix,divmix')
+parser.add_argument('--fixed', default=[], type=str, action='append',
+                    help='option=value passed to every run, e.g. --fixed epochs=300')
+parser.add_argument('--devices', default=[], type=str, nargs='*',
+                    help='CUDA devices to run on, one run per device at a time')
+parser.add_argument('--cpu_workers', default=0, type=int,
+                    help='number of CPU runs at a time when no devices are given (default: cores / cpus_per_run)')
+parser.add_argument('--cpus_per_run', default=4, type=int,
+                    help='CPU cores pinned to each CPU run (default: 4)')
+parser.add_argument('--dataset', default='cifar100', type=str,
+                    help='dataset of the runs, decoded once into shared memory (default: cifar100)')
+parser.add_argument('--shared_dir', default=None, type=str,
+                    help='where to put the shared decoded dataset (default: /dev/shm)')
+parser.add_argument('--dry_run', dest='dry_run', action='store_true',
+                    help='only print the expanded runs')
+parser.set_defaults(dry_run=False)
+
+
+def parse_value(value):
+    if value.lower() in ('true', 'false'):
+        return value.lower() == 'true'
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value
+
+
+def parse_assignments(items, multi):
+    result = {}
+    for item in items:
+        key, _, value = item.partition('=')
+        values = [parse_value(v) for v in value.split(',')]
+        result[key] = values if multi else values[0]
+    return result
+
+
+def expand(grid, fixed, runs):
+    "Every combination of the grid (plus the explicit runs), each with the fixed options"
+    configs = [dict(run) for run in runs]
+    keys = sorted(grid)
+    for values in itertools.product(*[grid[k] for k in keys]):
+        configs.append(dict(zip(keys, values)))
+    if not configs:
+        configs = [{}]
+    return [dict(fixed, **config) for config in configs]
+
+
+def train_option(key, value):
+    """Command line arguments that set the train.py option key (its destination,
+    e.g. bottleneck, or its name, e.g. weight-decay) to value"""
+    actions = [a for a in train.parser._actions
+               if a.dest == key or '--' + key in a.option_strings]
+    if not actions:
+        raise Exception('unknown train.py option: {}'.format(key))
+    dest = actions[0].dest
+    flags = [a for a in train.parser._actions if a.dest == dest and a.nargs == 0 and isinstance(a.const, bool)]
+    if flags:
+        # store_true/store_false options such as --no-bottleneck
+        if not isinstance(value, bool):
+            raise Exception('train.py option {} is a flag, give true or false instead of {!r}'.format(key, value))
+        if value == train.parser.get_default(dest):
+            return []
+        for action in flags:
+            if action.const == value:
+                return [action.option_strings[0]]
+        raise Exception('train.py has no flag that sets {} to {}'.format(key, value))
+    if isinstance(value, bool):
+        raise Exception('train.py option {} takes a value, not {}'.format(key, value))
+    names = actions[0].option_strings
+    return ['--' + key if '--' + key in names else max(names, key=len), str(value)]
+
+
+def command(config, expname, device, shared_data):
+    cmd = [sys.executable, MAIN, '--expname', expname, '--shared_data', shared_data,
+           '--device', 'cuda' if device is not None else 'cpu']
+    for key, value in sorted(config.items()):
+        cmd += train_option(key, value)
+    return cmd
+
+
+def run_directory(expname):
+    return 'runs/%s/' % expname
+
+
+def run_one(config, expname, slot, shared_data):
+    "Runs (or resumes) one training run on a device or a set of CPU cores"
+    directory = run_directory(expname)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    device = slot if not isinstance(slot, tuple) else None
+    cmd = command(config, expname, device, shared_data)
+    if os.path.exists(directory + 'checkpoint.pth.tar'):
+        cmd += ['--resume', directory + 'checkpoint.pth.tar']
+
+    env = dict(os.environ)
+    preexec_fn = None
+    if device is not None:
+        env['CUDA_VISIBLE_DEVICES'] = str(device)
+    else:
+        env['CUDA_VISIBLE_DEVICES'] = ''
+        env['OMP_NUM_THREADS'] = str(len(slot))
+        preexec_fn = lambda: os.sched_setaffinity(0, slot)
+
+    with open(directory + 'stdout.log', 'a') as log:
+        return subprocess.call(cmd, stdout=log, stderr=subprocess.STDOUT, env=env, preexec_fn=preexec_fn)
+
+
+def read_result(expname):
+    path = run_directory(expname) + 'result.json'
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def slots(args):
+    if args.devices:
+        return list(args.devices)
+    cores = sorted(os.sched_getaffinity(0))
+    workers = args.cpu_workers or max(1, len(cores) // args.cpus_per_run)
+    per_run = max(1, len(cores) // workers)
+    # with more workers than cores, slots share cores instead of being empty
+    return [tuple(sorted(set(cores[(i * per_run + j) % len(cores)] for j in range(per_run))))
+            for i in range(workers)]
+
+
+def load_configs(args):
+    "The expanded runs of the sweep: (expnames, configs, keys that differ between runs)"
+    grid, fixed, runs = {}, {}, []
+    if args.config is not None:
+        with open(args.config) as f:
+            config = json.load(f)
+        grid.update(config.get('grid', {}))
+        fixed.update(config.get('fixed', {}))
+        runs = config.get('runs', [])
+    grid.update(parse_assignments(args.grid, multi=True))
+    fixed.update(parse_assignments(args.fixed, multi=False))
+    fixed['dataset'] = args.dataset
+
+    configs = expand(grid, fixed, runs)
+    expnames = ['%s_%03d' % (args.name, i) for i in range(len(configs))]
+    keys = sorted(set(k for c in configs for k in c if k not in fixed or k in grid))
+
+    # every run must be expressible on the command line before anything starts
+    for config in configs:
+        for key, value in config.items():
+            train_option(key, value)
+
+    # runs are named by index: a restarted sweep must expand to the same configs,
+    # otherwise finished runs of the old sweep would be taken for the new ones
+    sweep_dir = 'runs/%s/' % args.name
+    if not os.path.exists(sweep_dir):
+        os.makedirs(sweep_dir)
+    if os.path.exists(sweep_dir + 'sweep.json'):
+        with open(sweep_dir + 'sweep.json') as f:
+            stored = {run['expname']: run['config'] for run in json.load(f)}
+        changed = [e for e, c in zip(expnames, configs)
+                   if e in stored and stored[e] != json.loads(json.dumps(c))]
+        if changed:
+            raise Exception('the runs {} of sweep {} had other settings, use a new --name'.format(
+                ', '.join(changed), args.name))
+    with open(sweep_dir + 'sweep.json', 'w') as f:
+        json.dump([{'expname': e, 'config': c} for e, c in zip(expnames, configs)], f, indent=2)
+    return expnames, configs, keys
+
+
+def export_shared(args):
+    "Decodes the dataset once into shared memory, returns the --shared_data directory"
+    if args.dataset == 'cifar100':
+        dataset_class = datasets.CIFAR100
+    elif args.dataset == 'cifar10':
+        dataset_class = datasets.CIFAR10
+    else:
+        raise Exception('unknown dataset : {}'.format(args.dataset))
+    shared_root = args.shared_dir or ('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir())
+    return cifar_cache(dataset_class, '../data', shared_root)
+
+
+def slot_name(slot):
+    return 'cuda:%s' % slot if not isinstance(slot, tuple) else 'cpus %s' % (list(slot),)
+
+
+def write_summary(args, expnames, configs, keys, extra=()):
+    "Prints the results of all runs, best first, and writes them to runs/<sweep>/summary.csv"
+    rows = []
+    for expname, config in zip(expnames, configs):
+        result = read_result(expname) or {}
+        row = dict({'expname': expname}, **{k: config.get(k, '') for k in keys})
+        row.update((name, value(expname)) for name, value in extra)
+        row.update(best_err1=result.get('best_err1', ''), best_err5=result.get('best_err5', ''))
+        rows.append(row)
+    fields = ['expname'] + keys + [name for name, _ in extra] + ['best_err1', 'best_err5']
+    print('\t'.join(fields))
+    for row in sorted(rows, key=lambda r: (r['best_err1'] == '', r['best_err1'])):
+        print('\t'.join(str(row[f]) for f in fields))
+    with open('runs/%s/summary.csv' % args.name, 'w') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    args = parser.parse_args()
+    expnames, configs, keys = load_configs(args)
+
+    pending = [(e, c) for e, c in zip(expnames, configs) if read_result(e) is None]
+    print('{} runs, {} finished, {} to do'.format(len(configs), len(configs) - len(pending), len(pending)))
+    if args.dry_run:
+        for expname, config in pending:
+            print(expname, ' '.join(command(config, expname, None, '<shared>')[2:]))
+        return
+
+    shared_data = export_shared(args)
+    codes = {}
+
+    free = queue.Queue()
+    for slot in slots(args):
+        free.put(slot)
+    lock = threading.Lock()
+
+    def worker(expname, config):
+        slot = free.get()
+        try:
+            with lock:
+                print('start', expname, 'on', slot_name(slot))
+            code = run_one(config, expname, slot, shared_data)
+            with lock:
+                codes[expname] = code
+                print('done ', expname, 'exit code', code)
+                if code != 0:
+                    print('FAILED', expname, 'see', run_directory(expname) + 'stdout.log')
+        finally:
+            free.put(slot)
+
+    threads = [threading.Thread(target=worker, args=run) for run in pending]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    write_summary(args, expnames, configs, keys, extra=[('exit_code', lambda e: codes.get(e, ''))])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+import os
+import threading
+
+import pytest
+import torch
+
+import checkpoint
+from checkpoint import CheckpointWriter, atomic_save
+
+
+def counting_save(monkeypatch):
+    "Counts the torch.save calls of the writer"
+    calls = []
+    save = torch.save
+
+    def wrapped(state, f):
+        calls.append(state)
+        save(state, f)
+    monkeypatch.setattr(checkpoint.torch, 'save', wrapped)
+    return calls
+
+
+def test_interrupted_write_keeps_the_old_checkpoint(tmp_path, monkeypatch):
+    filename = str(tmp_path / 'checkpoint.pth.tar')
+    atomic_save({'epoch': 1, 'w': torch.ones(1000)}, filename)
+
+    def interrupted(state, f):
+        f.write(b'half a checkpoint')
+        raise KeyboardInterrupt
+    monkeypatch.setattr(checkpoint.torch, 'save', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        atomic_save({'epoch': 2, 'w': torch.zeros(1000)}, filename)
+
+    state = torch.load(filename)
+    assert state['epoch'] == 1 and torch.equal(state['w'], torch.ones(1000))
+
+
+def test_best_is_linked_not_saved_again(tmp_path, monkeypatch):
+    calls = counting_save(monkeypatch)
+    filename, best = str(tmp_path / 'checkpoint.pth.tar'), str(tmp_path / 'model_best.pth.tar')
+    writer = CheckpointWriter()
+    writer.save({'epoch': 1}, filename, best)
+    writer.save({'epoch': 2}, filename)
+    writer.close()
+
+    assert len(calls) == 2
+    # the best checkpoint keeps the first save, the rename of the second one does not touch it
+    assert torch.load(best)['epoch'] == 1
+    assert torch.load(filename)['epoch'] == 2
+
+
+def test_best_is_a_hard_link(tmp_path):
+    filename, best = str(tmp_path / 'checkpoint.pth.tar'), str(tmp_path / 'model_best.pth.tar')
+    writer = CheckpointWriter()
+    writer.save({'epoch': 1}, filename, best)
+    writer.close()
+    assert os.stat(filename).st_ino == os.stat(best).st_ino
+
+
+def test_state_is_snapshotted(tmp_path):
+    filename = str(tmp_path / 'checkpoint.pth.tar')
+    weight = torch.zeros(3)
+    writer = CheckpointWriter()
+    writer.save({'w': weight}, filename)
+    weight.add_(1)
+    writer.close()
+    assert torch.equal(torch.load(filename)['w'], torch.zeros(3))
+
+
+def test_pending_saves_are_bounded(tmp_path, monkeypatch):
+    release = threading.Event()
+    save = torch.save
+
+    def blocked(state, f):
+        release.wait()
+        save(state, f)
+    monkeypatch.setattr(checkpoint.torch, 'save', blocked)
+
+    writer = CheckpointWriter(max_pending=2)
+    writer.save({'epoch': 1}, str(tmp_path / 'a'))
+    writer.save({'epoch': 2}, str(tmp_path / 'b'))
+    third = threading.Thread(target=writer.save, args=({'epoch': 3}, str(tmp_path / 'c')))
+    third.start()
+    third.join(timeout=0.5)
+    assert third.is_alive(), 'a third save did not wait for the two pending ones'
+
+    release.set()
+    third.join(timeout=10)
+    assert not third.is_alive()
+    writer.close()
+    assert [torch.load(str(tmp_path / n))['epoch'] for n in 'abc'] == [1, 2, 3]
+
+
+def failing_writer(tmp_path, monkeypatch):
+    def broken(state, f):
+        raise IOError('disk full')
+    monkeypatch.setattr(checkpoint.torch, 'save', broken)
+    writer = CheckpointWriter()
+    writer.save({'epoch': 1}, str(tmp_path / 'checkpoint.pth.tar'))
+    return writer
+
+
+def test_writer_error_is_raised_by_close(tmp_path, monkeypatch):
+    writer = failing_writer(tmp_path, monkeypatch)
+    with pytest.raises(IOError, match='disk full'):
+        writer.close()
+    assert not os.path.exists(str(tmp_path / 'checkpoint.pth.tar'))
+
+
+def test_writer_error_is_raised_by_the_next_save(tmp_path, monkeypatch):
+    writer = failing_writer(tmp_path, monkeypatch)
+    # the failed write has released its slot once the writer is idle again
+    writer.slots.acquire()
+    writer.slots.release()
+    with pytest.raises(IOError, match='disk full'):
+        writer.save({'epoch': 2}, str(tmp_path / 'checkpoint.pth.tar'))
+    writer.close()
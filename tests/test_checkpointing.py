@@ -0,0 +1,54 @@
+import pytest
+import torch
+import torch.nn.functional as F
+
+import pyramidnet as PYRM
+import recompute
+import resnet as RN
+
+
+def build(net_type, checkpoint_blocks, depth=20):
+    torch.manual_seed(0)
+    if net_type == 'resnet':
+        return RN.ResNet('cifar10', depth, 10, False, checkpoint_blocks)
+    return PYRM.PyramidNet('cifar10', depth, 24, 10, False, checkpoint_blocks)
+
+
+def norm_buffers(model):
+    return {name: b for name, b in model.named_buffers()
+            if name.endswith(('running_mean', 'running_var', 'num_batches_tracked'))}
+
+
+@pytest.mark.parametrize('net_type', ['resnet', 'pyramidnet'])
+@pytest.mark.parametrize('depth, checkpoint_blocks', [(20, 1), (20, 2), (20, 3), (8, 1)])
+def test_checkpointing_keeps_running_stats(net_type, depth, checkpoint_blocks):
+    torch.manual_seed(1)
+    input = torch.randn(4, 3, 32, 32)
+    target = torch.randint(10, (4,))
+    plain, checkpointed = build(net_type, 0, depth), build(net_type, checkpoint_blocks, depth)
+    for model in (plain, checkpointed):
+        model.train()
+        for _ in range(2):
+            F.cross_entropy(model(input), target).backward()
+
+    expected = norm_buffers(plain)
+    for name, b in norm_buffers(checkpointed).items():
+        torch.testing.assert_close(b, expected[name], msg=name)
+    for (name, p), q in zip(checkpointed.named_parameters(), plain.parameters()):
+        torch.testing.assert_close(p.grad, q.grad, msg=name)
+
+
+@pytest.mark.parametrize('checkpoint_blocks, sizes', [(1, [1] * 9), (2, [2, 1] * 3), (3, [3] * 3), (4, [3] * 3)])
+def test_segments_of_n_blocks(monkeypatch, checkpoint_blocks, sizes):
+    # 3 stages of 3 blocks, every segment is checkpointed, including the last one of a stage
+    segments = []
+    segment = recompute._segment
+
+    def recording(modules):
+        segments.append(len(modules))
+        return segment(modules)
+    monkeypatch.setattr(recompute, '_segment', recording)
+
+    model = build('resnet', checkpoint_blocks).train()
+    model(torch.randn(2, 3, 32, 32)).sum().backward()
+    assert segments == sizes
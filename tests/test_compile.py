@@ -0,0 +1,68 @@
+import copy
+import sys
+
+import pytest
+import torch
+
+import pyramidnet as PYRM
+import resnet as RN
+import train
+
+
+def build(net_type):
+    torch.manual_seed(0)
+    if net_type == 'resnet':
+        return RN.ResNet('cifar10', 8, 10, False)
+    return PYRM.PyramidNet('cifar10', 8, 16, 10, False)
+
+
+def batch():
+    torch.manual_seed(1)
+    input = torch.randn(4, 3, 32, 32)
+    target = torch.randint(10, (4,))
+    lam = torch.rand(4)
+    return input, [(target, lam), (target.flip(0), 1. - lam)]
+
+
+def step(model, loss_fn, input, mixed_target):
+    model.zero_grad(set_to_none=True)
+    output, loss = loss_fn(model, input, mixed_target)
+    loss.backward()
+    return output, loss
+
+
+# torch.compile of torch 2.0 refuses python 3.11 whatever the backend, see
+# the python pin in requirements.txt
+compile_unsupported = pytest.mark.skipif(
+    sys.version_info >= (3, 11) and tuple(int(v) for v in torch.__version__.split('.')[:2]) < (2, 1),
+    reason='torch.compile needs python < 3.11 with torch 2.0')
+
+
+@compile_unsupported
+@pytest.mark.parametrize('net_type', ['resnet', 'pyramidnet'])
+def test_compiled_step_matches_eager(net_type):
+    eager = build(net_type).train()
+    compiled = copy.deepcopy(eager)
+    input, mixed_target = batch()
+
+    output, loss = step(eager, train.forward_loss, input, mixed_target)
+    # aot_eager captures the same forward and backward graphs as --compile
+    # without generating code, so no compiler toolchain is needed
+    compiled_loss_fn = torch.compile(train.forward_loss, backend='aot_eager')
+    compiled_output, compiled_loss = step(compiled, compiled_loss_fn, input, mixed_target)
+
+    torch.testing.assert_close(compiled_output, output, rtol=1e-4, atol=1e-5)
+    torch.testing.assert_close(compiled_loss, loss, rtol=1e-4, atol=1e-5)
+    for (name, p), q in zip(eager.named_parameters(), compiled.parameters()):
+        torch.testing.assert_close(q.grad, p.grad, rtol=1e-3, atol=1e-4, msg=name)
+    for (name, b), c in zip(eager.named_buffers(), compiled.buffers()):
+        torch.testing.assert_close(c, b, rtol=1e-4, atol=1e-5, msg=name)
+
+
+@pytest.mark.parametrize('net_type', ['resnet', 'pyramidnet'])
+def test_scripted_model_matches_eager(net_type):
+    model = build(net_type).eval()
+    scripted = torch.jit.script(model)
+    input, _ = batch()
+    with torch.no_grad():
+        torch.testing.assert_close(scripted(input), model(input), rtol=1e-4, atol=1e-5)
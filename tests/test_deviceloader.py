@@ -0,0 +1,68 @@
+import warnings
+
+import numpy as np
+import pytest
+import torch
+import torchvision.transforms as transforms
+from PIL import Image
+
+from deviceloader import DeviceCIFARLoader
+
+
+class Images(object):
+    "A CIFAR-like split: (n, h, w, 3) uint8 data, read-only as in SharedCIFAR, and one label per image"
+
+    def __init__(self, n, size=8, seed=0):
+        self.data = np.random.RandomState(seed).randint(0, 256, (n, size, size, 3)).astype(np.uint8)
+        self.data.setflags(write=False)
+        self.targets = list(range(n))
+
+
+def test_read_only_data_without_warning():
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        DeviceCIFARLoader(Images(4), 2, 'cpu')
+
+
+def test_every_index_once_per_epoch():
+    loader = DeviceCIFARLoader(Images(10), 4, 'cpu', seed=0)
+    epochs = [torch.cat([target for _, target in loader]) for _ in range(2)]
+    for order in epochs:
+        assert sorted(order.tolist()) == list(range(10))
+    assert epochs[0].tolist() != epochs[1].tolist()
+
+
+def test_last_partial_batch():
+    loader = DeviceCIFARLoader(Images(10), 4, 'cpu', train=False, shuffle=False)
+    assert len(loader) == 3
+    assert [input.size(0) for input, _ in loader] == [4, 4, 2]
+    assert torch.cat([target for _, target in loader]).tolist() == list(range(10))
+
+
+def test_normalization_matches_to_tensor_normalize():
+    dataset = Images(6)
+    mean, std = (0.5, 0.4, 0.3), (0.2, 0.25, 0.3)
+    loader = DeviceCIFARLoader(dataset, 6, 'cpu', train=False, shuffle=False, mean=mean, std=std)
+    transform = transforms.Compose([transforms.ToTensor(), transforms.Normalize(mean, std)])
+    expected = torch.stack([transform(Image.fromarray(np.array(image))) for image in dataset.data])
+    input, _ = next(iter(loader))
+    torch.testing.assert_close(input, expected)
+
+
+@pytest.mark.parametrize('padding', [0, 2])
+def test_crop_flip_is_a_padded_crop(padding):
+    dataset = Images(32)
+    loader = DeviceCIFARLoader(dataset, 32, 'cpu', padding=padding, seed=0)
+    images = torch.from_numpy(np.array(dataset.data)).permute(0, 3, 1, 2)
+    padded = torch.nn.functional.pad(images, (padding,) * 4)
+    size = images.size(2)
+    input = loader.crop_flip(images)
+    flips = 0
+    for image, out in zip(padded, input):
+        # RandomCrop(size, padding) followed by RandomHorizontalFlip
+        crops = [image[:, y:y + size, x:x + size] for y in range(2 * padding + 1) for x in range(2 * padding + 1)]
+        plain = any(torch.equal(out, crop) for crop in crops)
+        flipped = any(torch.equal(out, crop.flip(2)) for crop in crops)
+        assert plain or flipped
+        flips += flipped and not plain
+    assert 0 < flips < len(images)
@@ -0,0 +1,90 @@
+import sys
+
+import pytest
+import torch
+import torch.nn as nn
+
+import inference
+import pyramidnet as PYRM
+import resnet as RN
+
+
+CONFIGS = [('resnet', 8, False), ('resnet', 11, True), ('pyramidnet', 8, False), ('pyramidnet', 11, True)]
+
+
+def build(net_type, depth, bottleneck):
+    "A small CIFAR model with non-trivial batch norm parameters and statistics"
+    torch.manual_seed(0)
+    if net_type == 'resnet':
+        model = RN.ResNet('cifar10', depth, 10, bottleneck)
+    else:
+        model = PYRM.PyramidNet('cifar10', depth, 24, 10, bottleneck)
+    with torch.no_grad():
+        for m in model.modules():
+            if isinstance(m, nn.BatchNorm2d):
+                m.weight.uniform_(0.5, 1.5)
+                m.bias.uniform_(-0.5, 0.5)
+        model.train()
+        for _ in range(3):
+            model(torch.randn(8, 3, 32, 32))
+    return model.eval()
+
+
+@pytest.mark.parametrize('net_type, depth, bottleneck', CONFIGS)
+def test_folded_model_matches_eager(net_type, depth, bottleneck):
+    model = build(net_type, depth, bottleneck)
+    input = torch.randn(4, 3, 32, 32)
+    with torch.no_grad():
+        expected = model(input)
+        before = sum(isinstance(m, nn.BatchNorm2d) for m in model.modules())
+        folded = inference.fold_batchnorms(model)
+        after = sum(isinstance(m, nn.BatchNorm2d) for m in folded.modules())
+        torch.testing.assert_close(folded(input), expected, rtol=1e-4, atol=1e-4)
+    assert after < before
+
+
+def save_parallel(model, path):
+    "A train.py checkpoint: the state of the DataParallel wrapper, keys prefixed with module."
+    state_dict = nn.DataParallel(model).state_dict()
+    assert all(k.startswith('module.') for k in state_dict)
+    torch.save({'epoch': 1, 'state_dict': state_dict}, path)
+
+
+def test_load_prefixed_checkpoint(tmp_path):
+    model = build('pyramidnet', 11, True)
+    path = str(tmp_path / 'model_best.pth.tar')
+    save_parallel(model, path)
+    loaded = inference.load_model(path, 'pyramidnet', 'cifar10', 11, alpha=24, bottleneck=True)
+    assert not loaded.training
+    input = torch.randn(2, 3, 32, 32)
+    with torch.no_grad():
+        torch.testing.assert_close(loaded(input), model(input))
+
+
+def test_predict_returns_topk_per_sample(tmp_path):
+    model = build('resnet', 8, False)
+    input = torch.randn(6, 3, 32, 32)
+    with torch.no_grad():
+        expected = torch.softmax(model(input), 1).topk(3, 1)
+    path = str(tmp_path / 'model_best.pth.tar')
+    save_parallel(model, path)
+
+    predictor = inference.Predictor.from_checkpoint(path, 'resnet', 'cifar10', 8, bottleneck=False, topk=3)
+    prob, index = predictor.predict(input)
+    assert prob.shape == index.shape == (6, 3)
+    assert torch.equal(index, expected.indices)
+    torch.testing.assert_close(prob, expected.values, rtol=1e-4, atol=1e-5)
+
+
+def test_torchscript_export_round_trip(tmp_path, monkeypatch):
+    model = build('pyramidnet', 8, False)
+    path, export = str(tmp_path / 'model_best.pth.tar'), str(tmp_path / 'model.pt')
+    save_parallel(model, path)
+    monkeypatch.setattr(sys, 'argv', ['inference.py', path, '--net_type', 'pyramidnet', '--dataset', 'cifar10',
+                                      '--depth', '8', '--alpha', '24', '--no-bottleneck', '--export', export])
+    inference.main()
+
+    loaded = torch.jit.load(export)
+    input = torch.randn(3, 3, 32, 32)
+    with torch.no_grad():
+        torch.testing.assert_close(loaded(input), model(input), rtol=1e-4, atol=1e-4)
@@ -0,0 +1,125 @@
+import math
+
+import pytest
+import torch
+import torch.nn as nn
+
+import train
+from lars import LARS, param_groups
+
+
+@pytest.fixture
+def options(monkeypatch):
+    "Sets train.args from a train.py command line"
+    def parse(*argv, distributed=False):
+        args = train.parser.parse_args(list(argv))
+        args.distributed = distributed
+        monkeypatch.setattr(train, 'args', args, raising=False)
+        return args
+    return parse
+
+
+def lr_of(epoch, iteration=0, iterations=1):
+    optimizer = torch.optim.SGD([nn.Parameter(torch.zeros(1))], lr=0.)
+    train.adjust_learning_rate(optimizer, epoch, iteration, iterations)
+    return optimizer.param_groups[0]['lr']
+
+
+def test_lars_trust_ratio():
+    torch.manual_seed(0)
+    w = nn.Parameter(torch.randn(4, 3))
+    w.grad = torch.randn(4, 3)
+    before, d_p = w.detach().clone(), w.grad + 0.01 * w.detach()
+    LARS([w], lr=0.5, weight_decay=0.01, eta=0.002).step()
+
+    trust = 0.002 * before.norm() / d_p.norm()
+    torch.testing.assert_close(w.detach(), before - 0.5 * trust * d_p)
+
+
+def test_lars_zero_weight_keeps_gradient():
+    w = nn.Parameter(torch.zeros(2, 2))
+    w.grad = torch.ones(2, 2)
+    LARS([w], lr=0.1).step()
+    torch.testing.assert_close(w.detach(), torch.full((2, 2), -0.1))
+
+
+def test_lars_excludes_biases_and_batch_norm():
+    model = nn.Sequential(nn.Conv2d(3, 4, 3), nn.BatchNorm2d(4), nn.Linear(4, 2))
+    adapted, plain = param_groups(model, 1e-4)
+    assert adapted['lars'] and adapted['weight_decay'] == 1e-4
+    assert {id(p) for p in adapted['params']} == {id(model[0].weight), id(model[2].weight)}
+    assert not plain['lars'] and plain['weight_decay'] == 0.
+    assert len(plain['params']) == 4
+
+    # the excluded parameters take a plain SGD step
+    for p in model.parameters():
+        p.grad = torch.ones_like(p)
+    bias = model[2].bias.detach().clone()
+    LARS(param_groups(model, 1e-4), lr=0.1).step()
+    torch.testing.assert_close(model[2].bias.detach(), bias - 0.1)
+
+
+def test_warmup(options):
+    options('--dataset', 'cifar10', '--epochs', '300', '--lr', '0.1', '--warmup_epochs', '2')
+    assert lr_of(0, 0, 10) == pytest.approx(0.1 / 20)
+    assert lr_of(0, 9, 10) == pytest.approx(0.1 * 10 / 20)
+    assert lr_of(1, 9, 10) == pytest.approx(0.1)
+    assert lr_of(2, 0, 10) == pytest.approx(0.1)
+
+
+def test_cosine(options):
+    options('--dataset', 'cifar10', '--epochs', '10', '--lr', '0.1', '--lr_schedule', 'cosine')
+    assert lr_of(0) == pytest.approx(0.1)
+    assert lr_of(5) == pytest.approx(0.05)
+    assert lr_of(2, 1, 4) == pytest.approx(0.05 * (1 + math.cos(math.pi * 2.25 / 10)))
+    assert lr_of(10) == pytest.approx(0.)
+
+
+def test_step(options):
+    options('--dataset', 'cifar100', '--epochs', '300', '--lr', '0.1')
+    assert [lr_of(e) for e in (0, 149, 150, 224, 225)] == pytest.approx([0.1, 0.1, 0.01, 0.01, 0.001])
+    options('--dataset', 'imagenet', '--epochs', '90', '--lr', '0.1')
+    assert [lr_of(e) for e in (29, 30, 60)] == pytest.approx([0.1, 0.01, 0.001])
+
+
+def test_linear_batch_size_scaling(options):
+    options('--lr', '0.1', '--batch_size', '64', '--accum_steps', '2', '--world_size', '4',
+            '--base_batch_size', '256', distributed=True)
+    assert train.base_learning_rate() == pytest.approx(0.2)
+    options('--lr', '0.1', '--batch_size', '64', '--accum_steps', '2', '--base_batch_size', '256')
+    assert train.base_learning_rate() == pytest.approx(0.05)
+    options('--lr', '0.1', '--batch_size', '64', '--accum_steps', '2')
+    assert train.base_learning_rate() == pytest.approx(0.1)
+
+
+def test_accumulation_group_sizes(options):
+    options('--accum_steps', '3')
+    assert [train.accumulation_group_size(i, 7) for i in range(7)] == [3, 3, 3, 3, 3, 3, 1]
+    assert [train.accumulation_group_size(i, 6) for i in range(6)] == [3] * 6
+
+
+@pytest.mark.parametrize('iterations', [4, 5])
+def test_accumulated_gradients_match_full_batch(options, iterations):
+    options('--accum_steps', '2')
+    torch.manual_seed(0)
+    model = nn.Linear(5, 3)
+    batches = [(torch.randn(8, 5), torch.randint(3, (8,))) for _ in range(iterations)]
+    criterion = nn.CrossEntropyLoss()
+
+    accumulated, group = [], []
+    for i, (input, target) in enumerate(batches):
+        # the backward and update rule of train.train
+        (criterion(model(input), target) / train.accumulation_group_size(i, iterations)).backward()
+        group.append(i)
+        if (i + 1) % 2 == 0 or i + 1 == iterations:
+            accumulated.append((group, model.weight.grad.clone()))
+            model.zero_grad(set_to_none=True)
+            group = []
+
+    assert [len(g) for g, _ in accumulated] == [2] * (iterations // 2) + [1] * (iterations % 2)
+    for group, grad in accumulated:
+        input = torch.cat([batches[i][0] for i in group])
+        target = torch.cat([batches[i][1] for i in group])
+        criterion(model(input), target).backward()
+        torch.testing.assert_close(grad, model.weight.grad)
+        model.zero_grad(set_to_none=True)
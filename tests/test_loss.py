@@ -0,0 +1,85 @@
+import contextlib
+
+import pytest
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+import mixers
+import train
+
+
+def old_loss(output, mixed_target):
+    "The per-pair criterion sum mixed_loss replaced"
+    loss = 0
+    for target, weight in mixed_target:
+        loss = loss + (weight * F.cross_entropy(output, target, reduction='none')).mean()
+    return loss
+
+
+def precision(name):
+    if name == 'bf16':
+        return torch.autocast('cpu', dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+
+def mixed_targets(kind, target, index):
+    n = target.size(0)
+    if kind == 'scalar':
+        return [(target, 0.3), (target[index], 0.7)]
+    lam = torch.rand(n)
+    return [(target, lam), (target[index], 1. - lam)]
+
+
+@pytest.mark.parametrize('name', ['fp32', 'bf16'])
+@pytest.mark.parametrize('kind', ['scalar', 'per-sample'])
+def test_mixed_loss_matches_pairs(name, kind):
+    torch.manual_seed(0)
+    layer = nn.Linear(16, 100)
+    features = torch.randn(8, 16)
+    target = torch.randint(100, (8,))
+    mixed_target = mixed_targets(kind, target, torch.randperm(8))
+    tolerance = dict(rtol=1e-2, atol=1e-2) if name == 'bf16' else dict(rtol=1e-5, atol=1e-6)
+    if kind == 'scalar':
+        # the original two-target processes: (1-lam) * criterion(a) + lam * criterion(b)
+        criterion = nn.CrossEntropyLoss()
+        with precision(name):
+            output = layer(features)
+            reference = 0.3 * criterion(output, target) + 0.7 * criterion(output, mixed_target[1][0])
+            torch.testing.assert_close(old_loss(output, mixed_target), reference)
+
+    losses, grads = [], []
+    for loss_fn in (old_loss, mixers.mixed_loss):
+        layer.zero_grad()
+        with precision(name):
+            output = layer(features)
+            loss = loss_fn(output, mixed_target)
+        loss.backward()
+        losses.append(loss.float())
+        grads.append(layer.weight.grad.clone())
+
+    torch.testing.assert_close(losses[1], losses[0], **tolerance)
+    torch.testing.assert_close(grads[1], grads[0], **tolerance)
+
+
+@pytest.mark.parametrize('name', ['fp32', 'bf16'])
+def test_mixed_loss_divmix(name):
+    torch.manual_seed(0)
+    layer = nn.Linear(16, 100)
+    features = torch.randn(8, 16)
+    input = torch.randn(8, 3, 32, 32)
+    target = torch.randint(100, (8,))
+    args = train.parser.parse_args([])
+    args.divmix_prob = 1.
+    _, mixed_target = mixers.divmix(input, target, args, mixers.MixSampler(0))
+    assert len(mixed_target) == 4
+
+    criterion = nn.CrossEntropyLoss()
+    with precision(name):
+        output = layer(features)
+        # the original divmix loss
+        reference = 0.25 * sum(criterion(output, t) for t, _ in mixed_target)
+        loss = mixers.mixed_loss(output, mixed_target)
+
+    tolerance = dict(rtol=1e-2, atol=1e-2) if name == 'bf16' else dict(rtol=1e-5, atol=1e-6)
+    torch.testing.assert_close(loss.float(), reference.float(), **tolerance)
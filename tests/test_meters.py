@@ -0,0 +1,59 @@
+import pytest
+import torch
+
+import train
+
+
+def old_accuracy(output, target, topk=(1,)):
+    "The per-k implementation of the original train.py"
+    maxk = max(topk)
+    batch_size = target.size(0)
+
+    _, pred = output.topk(maxk, 1, True, True)
+    pred = pred.t()
+    correct = pred.eq(target.view(1, -1).expand_as(pred))
+
+    res = []
+    for k in topk:
+        correct_k = correct[:k].reshape(-1).float().sum(0, keepdim=True)
+        wrong_k = batch_size - correct_k
+        res.append(wrong_k.mul_(100.0 / batch_size))
+    return res
+
+
+@pytest.mark.parametrize('topk', [(1,), (1, 5), (5, 1, 3)])
+def test_accuracy_matches_original(topk):
+    torch.manual_seed(0)
+    for batch_size in (1, 7, 64):
+        output = torch.randn(batch_size, 10)
+        # a few certain hits next to random targets
+        target = torch.randint(10, (batch_size,))
+        target[:batch_size // 2] = output[:batch_size // 2].argmax(1)
+        for err, old in zip(train.accuracy(output, target, topk), old_accuracy(output, target, topk)):
+            torch.testing.assert_close(err.reshape(1), old)
+
+
+def test_device_meter_reads_back_only_on_access(monkeypatch):
+    meter, reference = train.DeviceAverageMeter(), train.AverageMeter()
+    values = [torch.tensor(v) for v in (1.5, 2., 4.25)]
+
+    def sync(*args):
+        raise AssertionError('the meter read a device value back during update')
+
+    with monkeypatch.context() as m:
+        m.setattr(torch.Tensor, 'item', sync)
+        m.setattr(torch.Tensor, '__float__', sync)
+        for n, value in enumerate(values, 1):
+            meter.update(value, n)
+    for n, value in enumerate(values, 1):
+        reference.update(float(value), n)
+
+    assert meter.count == reference.count
+    assert meter.val == pytest.approx(reference.val)
+    assert meter.sum == pytest.approx(reference.sum)
+    assert meter.avg == pytest.approx(reference.avg)
+
+
+def test_empty_meters():
+    assert train.DeviceAverageMeter().avg == 0.
+    assert train.AverageMeter().avg == 0
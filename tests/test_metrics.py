@@ -0,0 +1,69 @@
+import csv
+import json
+import os
+import threading
+
+import torch
+
+import metrics
+import train
+from metrics import MetricsSink
+
+
+def test_default_writes_nothing():
+    assert train.parser.get_default('metrics_format') == 'none'
+    sink = MetricsSink()
+    sink.log('step', loss=torch.tensor(1.))
+    assert not sink.enabled and sink.buffer == []
+    sink.close()
+
+
+def test_close_flushes_jsonl(tmp_path):
+    # a long interval, so only close() can write the records
+    sink = MetricsSink(str(tmp_path), 'jsonl', flush_interval=3600.)
+    sink.log('step', iteration=0, loss=torch.tensor(2.5))
+    sink.log('step', iteration=1, loss=torch.tensor(1.5))
+    sink.log('val', epoch=0, err1=40.)
+    sink.close()
+
+    with open(os.path.join(str(tmp_path), 'step.jsonl')) as f:
+        steps = [json.loads(line) for line in f]
+    assert [r['iteration'] for r in steps] == [0, 1]
+    assert [r['loss'] for r in steps] == [2.5, 1.5]
+    with open(os.path.join(str(tmp_path), 'val.jsonl')) as f:
+        assert json.loads(f.read())['err1'] == 40.
+
+
+def test_csv_header_written_once(tmp_path):
+    for run in range(2):
+        sink = MetricsSink(str(tmp_path), 'csv', flush_interval=3600.)
+        sink.log('train', epoch=run, loss=torch.tensor(float(run)))
+        sink.close()
+
+    with open(os.path.join(str(tmp_path), 'train.csv')) as f:
+        lines = f.read().splitlines()
+    assert lines[0] == 'epoch,loss,time'
+    assert len(lines) == 3
+    rows = list(csv.DictReader(lines))
+    assert [(r['epoch'], float(r['loss'])) for r in rows] == [('0', 0.), ('1', 1.)]
+
+
+def test_tensors_converted_off_main_thread(tmp_path, monkeypatch):
+    threads = []
+
+    def number(value):
+        if torch.is_tensor(value):
+            threads.append(threading.current_thread())
+        return convert(value)
+    convert = metrics._number
+    monkeypatch.setattr(metrics, '_number', number)
+
+    sink = MetricsSink(str(tmp_path), 'jsonl', flush_interval=3600.)
+    loss = torch.tensor(3., requires_grad=True) * 2
+    sink.log('step', loss=loss)
+    # log only keeps a detached tensor, the conversion is left to the writer
+    assert torch.is_tensor(sink.buffer[0][1]['loss']) and not sink.buffer[0][1]['loss'].requires_grad
+    assert threads == []
+    sink.close()
+
+    assert len(threads) == 1 and threads[0] is not threading.main_thread()
@@ -0,0 +1,267 @@
+import numpy as np
+import pytest
+import torch
+import torch.nn as nn
+
+import mixers
+import train
+
+
+def mix_args(**options):
+    args = train.parser.parse_args([])
+    for name, value in options.items():
+        setattr(args, name, value)
+    return args
+
+
+class Recorder(mixers.MixSampler):
+    "Per-batch sampler that keeps its draws, to replay them through the original code"
+
+    def __init__(self, seed):
+        super(Recorder, self).__init__(seed)
+        self.draws = []
+
+    def rand(self, n, device):
+        u = super(Recorder, self).rand(n, device)
+        self.draws.append(u[0].item())
+        return u
+
+    def randint(self, high, n, device):
+        r = super(Recorder, self).randint(high, n, device)
+        self.draws.append(int(r[0]))
+        return r
+
+    def randperm(self, n, device):
+        index = super(Recorder, self).randperm(n, device)
+        self.draws.append(index)
+        return index
+
+    def beta(self, alpha, n, device):
+        lam = super(Recorder, self).beta(alpha, n, device)
+        self.draws.append(lam[0].item())
+        return lam
+
+
+def old_holes(input, draws, n_holes, length, value):
+    "The cutout/softcutout mask of the original train.py"
+    h = input.size()[2]
+    w = input.size()[3]
+    mask = np.ones((h, w), np.float32)
+    for n in range(n_holes):
+        y = next(draws)
+        x = next(draws)
+
+        y1 = np.clip(y - length // 2, 0, h)
+        y2 = np.clip(y + length // 2, 0, h)
+        x1 = np.clip(x - length // 2, 0, w)
+        x2 = np.clip(x + length // 2, 0, w)
+
+        mask[y1: y2, x1: x2] = value
+    return input * torch.from_numpy(mask).expand_as(input)
+
+
+def old_rand_bbox(size, lam, draws):
+    W = size[2]
+    H = size[3]
+    cut_rat = np.sqrt(1. - lam)
+    cut_w = int(W * cut_rat)
+    cut_h = int(H * cut_rat)
+
+    cx = next(draws)
+    cy = next(draws)
+
+    bbx1 = np.clip(cx - cut_w // 2, 0, W)
+    bby1 = np.clip(cy - cut_h // 2, 0, H)
+    bbx2 = np.clip(cx + cut_w // 2, 0, W)
+    bby2 = np.clip(cy + cut_h // 2, 0, H)
+    return bbx1, bby1, bbx2, bby2
+
+
+def old_process(process, input, target, args, draws):
+    """The per-batch branches of the original train() with the random draws
+    taken from draws; returns the input and the loss as a function of the output"""
+    input = input.clone()
+    criterion = nn.CrossEntropyLoss()
+    same = lambda output: criterion(output, target)
+    if process == 'cutout':
+        r = next(draws)
+        holes = [next(draws) for _ in range(2 * args.cutout_n_holes)]
+        if args.beta > 0 and r < args.cutout_prob:
+            input = old_holes(input, iter(holes), args.cutout_n_holes, args.cutout_length, 0.)
+        return input, same
+    if process == 'softcutout':
+        r = next(draws)
+        holes = [next(draws) for _ in range(2 * args.softcutout_n_holes)]
+        if args.beta > 0 and r < args.softcutout_prob:
+            input = old_holes(input, iter(holes), args.softcutout_n_holes, args.softcutout_length,
+                              args.softcutout_alpha)
+        return input, same
+    if process == 'mixup':
+        lam = next(draws)
+        index = next(draws)
+        input = lam * input + (1 - lam) * input[index, :]
+        return input, lambda output: lam * criterion(output, target) + (1 - lam) * criterion(output, target[index])
+    if process == 'cutmix':
+        r = next(draws)
+        lam = next(draws)
+        rand_index = next(draws)
+        bbox = [next(draws) for _ in range(2)]
+        if not (args.beta > 0 and r < args.cutmix_prob):
+            return input, same
+        bbx1, bby1, bbx2, bby2 = old_rand_bbox(input.size(), lam, iter(bbox))
+        input[:, :, bbx1:bbx2, bby1:bby2] = input[rand_index, :, bbx1:bbx2, bby1:bby2]
+        lam = 1 - ((bbx2 - bbx1) * (bby2 - bby1) / (input.size()[-1] * input.size()[-2]))
+        return input, lambda output: criterion(output, target) * lam + criterion(output, target[rand_index]) * (1. - lam)
+    if process == 'cutmixup':
+        r = next(draws)
+        mixuplam = next(draws)
+        cutmixlam = next(draws)
+        rand_index = next(draws)
+        bbox = [next(draws) for _ in range(2)]
+        if not (args.beta > 0 and r < args.cutmixup_prob):
+            return input, same
+        bbx1, bby1, bbx2, bby2 = old_rand_bbox(input.size(), cutmixlam, iter(bbox))
+        input[:, :, bbx1:bbx2, bby1:bby2] = mixuplam * input[:, :, bbx1:bbx2, bby1:bby2] + (1-mixuplam) * input[rand_index, :, bbx1:bbx2, bby1:bby2]
+        cutmixlam = 1 - ((bbx2 - bbx1) * (bby2 - bby1) / (input.size()[-1] * input.size()[-2]))
+        return input, lambda output: (criterion(output, target) * (1. - (1. - cutmixlam) * (1. - mixuplam)) +
+                                      criterion(output, target[rand_index]) * (1. - cutmixlam) * (1. - mixuplam))
+    if process == 'divmix':
+        r = next(draws)
+        rand_index1, rand_index2, rand_index3 = next(draws), next(draws), next(draws)
+        if not r < args.divmix_prob:
+            return input, same
+        h = input.size()[2]
+        w = input.size()[3]
+        input[:, :, w//2:w, 0:h//2] = input[rand_index1, :, w//2:w, 0:h//2]
+        input[:, :, 0:w//2, h//2:h] = input[rand_index2, :, 0:w//2, h//2:h]
+        input[:, :, w//2:w, h//2:h] = input[rand_index3, :, w//2:w, h//2:h]
+        return input, lambda output: 0.25 * (criterion(output, target) + criterion(output, target[rand_index1]) +
+                                             criterion(output, target[rand_index2]) + criterion(output, target[rand_index3]))
+    raise Exception(process)
+
+
+@pytest.mark.parametrize('prob', [0., 1.])
+@pytest.mark.parametrize('process', ['cutout', 'softcutout', 'mixup', 'cutmix', 'cutmixup', 'divmix'])
+def test_mixer_matches_original_process(process, prob):
+    args = mix_args(beta=1., cutout_prob=prob, softcutout_prob=prob, cutmix_prob=prob, cutmixup_prob=prob,
+                    divmix_prob=prob, cutout_n_holes=2, softcutout_n_holes=3, softcutout_alpha=0.5)
+    for seed in range(5):
+        torch.manual_seed(seed)
+        input = torch.randn(8, 3, 32, 32)
+        target = torch.randint(100, (8,))
+        output = torch.randn(8, 100)
+
+        sampler = Recorder(seed)
+        mixed, mixed_target = mixers.get_mixer(process)(input, target, args, sampler)
+        expected, loss = old_process(process, input, target, args, iter(sampler.draws))
+
+        torch.testing.assert_close(mixed, expected)
+        torch.testing.assert_close(mixers.mixed_loss(output, mixed_target), loss(output))
+
+
+def old_fademixup(input, lam):
+    "The ring loop of the original train.py, on a copy of input"
+    input = input.clone()
+    h, w = input.size()[2], input.size()[3]
+    shorter = min(h,w)
+    lam_unit = lam / ((1/6) * (shorter/2) * (shorter/2 + 1) * (shorter/2 - 4))
+    for i in range(shorter//2):
+        w_i = (i*w)//shorter
+        w_next = ((i+1)*w)//shorter
+        h_i = (i*h)//shorter
+        h_next = ((i+1)*h)//shorter
+        lam_i = i * lam_unit
+        input[:,:,w_i:w-w_i,h_i:h-h_i-1] = (1-lam_i) * input[:,:,w_i:w-w_i,h_i:h-h_i-1] + lam_i * input[:,:,w_i:w-w_i,h_i:h-h_i-1]
+        input[:,:,w-w_next:w-w_i,h_i+1:h-h_i] = (1-lam_i) * input[:,:,w-w_next:w-w_i,h_i+1:h-h_i] + lam_i * input[:,:,w-w_next:w-w_i,h_i+1:h-h_i]
+        input[:,:,w_i+1:w-w_i,h_i:h_next] = (1-lam_i) * input[:,:,w_i+1:w-w_i,h_i:h_next] + lam_i * input[:,:,w_i+1:w-w_i,h_i:h_next]
+        input[:,:,w_i:w-w_i-1,h-h_next:h-h_i] = (1-lam_i) * input[:,:,w_i:w-w_i-1,h-h_next:h-h_i] + lam_i * input[:,:,w_i:w-w_i-1,h-h_next:h-h_i]
+    return input
+
+
+@pytest.mark.parametrize('size', [(32, 32), (24, 40)])
+def test_fademixup_matches_ring_loop(size):
+    torch.manual_seed(0)
+    input = torch.randn(8, 3, *size)
+    target = torch.randint(100, (8,))
+    output = torch.randn(8, 100)
+    args = mix_args(fademixup_alpha=1.)
+
+    mixed, mixed_target = mixers.fademixup(input, target, args, mixers.MixSampler(0))
+    # the same draws as the mixer
+    sampler = mixers.MixSampler(0)
+    lam = sampler.beta(args.fademixup_alpha, 8, input.device)[0].item()
+    index = sampler.randperm(8, input.device)
+
+    torch.testing.assert_close(mixed, old_fademixup(input, lam))
+    criterion = nn.CrossEntropyLoss()
+    old_loss = (1-lam) * criterion(output, target) + lam * criterion(output, target[index])
+    torch.testing.assert_close(mixers.mixed_loss(output, mixed_target), old_loss)
+
+
+def test_fademixup_blend():
+    torch.manual_seed(0)
+    input = torch.randn(8, 3, 24, 40)
+    target = torch.randint(100, (8,))
+    args = mix_args(fademixup_alpha=1., fademixup_blend=True)
+
+    mixed, _ = mixers.fademixup(input, target, args, mixers.MixSampler(0))
+    sampler = mixers.MixSampler(0)
+    lam = sampler.beta(args.fademixup_alpha, 8, input.device)[0].item()
+    index = sampler.randperm(8, input.device)
+
+    # the outer ring is kept, the centre (ring 11 of s = 24) takes lam * 11 / unit of the shuffled batch
+    torch.testing.assert_close(mixed[:, :, 0], input[:, :, 0])
+    weight = lam * 11 / ((1/6) * 12 * 13 * 8)
+    torch.testing.assert_close(mixed[:, :, 12, 20], (1 - weight) * input[:, :, 12, 20] + weight * input[index, :, 12, 20])
+
+
+@pytest.mark.parametrize('size', [(8, 8), (8, 32), (4, 4)])
+def test_fademixup_small_images(size):
+    input = torch.randn(2, 3, *size)
+    target = torch.zeros(2, dtype=torch.long)
+    # without rings to blend the image is kept, as before
+    mixed, _ = mixers.fademixup(input, target, mix_args(), mixers.MixSampler(0))
+    assert mixed is input
+    with pytest.raises(Exception, match='larger than 8x8'):
+        mixers.fademixup(input, target, mix_args(fademixup_blend=True), mixers.MixSampler(0))
+
+
+def old_aroundmix(input, alpha):
+    "The eight slice updates of the original train.py"
+    h = input.size()[2]
+    w = input.size()[3]
+
+    inputi = input.clone()
+    inputi = inputi * (1 - alpha * 8)
+    inputi[:,:,0:w-1,:] = inputi[:,:,0:w-1,:] + alpha * input[:,:,1:w,:]
+    inputi[:,:,0:w-1,0:h-1] = inputi[:,:,0:w-1,0:h-1] + alpha * input[:,:,1:w,1:h]
+    inputi[:,:,:,0:h-1] = inputi[:,:,:,0:h-1] + alpha * input[:,:,:,1:h]
+    inputi[:,:,1:w,0:h-1] = inputi[:,:,1:w,0:h-1] + alpha * input[:,:,0:w-1,1:h]
+    inputi[:,:,1:w,:] = inputi[:,:,1:w,:] + alpha * input[:,:,0:w-1,:]
+    inputi[:,:,1:w,1:h] = inputi[:,:,1:w,1:h] + alpha * input[:,:,0:w-1,0:h-1]
+    inputi[:,:,:,1:h] = inputi[:,:,:,1:h] + alpha * input[:,:,:,0:h-1]
+    inputi[:,:,0:w-1,1:h] = inputi[:,:,0:w-1,1:h] + alpha * input[:,:,1:w,0:h-1]
+    return inputi
+
+
+@pytest.mark.parametrize('size', [32, 24])
+@pytest.mark.parametrize('alpha', [0.05, 1.])
+def test_aroundmix_matches_slices(size, alpha):
+    torch.manual_seed(0)
+    input = torch.randn(8, 3, size, size)
+    target = torch.randint(100, (8,))
+    args = mix_args(aroundmix_alpha=alpha, aroundmix_prob=0.5)
+
+    mixed, mixed_target = mixers.aroundmix(input, target, args, mixers.MixSampler(0, per_sample=True))
+    apply = mixers.MixSampler(0, per_sample=True).rand(8, input.device) < args.aroundmix_prob
+
+    expected = torch.where(apply.view(-1, 1, 1, 1), old_aroundmix(input, alpha), input)
+    torch.testing.assert_close(mixed, expected)
+    assert len(mixed_target) == 1 and mixed_target[0][0] is target and mixed_target[0][1] == 1.
+
+
+def test_aroundmix_off():
+    input = torch.randn(2, 3, 32, 32)
+    target = torch.zeros(2, dtype=torch.long)
+    mixed, _ = mixers.aroundmix(input, target, mix_args(aroundmix_prob=0.), mixers.MixSampler(0))
+    assert mixed is input
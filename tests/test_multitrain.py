@@ -0,0 +1,31 @@
+import pytest
+
+import multitrain
+
+
+def test_member_options():
+    args = multitrain.member_args(['--epochs', '2'], '--net_type resnet --depth 20 --expname a')
+    assert (args.net_type, args.depth, args.epochs, args.expname) == ('resnet', 20, 2, 'a')
+
+
+@pytest.mark.parametrize('override', ['--data_cache /tmp/other', '--imagenet_dir /tmp/other',
+                                      '--shared_data /tmp/other', '--workers 7', '--no-verbose'])
+def test_member_cannot_change_loader_options(override):
+    with pytest.raises(Exception, match='must be the same for all members'):
+        multitrain.member_args(['--data_cache', '/tmp/cache'], '--expname a ' + override)
+
+
+@pytest.mark.parametrize('option', ['--compile', '--resume runs/a/checkpoint.pth.tar', '--stop_epoch 1',
+                                    '--profile_steps 5'])
+def test_unsupported_options_are_rejected(option):
+    with pytest.raises(Exception, match='does not support'):
+        multitrain.member_args([], '--expname a ' + option)
+    with pytest.raises(Exception, match='does not support'):
+        multitrain.member_args(option.split(), '--expname a')
+
+
+def test_member_checkpoint_blocks_reach_the_model():
+    args = multitrain.member_args(['--dataset', 'cifar10', '--device', 'cpu'],
+                                  '--net_type resnet --depth 8 --expname a --checkpoint_blocks 2')
+    member = multitrain.Member(args, 10)
+    assert member.model.module.checkpoint_blocks == 2
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from imagenetshards import ShardSampler
+from train import SplitSampler
+
+
+class Shards(object):
+    "The index of a ShardedImageFolder with the given shard sizes"
+
+    def __init__(self, sizes):
+        self.index = np.zeros((sum(sizes), 4), dtype=np.int64)
+        self.index[:, 0] = np.repeat(np.arange(len(sizes)), sizes)
+
+    def __len__(self):
+        return len(self.index)
+
+
+@pytest.mark.parametrize('num_replicas', [1, 2, 3, 4])
+def test_shard_sampler_evaluation_sees_every_sample_once(num_replicas):
+    dataset = Shards([5, 3, 7, 1])
+    samplers = [ShardSampler(dataset, shuffle=False, num_replicas=num_replicas, rank=r)
+                for r in range(num_replicas)]
+    indices = [list(s) for s in samplers]
+    assert [len(i) for i in indices] == [len(s) for s in samplers]
+    assert sorted(i for part in indices for i in part) == list(range(len(dataset)))
+
+
+def test_shard_sampler_training_keeps_shards_apart():
+    dataset = Shards([4, 4, 4, 4])
+    parts = [set(ShardSampler(dataset, num_replicas=2, rank=r)) for r in range(2)]
+    assert not parts[0] & parts[1]
+    assert all(len(p) == 8 for p in parts)
+
+
+@pytest.mark.parametrize('sizes, num_replicas', [([10], 2), ([7, 3], 2), ([1, 9, 2], 3), ([3, 3], 4)])
+def test_shard_sampler_training_splits_samples_across_ranks(sizes, num_replicas):
+    dataset = Shards(sizes)
+    for epoch in range(3):
+        parts = []
+        for r in range(num_replicas):
+            sampler = ShardSampler(dataset, num_replicas=num_replicas, rank=r)
+            sampler.set_epoch(epoch)
+            parts.append(list(sampler))
+        assert all(len(p) == len(dataset) // num_replicas for p in parts)
+        seen = [i for part in parts for i in part]
+        # no repeats within or across ranks, only the remainder is left out
+        assert len(set(seen)) == len(seen)
+        assert len(dataset) - len(seen) == len(dataset) % num_replicas
+
+
+def test_shard_sampler_training_reads_shards_in_runs():
+    dataset = Shards([7, 3])
+    for rank in range(2):
+        shards = dataset.index[list(ShardSampler(dataset, num_replicas=2, rank=rank)), 0]
+        assert np.count_nonzero(np.diff(shards)) <= 1
+
+
+@pytest.mark.parametrize('num_replicas', [1, 2, 3, 8])
+def test_split_sampler_sees_every_sample_once(num_replicas):
+    dataset = list(range(10))
+    parts = [list(SplitSampler(dataset, num_replicas, r)) for r in range(num_replicas)]
+    assert [i for part in parts for i in part] == dataset
+    assert max(len(p) for p in parts) - min(len(p) for p in parts) <= 1
@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+
+from shareddata import SharedCIFAR, cache_key, cifar_cache
+
+
+class FakeCIFAR(object):
+    "The parts of a torchvision CIFAR class cifar_cache uses; download writes the batch files"
+
+    base_folder = 'fake-batches-py'
+    train_list = [['data_batch_1', '0'], ['data_batch_2', '0']]
+    test_list = [['test_batch', '0']]
+    built = []
+
+    def __init__(self, root, train=True, download=False):
+        FakeCIFAR.built.append((train, download))
+        directory = os.path.join(root, self.base_folder)
+        if download and not os.path.exists(directory):
+            os.makedirs(directory)
+            for name, _ in self.train_list + self.test_list:
+                with open(os.path.join(directory, name), 'wb') as f:
+                    f.write(b'batch')
+        # the value of every pixel is the size of the first batch file
+        value = os.path.getsize(os.path.join(directory, 'data_batch_1')) % 256
+        n = 4 if train else 2
+        self.data = np.full((n, 2, 2, 3), value, dtype=np.uint8)
+        self.targets = list(range(n))
+
+
+def test_cache_is_reused(tmp_path):
+    root, cache = str(tmp_path / 'data'), str(tmp_path / 'cache')
+    FakeCIFAR.built = []
+    first = cifar_cache(FakeCIFAR, root, cache)
+    assert (True, True) in FakeCIFAR.built
+    FakeCIFAR.built = []
+    assert cifar_cache(FakeCIFAR, root, cache) == first
+    assert FakeCIFAR.built == []
+    assert len(SharedCIFAR(first, train=True)) == 4 and len(SharedCIFAR(first, train=False)) == 2
+
+
+def test_changed_source_gets_a_new_cache(tmp_path):
+    root, cache = str(tmp_path / 'data'), str(tmp_path / 'cache')
+    first = cifar_cache(FakeCIFAR, root, cache)
+    key = cache_key(FakeCIFAR, root)
+
+    # a corrupted or replaced batch file
+    with open(os.path.join(root, FakeCIFAR.base_folder, 'data_batch_1'), 'wb') as f:
+        f.write(b'another batch')
+    assert cache_key(FakeCIFAR, root) != key
+    second = cifar_cache(FakeCIFAR, root, cache)
+    assert second != first
+    assert SharedCIFAR(second).data[0, 0, 0, 0] == len(b'another batch')
+    assert SharedCIFAR(first).data[0, 0, 0, 0] == len(b'batch')
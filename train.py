@@ -1,29 +1,35 @@
 import argparse
+import contextlib
+import json
+import math
 import os
-import shutil
 import time
 
 import torch
-import torchvision
 import torchvision.transforms as transforms
 import torchvision.datasets as datasets
-import torchvision.models as models
 
 import torch.nn as nn
 import torch.nn.parallel
 import torch.backends.cudnn as cudnn
-import torch.nn.functional as F
+import torch.distributed as dist
+import torch.multiprocessing as mp
 
 import torch.optim as optim
 import torch.utils.data
 import torch.utils.data.distributed
 
-from torch.autograd import Variable
-import numpy as np
-import copy
-
 import resnet as RN
 import pyramidnet as PYRM
+import mixers
+from deviceloader import DeviceCIFARLoader
+from prefetcher import Prefetcher
+from checkpoint import CheckpointWriter
+from profiler import StepProfiler
+from metrics import MetricsSink
+from shareddata import SharedCIFAR, cifar_cache
+from lars import LARS, param_groups as lars_param_groups
+from imagenetshards import ShardedImageFolder, ShardSampler, imagenet_transforms
 
 
 parser = argparse.ArgumentParser(description='thesis')
@@ -83,6 +89,9 @@ parser.add_argument('--fademixup_alpha', default=1, type=float,
                     help='fademixup interpolation coefficient (default: 1)')
 parser.add_argument('--fademixup_prob', default=0, type=float,
                     help='fademixup probability')
+parser.add_argument('--fademixup_blend', dest='fademixup_blend', action='store_true',
+                    help='blend the rings of fademixup with the shuffled batch (default: keep the image '
+                         'and only mix the targets, as the original ring loop did)')
 parser.add_argument('--softcutout_prob', default=0, type=float,
                     help='softcutout probability')
 parser.add_argument('--softcutout_n_holes', type=int, default=1,
@@ -91,22 +100,238 @@ parser.add_argument('--softcutout_length', type=int, default=16,
                     help='length of the holes')
 parser.add_argument('--softcutout_alpha', type=float, default=1.0,
                     help='softcutout strength')
+parser.add_argument('--mix_seed', type=int, default=None,
+                    help='seed of the on-device generator used by the augmentation process (default: random)')
+parser.add_argument('--mix_per_sample', dest='mix_per_sample', action='store_true',
+                    help='draw lambdas, boxes and probabilities per sample instead of per batch')
+parser.add_argument('--device_loader', dest='device_loader', action='store_true',
+                    help='keep the CIFAR dataset on the device and augment whole batches there (no loader workers)')
+parser.add_argument('--prefetch', default=0, type=int, metavar='N',
+                    help='number of batches copied and augmented ahead of the training step (default: 0, off)')
+parser.add_argument('--device', default='cuda', type=str,
+                    help='device to train on (default: cuda)')
+parser.add_argument('--precision', default='fp32', type=str, choices=['fp32', 'fp16', 'bf16'],
+                    help='autocast precision of the forward pass and loss (default: fp32)')
+parser.add_argument('--eval_batch_size', default=512, type=int, metavar='N',
+                    help='mini-batch size of the validation pass (default: 512)')
+parser.add_argument('--eval_every', default=1, type=int, metavar='N',
+                    help='validate every N epochs, the last epoch is always validated (default: 1)')
+parser.add_argument('--eval_subset', default=0, type=int, metavar='N',
+                    help='validate intermediate epochs on the first N test samples only; the best model '
+                         'is tracked on full passes (default: 0, always full)')
+parser.add_argument('--checkpoint_blocks', default=0, type=int, metavar='N',
+                    help='recompute activations in segments of N blocks during backward (default: 0, off)')
+parser.add_argument('--max_pending_saves', default=1, type=int, metavar='N',
+                    help='number of checkpoints written in the background at the same time (default: 1)')
+parser.add_argument('--profile_steps', default=0, type=int, metavar='N',
+                    help='time the phases of N training iterations and write a Chrome trace to runs/<expname>/ (default: 0, off)')
+parser.add_argument('--profile_start', default=10, type=int, metavar='N',
+                    help='first profiled training iteration, counted over all epochs (default: 10)')
+parser.add_argument('--profile_modules', dest='profile_modules', action='store_true',
+                    help='also time the forward/backward pass of every block of layer1-layer4')
+parser.add_argument('--metrics_format', default='none', type=str, choices=['none', 'jsonl', 'csv'],
+                    help='format of the step/epoch metric files written to runs/<expname>/metrics/ (default: none)')
+parser.add_argument('--shared_data', default=None, type=str,
+                    help='directory of a CIFAR export (see shareddata.export_cifar) to read instead of ../data')
+parser.add_argument('--data_cache', default='../data/cache', type=str,
+                    help='directory of the memory-mapped CIFAR cache, converted on first use and used by default; '
+                         'empty to read the torchvision dataset directly, as before the cache (default: ../data/cache)')
+parser.add_argument('--imagenet_dir', default='../data/imagenet-shards', type=str,
+                    help='directory with the train/ and val/ shards of imagenetshards.py convert')
+parser.add_argument('--resume', default=None, type=str,
+                    help='checkpoint to resume training from')
+parser.add_argument('--stop_epoch', default=0, type=int, metavar='N',
+                    help='stop after N epochs of the --epochs schedule, with a full validation and a '
+                         'checkpoint to resume from (default: 0, train all epochs)')
+parser.add_argument('--lr_schedule', default='step', type=str, choices=['step', 'cosine'],
+                    help='learning rate schedule, updated every iteration (default: step, the epoch decay)')
+parser.add_argument('--warmup_epochs', default=0, type=float, metavar='N',
+                    help='linear learning rate warmup over the first N epochs (default: 0, off)')
+parser.add_argument('--base_batch_size', default=0, type=int, metavar='N',
+                    help='scale --lr linearly by the effective batch size (batch_size * accum_steps * world_size) '
+                         'over N (default: 0, no scaling)')
+parser.add_argument('--optimizer', default='sgd', type=str, choices=['sgd', 'lars'],
+                    help='optimizer: Nesterov SGD, or LARS for large batches (default: sgd)')
+parser.add_argument('--lars_eta', default=0.001, type=float,
+                    help='LARS trust coefficient (default: 0.001)')
+parser.add_argument('--accum_steps', default=1, type=int, metavar='N',
+                    help='accumulate the gradients of N batches per optimizer step (default: 1)')
+parser.add_argument('--compile', dest='compile', action='store_true',
+                    help='compile the forward pass and mixed loss (and so their backward) with torch.compile; '
+                         'without --world_size the model runs on a single device')
+parser.add_argument('--compile_mode', default='default', type=str,
+                    choices=['default', 'reduce-overhead', 'max-autotune'],
+                    help='torch.compile mode of --compile (default: default)')
+parser.add_argument('--world_size', default=1, type=int, metavar='N',
+                    help='number of distributed processes, one per device; --batch_size is per process (default: 1, DataParallel)')
+parser.add_argument('--dist_backend', default='nccl', type=str,
+                    help='distributed backend: nccl, or gloo for CPU (default: nccl)')
+parser.add_argument('--dist_url', default='tcp://127.0.0.1:23456', type=str,
+                    help='url used to set up distributed training')
 
 
 
 parser.set_defaults(bottleneck=True)
 parser.set_defaults(verbose=True)
+parser.set_defaults(mix_per_sample=False)
+parser.set_defaults(fademixup_blend=False)
+parser.set_defaults(device_loader=False)
+parser.set_defaults(profile_modules=False)
+parser.set_defaults(compile=False)
 
 best_err1 = 100
 best_err5 = 100
+checkpoint_writer = None
+# disabled unless --profile_steps is given
+step_profiler = StepProfiler(0, 0)
+metrics_sink = MetricsSink()
+# replaced by its compiled version with --compile
+step_loss = None
+
+PRECISIONS = {'fp32': torch.float32, 'fp16': torch.float16, 'bf16': torch.bfloat16}
 
 
 def main():
 
-    global args, best_err1, best_err5
+    global args
 
     args = parser.parse_args()
 
+    if args.world_size > 1:
+        # one training process per device
+        mp.spawn(main_worker, nprocs=args.world_size, args=(args,))
+    else:
+        main_worker(0, args)
+
+
+def main_worker(rank, main_args):
+
+    global args, best_err1, best_err5, checkpoint_writer, step_profiler, metrics_sink, step_loss
+
+    args = main_args
+    args.rank = rank
+    args.distributed = args.world_size > 1
+
+    if args.distributed:
+        dist.init_process_group(args.dist_backend, init_method=args.dist_url,
+                                world_size=args.world_size, rank=rank)
+        if torch.device(args.device).type == 'cuda':
+            args.device = 'cuda:%d' % rank
+            torch.cuda.set_device(args.device)
+        # only the first process reports every iteration
+        args.verbose = args.verbose and rank == 0
+
+    train_loader, val_loader, numberofclass = make_loaders(args)
+    model = make_model(args, numberofclass)
+
+    if args.distributed:
+        model = model.to(args.device)
+        device_ids = [torch.device(args.device).index] if torch.device(args.device).type == 'cuda' else None
+        model = torch.nn.parallel.DistributedDataParallel(model, device_ids=device_ids)
+    else:
+        model = torch.nn.DataParallel(model).to(args.device)
+
+    #print(model)
+    #print('the number of model parameters: {}'.format(sum([p.data.nelement() for p in model.parameters()])))
+
+    criterion = nn.CrossEntropyLoss().to(args.device)
+
+    if args.profile_steps > 0 and args.rank == 0:
+        step_profiler = StepProfiler(args.profile_start, args.profile_steps,
+                                     'runs/%s/trace.json' % (args.expname), args.device)
+        if args.profile_modules:
+            step_profiler.attach(model)
+
+    if args.metrics_format != 'none' and args.rank == 0:
+        metrics_sink = MetricsSink('runs/%s/metrics' % (args.expname), args.metrics_format)
+
+    optimizer = make_optimizer(args, model)
+
+    step_loss = forward_loss
+    if args.compile:
+        step_loss = torch.compile(forward_loss, mode=args.compile_mode)
+
+    cudnn.benchmark = True
+
+    # every process draws its own augmentation randomness
+    mix_seed = None if args.mix_seed is None else args.mix_seed + rank
+    sampler = mixers.MixSampler(mix_seed, args.mix_per_sample)
+    # loss scaling is only needed for float16
+    scaler = torch.cuda.amp.GradScaler(enabled=args.precision == 'fp16')
+
+    start_epoch = 0
+    if args.resume is not None:
+        checkpoint = torch.load(args.resume, map_location='cpu')
+        model.load_state_dict(checkpoint['state_dict'])
+        optimizer.load_state_dict(checkpoint['optimizer'])
+        if 'scaler' in checkpoint:
+            scaler.load_state_dict(checkpoint['scaler'])
+        start_epoch = checkpoint['epoch'] + 1
+        best_err1 = checkpoint['best_err1']
+        best_err5 = checkpoint['best_err5']
+        print('=> resuming from', args.resume, 'at epoch', start_epoch)
+
+    for epoch in range(start_epoch, args.epochs):
+        
+        if hasattr(getattr(train_loader, 'sampler', None), 'set_epoch'):
+            # DistributedSampler and ShardSampler reshuffle every epoch
+            train_loader.sampler.set_epoch(epoch)
+
+        # train for one epoch
+        train_loss = train(train_loader, model, criterion, optimizer, epoch, sampler, scaler)
+
+        # evaluate on validation set
+        last_epoch = epoch == args.epochs - 1
+        stop = args.stop_epoch > 0 and epoch + 1 >= args.stop_epoch
+        is_best = False
+        if last_epoch or stop or (epoch + 1) % args.eval_every == 0:
+            full = last_epoch or stop or args.eval_subset <= 0
+            err1, err5, val_loss = validate(val_loader, model, criterion, epoch,
+                                            None if full else args.eval_subset)
+
+            # remember best prec@1 and save checkpoint
+            if full and err1 <= best_err1:
+                is_best = True
+                best_err1 = err1
+                best_err5 = err5
+
+        if args.rank == 0:
+            print('Current best accuracy (top-1 and 5 error):', best_err1, best_err5)
+            save_checkpoint({
+                'epoch': epoch,
+                'arch': args.net_type,
+                'state_dict': model.state_dict(),
+                'best_err1': best_err1,
+                'best_err5': best_err5,
+                'optimizer': optimizer.state_dict(),
+                'scaler': scaler.state_dict(),
+            }, is_best)
+
+        if stop and not last_epoch:
+            # an intermediate result (e.g. a rung of asha.py), resumed later with --resume
+            if args.rank == 0:
+                save_result({'epoch': epoch + 1, 'err1': err1, 'err5': err5,
+                             'best_err1': best_err1, 'best_err5': best_err5},
+                            'stop_%d.json' % (epoch + 1))
+            break
+    else:
+        if args.rank == 0:
+            print('Best accuracy (top-1 and 5 error):', best_err1, best_err5)
+            save_result({'best_err1': best_err1, 'best_err5': best_err5, 'epochs': args.epochs})
+
+    metrics_sink.close()
+
+    if checkpoint_writer is not None:
+        # wait for the last checkpoint to be committed
+        checkpoint_writer.close()
+        checkpoint_writer = None
+
+    if args.distributed:
+        dist.destroy_process_group()
+
+
+def make_loaders(args):
+    "Training and validation loaders of args.dataset, and its number of classes"
     if args.dataset.startswith('cifar'):
         normalize = transforms.Normalize(mean=[x / 255.0 for x in [125.3, 123.0, 113.9]],
                                             std=[x / 255.0 for x in [63.0, 62.1, 66.7]])
@@ -124,320 +349,168 @@ def main():
         ])
 
         if args.dataset == 'cifar100':
-            train_loader = torch.utils.data.DataLoader(
-                datasets.CIFAR100('../data', train=True, download=True, transform=transform_train),
-                batch_size=args.batch_size, shuffle=True, num_workers=args.workers, pin_memory=True)
-            val_loader = torch.utils.data.DataLoader(
-                datasets.CIFAR100('../data', train=False, transform=transform_test),
-                batch_size=args.batch_size, shuffle=True, num_workers=args.workers, pin_memory=True)
+            dataset_class = datasets.CIFAR100
             numberofclass = 100
         elif args.dataset == 'cifar10':
-            train_loader = torch.utils.data.DataLoader(
-                datasets.CIFAR10('../data',train=True, download=True, transform=transform_train),
-                batch_size=args.batch_size, shuffle=True, num_workers=args.workers, pin_memory=True)
-
-            val_loader = torch.utils.data.DataLoader(
-                        datasets.CIFAR10('../data', train=False, transform=transform_test),
-                        batch_size=args.batch_size, shuffle=True, num_workers=args.workers, pin_memory=True)
+            dataset_class = datasets.CIFAR10
             numberofclass = 10
         else:
             raise Exception('unknown dataset : {}'.format(args.dataset))
 
-    if args.net_type == 'resnet':
-        model = RN.ResNet(args.dataset, args.depth, numberofclass, args.bottleneck)
-    elif args.net_type == 'pyramidnet':
-        model = PYRM.PyramidNet(args.dataset, args.depth, args.alpha, numberofclass, args.bottleneck)
+        if args.shared_data is not None:
+            data_dir = args.shared_data
+        elif args.data_cache:
+            data_dir = cifar_cache(dataset_class, '../data', args.data_cache)
+        else:
+            data_dir = None
+
+        def make_dataset(train, transform=None):
+            if data_dir is not None:
+                return SharedCIFAR(data_dir, train=train, transform=transform)
+            return dataset_class('../data', train=train, download=train, transform=transform)
+
+        if args.device_loader and args.distributed:
+            raise Exception('--device_loader does not support distributed training')
+
+        if args.device_loader:
+            train_loader = DeviceCIFARLoader(
+                make_dataset(train=True),
+                args.batch_size, args.device, train=True, mean=normalize.mean, std=normalize.std)
+            val_loader = DeviceCIFARLoader(
+                make_dataset(train=False),
+                args.eval_batch_size, args.device, train=False, shuffle=False, mean=normalize.mean, std=normalize.std)
+        elif args.distributed:
+            train_set = make_dataset(train=True, transform=transform_train)
+            val_set = make_dataset(train=False, transform=transform_test)
+            train_sampler = torch.utils.data.distributed.DistributedSampler(train_set)
+            train_loader = torch.utils.data.DataLoader(
+                train_set, batch_size=args.batch_size, sampler=train_sampler,
+                num_workers=args.workers, pin_memory=True)
+            val_loader = torch.utils.data.DataLoader(
+                val_set, batch_size=args.eval_batch_size, shuffle=False, num_workers=args.workers, pin_memory=True,
+                sampler=SplitSampler(val_set, args.world_size, args.rank))
+        else:
+            train_loader = torch.utils.data.DataLoader(
+                make_dataset(train=True, transform=transform_train),
+                batch_size=args.batch_size, shuffle=True, num_workers=args.workers, pin_memory=True)
+            val_loader = torch.utils.data.DataLoader(
+                make_dataset(train=False, transform=transform_test),
+                batch_size=args.eval_batch_size, shuffle=False, num_workers=args.workers, pin_memory=True)
+    elif args.dataset == 'imagenet':
+        if args.device_loader:
+            raise Exception('--device_loader only supports CIFAR')
+        transform_train, transform_test = imagenet_transforms()
+        train_set = ShardedImageFolder(os.path.join(args.imagenet_dir, 'train'), transform_train)
+        val_set = ShardedImageFolder(os.path.join(args.imagenet_dir, 'val'), transform_test)
+        numberofclass = len(train_set.classes)
+        num_replicas = args.world_size if args.distributed else 1
+        # shard-ordered sampling keeps the reads of every worker sequential
+        train_loader = torch.utils.data.DataLoader(
+            train_set, batch_size=args.batch_size, num_workers=args.workers, pin_memory=True,
+            sampler=ShardSampler(train_set, num_replicas=num_replicas, rank=args.rank),
+            persistent_workers=args.workers > 0)
+        val_loader = torch.utils.data.DataLoader(
+            val_set, batch_size=args.eval_batch_size, num_workers=args.workers, pin_memory=True,
+            sampler=ShardSampler(val_set, shuffle=False, num_replicas=num_replicas, rank=args.rank))
     else:
-        raise Exception('unknown network architecture: {}'.format(args.net_type))
-
-
-    model = torch.nn.DataParallel(model).cuda()
-
-    #print(model)
-    #print('the number of model parameters: {}'.format(sum([p.data.nelement() for p in model.parameters()])))
-
-    criterion = nn.CrossEntropyLoss().cuda()
-
-    optimizer = optim.SGD(model.parameters(), args.lr, momentum=args.momentum, weight_decay=args.weight_decay, nesterov=True)
-
-    cudnn.benchmark = True
-
-    for epoch in range(0, args.epochs):
-        
-        adjust_learning_rate(optimizer, epoch)
-
-        # train for one epoch
-        train_loss = train(train_loader, model, criterion, optimizer, epoch)
+        raise Exception('unknown dataset : {}'.format(args.dataset))
 
-        # evaluate on validation set
-        err1, err5, val_loss = validate(val_loader, model, criterion, epoch)
+    return train_loader, val_loader, numberofclass
 
-        # remember best prec@1 and save checkpoint
-        is_best = err1 <= best_err1
-        best_err1 = min(err1, best_err1)
-        if is_best:
-            best_err5 = err5
 
-        print('Current best accuracy (top-1 and 5 error):', best_err1, best_err5)
-        save_checkpoint({
-            'epoch': epoch,
-            'arch': args.net_type,
-            'state_dict': model.state_dict(),
-            'best_err1': best_err1,
-            'best_err5': best_err5,
-            'optimizer': optimizer.state_dict(),
-        }, is_best)
+def make_model(args, numberofclass):
+    if args.net_type == 'resnet':
+        model = RN.ResNet(args.dataset, args.depth, numberofclass, args.bottleneck, args.checkpoint_blocks)
+    elif args.net_type == 'pyramidnet':
+        model = PYRM.PyramidNet(args.dataset, args.depth, args.alpha, numberofclass, args.bottleneck, args.checkpoint_blocks)
+    else:
+        raise Exception('unknown network architecture: {}'.format(args.net_type))
 
-    print('Best accuracy (top-1 and 5 error):', best_err1, best_err5)
+    return model
 
 
-def train(train_loader, model, criterion, optimizer, epoch):
+def train(train_loader, model, criterion, optimizer, epoch, sampler, scaler):
     
     batch_time = AverageMeter()
     data_time = AverageMeter()
-    losses = AverageMeter()
-    top1 = AverageMeter()
-    top5 = AverageMeter()
+    losses = DeviceAverageMeter()
+    top1 = DeviceAverageMeter()
+    top5 = DeviceAverageMeter()
 
     model.train()
 
     end = time.time()
-    current_LR = get_learning_rate(optimizer)[0]
+    mixer = mixers.get_mixer(args.process)
+    iterations = len(train_loader)
+    # DataParallel is not compiled, the compiled step runs the wrapped model on its device
+    net = model.module if args.compile and isinstance(model, nn.DataParallel) else model
+
+    def prepare(input, target):
+        # augment on the input's device
+        with step_profiler.phase('augment'):
+            input, mixed_target = mixer(input, target, args, sampler)
+        return input, target, mixed_target
+
+    def load(input, target):
+        with step_profiler.phase('h2d'):
+            input = input.to(args.device)
+            target = target.to(args.device)
+        return prepare(input, target)
+
+    if args.prefetch > 0:
+        batches = Prefetcher(train_loader, args.device, prepare=prepare, depth=args.prefetch)
+    else:
+        batches = (load(input, target) for input, target in train_loader)
 
-    for i, (input, target) in enumerate(train_loader):
-        # measure data loading time
+    for i, (input, target, mixed_target) in enumerate(batches):
+        # measure data loading time (transfer and augmentation included)
         data_time.update(time.time() - end)
 
-        input = input.cuda()
-        target = target.cuda()
-
-        if args.process == 'None':
-            # compute output
-            output = model(input)
-            loss = criterion(output, target)
-        elif args.process == 'cutout':
-            r = np.random.rand(1)
-            if args.beta > 0 and r < args.cutout_prob:
-                h = input.size()[2]
-                w = input.size()[3]
-
-                mask = np.ones((h, w), np.float32)
-
-                for n in range(args.cutout_n_holes):
-                    y = np.random.randint(h)
-                    x = np.random.randint(w)
-
-                    y1 = np.clip(y - args.cutout_length // 2, 0, h)
-                    y2 = np.clip(y + args.cutout_length // 2, 0, h)
-                    x1 = np.clip(x - args.cutout_length // 2, 0, w)
-                    x2 = np.clip(x + args.cutout_length // 2, 0, w)
-
-                    mask[y1: y2, x1: x2] = 0.
-
-                mask = torch.from_numpy(mask)
-                mask = mask.expand_as(input)
-                mask = mask.cuda()
-                input = input * mask
-
-                output = model(input)
-                loss = criterion(output, target)
-            else:
-                # compute output
-                output = model(input)
-                loss = criterion(output, target)    
-        elif args.process == 'mixup':
-            alpha = args.mixup_alpha
-            if alpha > 0:
-                lam = np.random.beta(alpha, alpha)
-            else:
-                lam = 1
-
-            batch_size = input.size()[0]
-            index = torch.randperm(batch_size).cuda()
-
-            input = lam * input + (1 - lam) * input[index, :]
-            
-            target_a = target
-            target_b = target[index]
-
-            inputs, targets_a, targets_b = map(Variable, (input, target_a, target_b))
-            output = model(input)
-            loss = lam * criterion(output, target_a) + (1 - lam) * criterion(output, target_b)
-
-        elif args.process == 'cutmix':
-            r = np.random.rand(1)
-            if args.beta > 0 and r < args.cutmix_prob:
-                # generate mixed sample
-                lam = np.random.beta(args.beta, args.beta)
-                rand_index = torch.randperm(input.size()[0]).cuda()
-                target_a = target
-                target_b = target[rand_index]
-                bbx1, bby1, bbx2, bby2 = rand_bbox(input.size(), lam)
-                input[:, :, bbx1:bbx2, bby1:bby2] = input[rand_index, :, bbx1:bbx2, bby1:bby2]
-                # adjust lambda to exactly match pixel ratio
-                lam = 1 - ((bbx2 - bbx1) * (bby2 - bby1) / (input.size()[-1] * input.size()[-2]))
-                # compute output
-                output = model(input)
-                loss = criterion(output, target_a) * lam + criterion(output, target_b) * (1. - lam)
-            else:
-                # compute output
-                output = model(input)
-                loss = criterion(output, target)
-        elif args.process == 'cutmixup':
-            r = np.random.rand(1)
-            alpha = args.cutmixup_alpha
-            if alpha > 0:
-                mixuplam = np.random.beta(alpha, alpha)
-            else:
-                mixuplam = 1
-
-            if args.beta > 0 and r < args.cutmixup_prob:
-                # generate mixed sample
-                cutmixlam = np.random.beta(args.beta, args.beta)
-                rand_index = torch.randperm(input.size()[0]).cuda()
-                target_a = target
-                target_b = target[rand_index]
-                bbx1, bby1, bbx2, bby2 = rand_bbox(input.size(), cutmixlam)
-                input[:, :, bbx1:bbx2, bby1:bby2] = mixuplam * input[:, :, bbx1:bbx2, bby1:bby2] + (1-mixuplam) * input[rand_index, :, bbx1:bbx2, bby1:bby2]
-                # adjust lambda to exactly match pixel ratio
-                cutmixlam = 1 - ((bbx2 - bbx1) * (bby2 - bby1) / (input.size()[-1] * input.size()[-2]))
-
-                inputs, targets_a, targets_b = map(Variable, (input, target_a, target_b))
-                # compute output
-                output = model(input)
-                loss = criterion(output, target_a) * (1. - (1. - cutmixlam) * (1. - mixuplam)) + criterion(output, target_b) * (1. - cutmixlam) * (1. - mixuplam)
-            else:
-                # compute output
-                output = model(input)
-                loss = criterion(output, target)
-        elif args.process == 'divmix':
-            r = np.random.rand(1)
-            if r < args.divmix_prob:
-                # generate mixed sample
-                rand_index1 = torch.randperm(input.size()[0]).cuda()
-                rand_index2 = torch.randperm(input.size()[0]).cuda()
-                rand_index3 = torch.randperm(input.size()[0]).cuda()
-                target_1 = target
-                target_2 = target[rand_index1]
-                target_3 = target[rand_index2]
-                target_4 = target[rand_index3]
-                h = input.size()[2]
-                w = input.size()[3]
-                input[:, :, w//2:w, 0:h//2] = input[rand_index1, :, w//2:w, 0:h//2]
-                input[:, :, 0:w//2, h//2:h] = input[rand_index2, :, 0:w//2, h//2:h]
-                input[:, :, w//2:w, h//2:h] = input[rand_index3, :, w//2:w, h//2:h]
-                # compute output
-                output = model(input)
-                loss = 0.25 * (criterion(output, target_1) + criterion(output, target_2) + criterion(output, target_3) + criterion(output, target_4) )
-            else:
-                # compute output
-                output = model(input)
-                loss = criterion(output, target)
-        elif args.process == 'aroundmix':
-            alpha = args.aroundmix_alpha
-            r = np.random.rand(1)
-            if r < args.aroundmix_prob:
-                h = input.size()[2]
-                w = input.size()[3]
-
-                inputi = copy.deepcopy(input)
-                inputi = inputi * (1 - alpha * 8)
-                inputi[:,:,0:w-1,:] = inputi[:,:,0:w-1,:] + alpha * input[:,:,1:w,:]
-                inputi[:,:,0:w-1,0:h-1] = inputi[:,:,0:w-1,0:h-1] + alpha * input[:,:,1:w,1:h]
-                inputi[:,:,:,0:h-1] = inputi[:,:,:,0:h-1] + alpha * input[:,:,:,1:h]
-                inputi[:,:,1:w,0:h-1] = inputi[:,:,1:w,0:h-1] + alpha * input[:,:,0:w-1,1:h]
-                inputi[:,:,1:w,:] = inputi[:,:,1:w,:] + alpha * input[:,:,0:w-1,:]
-                inputi[:,:,1:w,1:h] = inputi[:,:,1:w,1:h] + alpha * input[:,:,0:w-1,0:h-1]
-                inputi[:,:,:,1:h] = inputi[:,:,:,1:h] + alpha * input[:,:,:,0:h-1]
-                inputi[:,:,0:w-1,1:h] = inputi[:,:,0:w-1,1:h] + alpha * input[:,:,1:w,0:h-1]
-                input = inputi
-
-                output = model(input)
-                loss = criterion(output, target)
-            else :
-                output = model(input)
-                loss = criterion(output, target)
-        elif args.process == 'fademixup':
-
-            alpha = args.fademixup_alpha
-            if alpha > 0:
-                lam = np.random.beta(alpha, alpha)
+        adjust_learning_rate(optimizer, epoch, i, iterations)
+        current_LR = get_learning_rate(optimizer)[0]
+        # the optimizer steps after every accum_steps batches and at the end of the epoch
+        update = (i + 1) % args.accum_steps == 0 or i + 1 == iterations
+        group_size = accumulation_group_size(i, iterations)
+
+        # compute output
+        with autocast():
+            if args.compile:
+                # the forward pass and the loss are one compiled graph
+                with step_profiler.phase('forward'):
+                    output, loss = step_loss(net, input, mixed_target)
             else:
-                lam = 1
-
-            batch_size = input.size()[0]
-            index = torch.randperm(batch_size).cuda()
-            h, w = input.size()[2], input.size()[3]
-            shorter = min(h,w)
-            lam_unit = lam / ((1/6) * (shorter/2) * (shorter/2 + 1) * (shorter/2 - 4))
-            for i in range(shorter//2):
-                w_i = (i*w)//shorter
-                w_next = ((i+1)*w)//shorter
-                h_i = (i*h)//shorter
-                h_next = ((i+1)*h)//shorter
-                lam_i = i * lam_unit
-                input[:,:,w_i:w-w_i,h_i:h-h_i-1] = (1-lam_i) * input[:,:,w_i:w-w_i,h_i:h-h_i-1] + lam_i * input[:,:,w_i:w-w_i,h_i:h-h_i-1]
-                input[:,:,w-w_next:w-w_i,h_i+1:h-h_i] = (1-lam_i) * input[:,:,w-w_next:w-w_i,h_i+1:h-h_i] + lam_i * input[:,:,w-w_next:w-w_i,h_i+1:h-h_i]
-                input[:,:,w_i+1:w-w_i,h_i:h_next] = (1-lam_i) * input[:,:,w_i+1:w-w_i,h_i:h_next] + lam_i * input[:,:,w_i+1:w-w_i,h_i:h_next]
-                input[:,:,w_i:w-w_i-1,h-h_next:h-h_i] = (1-lam_i) * input[:,:,w_i:w-w_i-1,h-h_next:h-h_i] + lam_i * input[:,:,w_i:w-w_i-1,h-h_next:h-h_i]
-
-            target_a = target
-            target_b = target[index]
-
-            inputs, targets_a, targets_b = map(Variable, (input, target_a, target_b))
-            output = model(input)
-            loss = (1-lam) * criterion(output, target_a) + lam * criterion(output, target_b)
-        elif args.process == 'softcutout':
-            r = np.random.rand(1)
-            alpha = args.softcutout_alpha
-            if args.beta > 0 and r < args.softcutout_prob:
-                h = input.size()[2]
-                w = input.size()[3]
-
-                mask = np.ones((h, w), np.float32)
-
-                for n in range(args.cutout_n_holes):
-                    y = np.random.randint(h)
-                    x = np.random.randint(w)
-
-                    y1 = np.clip(y - args.softcutout_length // 2, 0, h)
-                    y2 = np.clip(y + args.softcutout_length // 2, 0, h)
-                    x1 = np.clip(x - args.softcutout_length // 2, 0, w)
-                    x2 = np.clip(x + args.softcutout_length // 2, 0, w)
-
-                    mask[y1: y2, x1: x2] = alpha
-
-                mask = torch.from_numpy(mask)
-                mask = mask.expand_as(input)
-                mask = mask.cuda()
-                input = input * mask
-
-                output = model(input)
-                loss = criterion(output, target)
-            else:
-                # compute output
-                output = model(input)
-                loss = criterion(output, target)    
-        
-        else:
-            raise Exception('unknown data augmentation process: {}'.format(args.process))
+                with step_profiler.phase('forward'):
+                    output = model(input)
+                with step_profiler.phase('loss'):
+                    loss = mixers.mixed_loss(output, mixed_target)
 
         # measure accuracy and record loss
         err1, err5 = accuracy(output.data, target, topk=(1,5))
 
-        losses.update(loss.item(), input.size(0))
-        top1.update(err1.item(), input.size(0))
-        top5.update(err5.item(), input.size(0))
+        losses.update(loss, input.size(0))
+        top1.update(err1, input.size(0))
+        top5.update(err5, input.size(0))
 
         # compute gradient and do SGD step
-        optimizer.zero_grad()
-        loss.backward()
-        optimizer.step()
+        with step_profiler.phase('backward'):
+            # DistributedDataParallel only all-reduces the gradients of the last accumulated batch
+            with model.no_sync() if args.distributed and not update else contextlib.nullcontext():
+                scaler.scale(loss / group_size).backward()
+        if update:
+            with step_profiler.phase('step'):
+                scaler.step(optimizer)
+                scaler.update()
+                optimizer.zero_grad(set_to_none=True)
+        step_profiler.step()
 
         # measure elapsed time
         batch_time.update(time.time() - end)
         end = time.time()
 
+        metrics_sink.log('step', epoch=epoch, iteration=i, lr=current_LR, loss=loss, err1=err1, err5=err5,
+                         data_time=data_time.val, batch_time=batch_time.val,
+                         samples_per_sec=input.size(0) / batch_time.val)
+
         if i % args.print_freq == 0 and args.verbose == True:
             print('Epoch: [{0}/{1}][{2}/{3}]\t'
                   'LR: {LR:.6f}\t'
@@ -449,81 +522,100 @@ def train(train_loader, model, criterion, optimizer, epoch):
                 epoch, args.epochs, i, len(train_loader), LR=current_LR, batch_time=batch_time,
                 data_time=data_time, loss=losses, top1=top1, top5=top5))
 
-    print('* Epoch: [{0}/{1}]\t Top 1-err {top1.avg:.3f}  Top 5-err {top5.avg:.3f}\t Train Loss {loss.avg:.3f}'.format(
-        epoch, args.epochs, top1=top1, top5=top5, loss=losses))
-
-    return losses.avg
-
-
-def rand_bbox(size, lam):
-    W = size[2]
-    H = size[3]
-    cut_rat = np.sqrt(1. - lam)
-    cut_w = np.int(W * cut_rat)
-    cut_h = np.int(H * cut_rat)
+    if args.rank == 0:
+        print('* Epoch: [{0}/{1}]\t Top 1-err {top1.avg:.3f}  Top 5-err {top5.avg:.3f}\t Train Loss {loss.avg:.3f}'.format(
+            epoch, args.epochs, top1=top1, top5=top5, loss=losses))
 
-    # uniform
-    cx = np.random.randint(W)
-    cy = np.random.randint(H)
+    metrics_sink.log('train', epoch=epoch, lr=get_learning_rate(optimizer)[0], loss=losses.avg, err1=top1.avg, err5=top5.avg,
+                     data_time=data_time.avg, batch_time=batch_time.avg,
+                     samples_per_sec=losses.count / batch_time.sum if batch_time.sum > 0 else 0.)
 
-    bbx1 = np.clip(cx - cut_w // 2, 0, W)
-    bby1 = np.clip(cy - cut_h // 2, 0, H)
-    bbx2 = np.clip(cx + cut_w // 2, 0, W)
-    bby2 = np.clip(cy + cut_h // 2, 0, H)
-
-    return bbx1, bby1, bbx2, bby2
+    return losses.avg
 
 
-def validate(val_loader, model, criterion, epoch):
+def validate(val_loader, model, criterion, epoch, max_samples=None):
     batch_time = AverageMeter()
-    losses = AverageMeter()
-    top1 = AverageMeter()
-    top5 = AverageMeter()
+    losses = DeviceAverageMeter()
+    top1 = DeviceAverageMeter()
+    top5 = DeviceAverageMeter()
 
     # switch to evaluate mode
     model.eval()
 
+    if args.prefetch > 0:
+        batches = Prefetcher(val_loader, args.device, depth=args.prefetch)
+    else:
+        batches = val_loader
+
     end = time.time()
-    for i, (input, target) in enumerate(val_loader):
-        target = target.cuda()
+    with torch.inference_mode():
+        for i, (input, target) in enumerate(batches):
+            input = input.to(args.device, non_blocking=True)
+            target = target.to(args.device, non_blocking=True)
 
-        output = model(input)
-        loss = criterion(output, target)
+            with autocast():
+                output = model(input)
+                loss = criterion(output, target)
 
-        # measure accuracy and record loss
-        err1, err5 = accuracy(output.data, target, topk=(1, 5))
+            # measure accuracy and record loss
+            err1, err5 = accuracy(output, target, topk=(1, 5))
 
-        losses.update(loss.item(), input.size(0))
+            losses.update(loss, input.size(0))
 
-        top1.update(err1.item(), input.size(0))
-        top5.update(err5.item(), input.size(0))
+            top1.update(err1, input.size(0))
+            top5.update(err5, input.size(0))
 
-        # measure elapsed time
-        batch_time.update(time.time() - end)
-        end = time.time()
+            # measure elapsed time
+            batch_time.update(time.time() - end)
+            end = time.time()
 
-        if i % args.print_freq == 0 and args.verbose == True:
-            print('Test (on val set): [{0}/{1}][{2}/{3}]\t'
-                  'Time {batch_time.val:.3f} ({batch_time.avg:.3f})\t'
-                  'Loss {loss.val:.4f} ({loss.avg:.4f})\t'
-                  'Top 1-err {top1.val:.4f} ({top1.avg:.4f})\t'
-                  'Top 5-err {top5.val:.4f} ({top5.avg:.4f})'.format(
-                epoch, args.epochs, i, len(val_loader), batch_time=batch_time, loss=losses,
-                top1=top1, top5=top5))
+            if i % args.print_freq == 0 and args.verbose == True:
+                print('Test (on val set): [{0}/{1}][{2}/{3}]\t'
+                      'Time {batch_time.val:.3f} ({batch_time.avg:.3f})\t'
+                      'Loss {loss.val:.4f} ({loss.avg:.4f})\t'
+                      'Top 1-err {top1.val:.4f} ({top1.avg:.4f})\t'
+                      'Top 5-err {top5.val:.4f} ({top5.avg:.4f})'.format(
+                    epoch, args.epochs, i, len(val_loader), batch_time=batch_time, loss=losses,
+                    top1=top1, top5=top5))
+
+            # fast evaluation on a fixed prefix of the (sequential) test set
+            if max_samples is not None and losses.count >= max_samples:
+                break
+
+    if args.distributed:
+        # combine the validation shards of all processes
+        for meter in (losses, top1, top5):
+            meter.all_reduce(args.device)
+
+    if args.rank == 0:
+        print('* Epoch: [{0}/{1}]\t Top 1-err {top1.avg:.3f}  Top 5-err {top5.avg:.3f}\t Test Loss {loss.avg:.3f}'.format(
+            epoch, args.epochs, top1=top1, top5=top5, loss=losses))
+    metrics_sink.log('val', epoch=epoch, loss=losses.avg, err1=top1.avg, err5=top5.avg, samples=losses.count,
+                     full=max_samples is None, samples_per_sec=losses.count / batch_time.sum if batch_time.sum > 0 else 0.)
 
-    print('* Epoch: [{0}/{1}]\t Top 1-err {top1.avg:.3f}  Top 5-err {top5.avg:.3f}\t Test Loss {loss.avg:.3f}'.format(
-        epoch, args.epochs, top1=top1, top5=top5, loss=losses))
     return top1.avg, top5.avg, losses.avg
 
 
 def save_checkpoint(state, is_best, filename='checkpoint.pth.tar'):
+    global checkpoint_writer
+    if checkpoint_writer is None:
+        checkpoint_writer = CheckpointWriter(args.max_pending_saves)
     directory = "runs/%s/" % (args.expname)
     if not os.path.exists(directory):
         os.makedirs(directory)
     filename = directory + filename
-    torch.save(state, filename)
-    if is_best:
-        shutil.copyfile(filename, 'runs/%s/' % (args.expname) + 'model_best.pth.tar')
+    best_filename = directory + 'model_best.pth.tar' if is_best else None
+    checkpoint_writer.save(state, filename, best_filename)
+
+
+def save_result(result, filename='result.json'):
+    "Writes the final result of the run, which marks it as finished for sweep.py"
+    directory = "runs/%s/" % (args.expname)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(directory + filename + '.tmp', 'w') as f:
+        json.dump(result, f)
+    os.replace(directory + filename + '.tmp', directory + filename)
 
 
 class AverageMeter(object):
@@ -545,20 +637,122 @@ class AverageMeter(object):
         self.avg = self.sum / self.count
 
 
-def adjust_learning_rate(optimizer, epoch):
-    """Sets the learning rate to the initial LR decayed by 10 every 30 epochs"""
-    if args.dataset.startswith('cifar'):
-        lr = args.lr * (0.1 ** (epoch // (args.epochs * 0.5))) * (0.1 ** (epoch // (args.epochs * 0.75)))
+class DeviceAverageMeter(object):
+    """AverageMeter for device tensors: the running sum stays on the device
+    and is only read back (synchronizing) when val, sum or avg is accessed"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._val = 0
+        self._sum = 0
+        self.count = 0
+
+    def update(self, val, n=1):
+        self._val = val.detach()
+        self._sum = self._sum + self._val * n
+        self.count += n
+
+    @property
+    def val(self):
+        return float(self._val)
+
+    @property
+    def sum(self):
+        return float(self._sum)
+
+    @property
+    def avg(self):
+        # 0 before the first update, like AverageMeter (e.g. a rank without samples)
+        return self.sum / self.count if self.count else 0.
+
+    def all_reduce(self, device):
+        "Sums the running totals over all distributed processes"
+        total = torch.tensor([self.sum, self.count], dtype=torch.float64, device=device)
+        dist.all_reduce(total)
+        self._sum = total[0]
+        self.count = int(total[1])
+
+
+class SplitSampler(torch.utils.data.Sampler):
+    """Sequential evaluation sampler of one distributed process.
+
+    The dataset is split into contiguous parts, one per process, without the
+    padding of DistributedSampler, so that every sample is evaluated exactly
+    once; the parts may differ in length by one.
+    """
+
+    def __init__(self, dataset, num_replicas, rank):
+        self.begin = len(dataset) * rank // num_replicas
+        self.end = len(dataset) * (rank + 1) // num_replicas
+
+    def __iter__(self):
+        return iter(range(self.begin, self.end))
+
+    def __len__(self):
+        return self.end - self.begin
+
+
+def forward_loss(model, input, mixed_target):
+    "Output and mixed-target loss of a training step, captured as one graph by --compile"
+    output = model(input)
+    return output, mixers.mixed_loss(output, mixed_target)
+
+
+def make_optimizer(args, model):
+    if args.optimizer == 'lars':
+        return LARS(lars_param_groups(model, args.weight_decay), args.lr, momentum=args.momentum,
+                    eta=args.lars_eta, nesterov=True)
+    return optim.SGD(model.parameters(), args.lr, momentum=args.momentum, weight_decay=args.weight_decay, nesterov=True)
+
+
+def base_learning_rate():
+    "--lr, scaled linearly by the effective batch size when --base_batch_size is given"
+    if args.base_batch_size <= 0:
+        return args.lr
+    world_size = args.world_size if args.distributed else 1
+    return args.lr * args.batch_size * args.accum_steps * world_size / args.base_batch_size
+
+
+def accumulation_group_size(iteration, iterations):
+    "Number of batches accumulated into the optimizer step of iteration, fewer than --accum_steps at the end of an epoch"
+    begin = iteration - iteration % args.accum_steps
+    return min(args.accum_steps, iterations - begin)
+
+
+def adjust_learning_rate(optimizer, epoch, iteration=0, iterations=1):
+    """Sets the learning rate of iteration of epoch (out of iterations per epoch):
+    the step rule decays the initial LR by 10 at fixed epochs, cosine anneals
+    it to 0 over all epochs; both after the linear warmup of --warmup_epochs"""
+    lr = base_learning_rate()
+    progress = epoch + float(iteration) / iterations
+    if args.lr_schedule == 'cosine':
+        lr = 0.5 * lr * (1 + math.cos(math.pi * progress / args.epochs))
+    elif args.dataset.startswith('cifar'):
+        lr = lr * (0.1 ** (epoch // (args.epochs * 0.5))) * (0.1 ** (epoch // (args.epochs * 0.75)))
     elif args.dataset == ('imagenet'):
         if args.epochs == 300:
-            lr = args.lr * (0.1 ** (epoch // 75))
+            lr = lr * (0.1 ** (epoch // 75))
         else:
-            lr = args.lr * (0.1 ** (epoch // 30))
+            lr = lr * (0.1 ** (epoch // 30))
+
+    if progress < args.warmup_epochs:
+        lr = lr * (epoch * iterations + iteration + 1) / (args.warmup_epochs * iterations)
 
     for param_group in optimizer.param_groups:
         param_group['lr'] = lr
 
 
+def autocast():
+    "Autocast context for --precision on --device, a no-op for fp32"
+    if args.precision == 'fp32':
+        # a disabled CPU autocast still rejects float32 as its dtype
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=torch.device(args.device).type,
+                          dtype=PRECISIONS[args.precision])
+
+
 def get_learning_rate(optimizer):
     lr = []
     for param_group in optimizer.param_groups:
@@ -567,19 +761,13 @@ def get_learning_rate(optimizer):
 
 
 def accuracy(output, target, topk=(1,)):
-    """Computes the precision@k for the specified values of k"""
+    """Computes the error@k for the specified values of k"""
     maxk = max(topk)
     batch_size = target.size(0)
 
     _, pred = output.topk(maxk, 1, True, True)
-    pred = pred.t()
-    correct = pred.eq(target.view(1, -1).expand_as(pred))
-
-    res = []
-    for k in topk:
-        #correct_k = correct[:k].view(-1).float().sum(0, keepdim=True)
-        correct_k = correct[:k].reshape(-1).float().sum(0, keepdim=True)
-        wrong_k = batch_size - correct_k
-        res.append(wrong_k.mul_(100.0 / batch_size))
+    # hits[j] counts the samples whose target is within the top j+1 predictions
+    hits = pred.eq(target.view(-1, 1)).sum(0).cumsum(0)
+    err = (batch_size - hits.float()).mul_(100.0 / batch_size)
 
-    return res
\ No newline at end of file
+    return [err[k - 1] for k in topk]